@@ -13,15 +13,21 @@ import pprint
 import re
 import sys
 from genreml.model.processing.audio import AudioFile
-from genreml.model.processing.audio_features import SpectrogramGenerator
+from genreml.model.processing.audio_features import LibrosaFeatureGenerator, SpectrogramGenerator
+from genreml.model.processing.cache import FeatureCache
+from genreml.model.processing.pcm import decode_pcm, is_pcm
+from genreml.model.processing.spectral import SpectralEngine
 from PIL import Image
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 import audio_classifier as classy
+from compute import run_cpu, shutdown_executors
 
 
 app = Quart(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024
+# audio sent as the raw file with a signature of its digest instead of base64 in signed json
+AUDIO_CONTENT_TYPE = 'application/octet-stream'
 
 
 class app_state:
@@ -29,6 +35,8 @@ class app_state:
         self.loop = loop
         self.signer = itsdangerous.Signer(os.environ['SIGNING_TOKEN'])
         self.serializer = itsdangerous.Serializer(os.environ['SIGNING_TOKEN'])
+        # features already extracted from the same audio are served from here instead of being extracted again
+        self.feature_cache = FeatureCache(directory=os.environ.get('GENREML_CACHE_DIR', '/opt/cache'))
 
 
 # simple logging snippet from https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
@@ -41,20 +49,51 @@ async def test_server():
     return jsonify({'msg': 'server up'})
 
 
-async def get_features(file_location):
+def read_audio_upload(req_data):
+    # returns the audio, its extension and its sha256 digest or None if the request has no audio
+    if request.mimetype == AUDIO_CONTENT_TYPE:
+        data_hash = hashlib.sha256(req_data).hexdigest()
+        if APP_STATE.signer.unsign(request.headers.get('X-Genreml-Signature', '')).decode('utf-8') != data_hash:
+            raise itsdangerous.BadSignature('audio does not match its signature')
+        return (req_data, request.headers.get('X-Genreml-Ext', 'music_file'), data_hash)
+    req_json = APP_STATE.serializer.loads(req_data)
+    if 'data' not in req_json or 'ext' not in req_json:
+        return None
+    raw_data = base64.b64decode(req_json['data'])
+    return (raw_data, req_json['ext'], hashlib.sha256(raw_data).hexdigest())
+
+
+def load_audio(raw_data, upload_path, **kwargs):
+    # decoded clips from the frontend are used as they are without decoding or resampling them again,
+    # wav and the other formats libsndfile reads are decoded straight from memory
+    # and the rest (mp3) go through audioread which needs a file on disk
+    if is_pcm(raw_data):
+        return decode_pcm(raw_data)
+    try:
+        return librosa.load(io.BytesIO(raw_data), **kwargs)
+    except Exception:
+        pass
+    with open(upload_path, 'wb') as f:
+        f.write(raw_data)
+    try:
+        return librosa.load(upload_path, **kwargs)
+    finally:
+        os.remove(upload_path)
+
+
+def get_features(raw_data, upload_path):
     try:
         # af extraction
-        audio_signal, sample_rate = librosa.load(file_location)
+        audio_signal, sample_rate = load_audio(raw_data, upload_path)
         song_class = classy.Song()
         ds = song_class._Song__get_features(audio_signal, sample_rate)
         test_hashes = {'72e8250037da01f3b3695b3617ae1dd7', 'be7b6b0bd584a7ac62e4d2ef620eea09'}
         if 'TEST_FLAG' in os.environ and os.environ['TEST_FLAG'] == 'true':
             try:
-                with open(file_location, 'rb') as f:
-                    th = hashlib.md5(f.read()).hexdigest()
-                    if th in test_hashes:
-                        eprint(th)
-                        eprint(ds.to_json())
+                th = hashlib.md5(raw_data).hexdigest()
+                if th in test_hashes:
+                    eprint(th)
+                    eprint(ds.to_json())
             except Exception as ex:
                 eprint('failed on test sample code')
                 eprint(ex)
@@ -69,39 +108,28 @@ async def get_features(file_location):
 @app.route('/requestfeatures', methods=['POST'])
 async def generate_features():
     global APP_STATE
-    cleanup_paths = []
-    def cleanup_files():
-        for path in cleanup_paths:
-            try:
-                if os.path.isfile(path):
-                    os.remove(path)
-            except Exception as ex:
-                eprint(str(ex))
-                pass
     req_data = await request.get_data()
     try:
-        req_json = APP_STATE.serializer.loads(req_data)
+        upload = read_audio_upload(req_data)
     except Exception as ex:
         eprint(str(ex))
-        cleanup_files()
         return jsonify({
             'msg': 'payload did not have valid signature',
             'ex': str(ex)
             })
-    if 'data' in req_json and 'ext' in req_json:
-        data = req_json['data']
+    if upload is not None:
+        raw_data, ext, data_hash = upload
         # this will be audio
         try:
-            raw_data = base64.b64decode(data)
-            data_hash = hashlib.sha256(raw_data).hexdigest()
-            upload_path = data_hash+'.'+req_json['ext']
-            with open(upload_path, 'wb') as f:
-                f.write(raw_data)
-            cleanup_paths.append(upload_path)
-            features = await get_features(upload_path)
+            cache_key = APP_STATE.feature_cache.make_key(data_hash, "song_features")
+            cached_features = APP_STATE.feature_cache.get(cache_key)
+            if cached_features is not None:
+                return cached_features
+            # extraction runs in the compute process pool so the event loop keeps answering requests
+            features = await run_cpu(get_features, raw_data, data_hash+'.'+ext)
             if features[0] is True:
                 return_data = features[1]
-                cleanup_files()
+                APP_STATE.feature_cache.put(cache_key, return_data)
                 return return_data
             else:
                 eprint(str(features[1]))
@@ -117,12 +145,86 @@ async def generate_features():
                 'ex': str(ex)
             }
             pass
-        cleanup_files()
         return jsonify(return_data)
-    cleanup_files()
     return jsonify({'msg':'something went wrong'})
 
 
+def render_model_image(spectrogram_data):
+    # renders the spectrogram the way the spectrogram service does and applies the crop
+    # the predictor makes to that image so the result goes into the model as it is
+    fig = plt.figure(frameon=False)
+    ax = plt.Axes(fig, [0., 0., 1., 1.])
+    ax.set_axis_off()
+    fig.add_axes(ax)
+    ax.imshow(spectrogram_data, aspect='auto', cmap='Greys')
+    image_file = io.BytesIO()
+    fig.savefig(image_file, format='png')
+    plt.close(fig)
+    image_file.seek(0)
+    img = Image.open(image_file).convert('L')
+    # the crop and resize of the spectrogram service's model input image
+    img = img.crop((55, 50, 390, 250)).resize((classy.IMG_WIDTH, classy.IMG_HEIGHT))
+    # and the crop and resize the predictor applies to that image again
+    img = img.crop((55, 50, 390, 250)).resize((classy.IMG_WIDTH, classy.IMG_HEIGHT))
+    return np.array(img, dtype=np.uint8)
+
+
+def analyze_clip(raw_data, upload_path):
+    # one decode and one stft give the predictor both of its model inputs
+    audio_signal, sample_rate = load_audio(raw_data, upload_path)
+    spectral_engine = SpectralEngine(audio_signal, sample_rate)
+    features, _ = LibrosaFeatureGenerator(audio_signal, sample_rate, spectral_engine=spectral_engine).generate()
+    features_sorted = np.array([[features[col] for col in classy.FEATURE_COLS]])
+    scaled_features = classy.ModelBundle.get().scaler.transform(features_sorted)[0]
+    # the spectrogram service only draws the first MIN_CLIP_LENGTH seconds
+    clip_length = int(classy.MIN_CLIP_LENGTH * sample_rate)
+    if len(audio_signal) > clip_length:
+        audio_signal = audio_signal[:clip_length]
+        spectral_engine = SpectralEngine(audio_signal, sample_rate)
+    spectrogram = SpectrogramGenerator(audio_signal, sample_rate, spectral_engine=spectral_engine)
+    image = render_model_image(spectrogram._create_spectrogram_data())
+    return {
+        'scaled_features': [float(feature) for feature in scaled_features],
+        'image': base64.b64encode(image.tobytes()).decode('utf-8'),
+        'image_shape': list(image.shape)
+    }
+
+
+# the predictor gets its scaled features and model image from one request instead of
+# sending the clip to both this service and the spectrogram service
+@app.route('/analyze', methods=['POST'])
+async def analyze():
+    global APP_STATE
+    req_data = await request.get_data()
+    try:
+        upload = read_audio_upload(req_data)
+    except Exception as ex:
+        eprint(str(ex))
+        return jsonify({
+            'msg': 'payload did not have valid signature',
+            'ex': str(ex)
+            })
+    if upload is None:
+        return jsonify({'msg':'something went wrong'})
+    raw_data, ext, data_hash = upload
+    try:
+        # keyed on the scaler's contents so replacing the scaler file never serves features scaled with the old one
+        cache_key = APP_STATE.feature_cache.make_key(
+            data_hash, "model_input", scaler_hash=classy.ModelBundle.get().scaler_hash)
+        analysis = APP_STATE.feature_cache.get(cache_key)
+        if analysis is None:
+            analysis = await run_cpu(analyze_clip, raw_data, data_hash+'.'+ext)
+            APP_STATE.feature_cache.put(cache_key, analysis)
+        return jsonify(analysis)
+    except Exception as ex:
+        eprint('clip analysis failed')
+        eprint(str(ex))
+        return jsonify({
+            'msg': 'clip analysis failed',
+            'ex': str(ex)
+        })
+
+
 @app.route('/restartsignal', methods=['POST'])
 async def restart_signal():
     global APP_STATE
@@ -143,3 +245,8 @@ async def start():
     global APP_STATE
     event_loop = asyncio.get_event_loop()
     APP_STATE = app_state(event_loop)
+
+
+@app.after_serving
+async def stop():
+    shutdown_executors()
@@ -1,4 +1,4 @@
-from collections import Counter
+from collections import Counter, OrderedDict
 from functools import reduce
 from keras import models
 from sklearn.preprocessing import LabelEncoder
@@ -27,6 +27,8 @@ import matplotlib.image as mpimg
 import tensorflow as tf
 from PIL import Image
 import audio_classifier as classy
+from compute import run_inference, shutdown_executors
+from service_client import close_services, get_service
 import datetime
 import random
 import decimal
@@ -41,6 +43,13 @@ def get_timestamp_seed():
 
 
 random.seed(get_timestamp_seed())
+# audio is sent to the feature and spectrogram services as the raw file with a signature of its digest
+AUDIO_CONTENT_TYPE = 'application/octet-stream'
+# how many clips are leased from the frontend at once; they're analyzed concurrently and run through the model
+# as one batch while the next lease is fetched
+LEASE_SIZE = int(os.environ.get('GENREML_LEASE_SIZE', '8'))
+# how many times a result is posted back before it's left for the lease to run out
+POST_ATTEMPTS = 5
 
 
 class app_state:
@@ -54,9 +63,26 @@ class app_state:
         self.serializer = itsdangerous.Serializer(os.environ['SIGNING_TOKEN'])
         self.model_hash = os.environ['GENREML_MODEL_HASH']
         self.model_path = self.get_model_path(self.model_hash)
+        # model and scaler are loaded on first use and then shared by every prediction
+        self.model_bundle = classy.ModelBundle.get(self.model_path)
+        # predictions already made for the same clip and model are served from here instead of running the model
+        self.prediction_cache = OrderedDict()
+        self.prediction_cache_size = int(os.environ.get('GENREML_PREDICTION_CACHE_SIZE', '1024'))
         if not self.check_model_hash(self.model_hash) is True:
             eprint("model not found during init")
 
+    def get_cached_prediction(self, cache_key):
+        if cache_key not in self.prediction_cache:
+            return None
+        self.prediction_cache.move_to_end(cache_key)
+        return self.prediction_cache[cache_key]
+
+    def cache_prediction(self, cache_key, prediction):
+        self.prediction_cache[cache_key] = prediction
+        self.prediction_cache.move_to_end(cache_key)
+        while len(self.prediction_cache) > self.prediction_cache_size:
+            self.prediction_cache.popitem(last=False)
+
     def get_model_path(self, model_hash):
         return "/".join([self.model_dir, model_hash])+".h5"
 
@@ -96,6 +122,28 @@ def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, flush=True, **kwargs)
 
 
+async def get_work_audio(item):
+    # older frontends inline the clip as base64 and newer ones hand out a reference to it that's
+    # either a path on a store shared with this container or a signed url on the frontend
+    if 'data' in item:
+        return base64.b64decode(item.pop('data'))
+    if os.environ.get('GENREML_SHARED_STORE') == 'true' and os.path.isfile(item.get('path', '')):
+        with open(item['path'], 'rb') as f:
+            return f.read()
+    blob = await get_service('frontend').get(item['blob'], timeout=60.0)
+    blob.raise_for_status()
+    return blob.content
+
+
+def get_audio_upload_headers(raw_data, ext):
+    # only the digest is signed so multi-megabyte bodies aren't serialized to be signed
+    return {
+        'Content-Type': AUDIO_CONTENT_TYPE,
+        'X-Genreml-Ext': ext,
+        'X-Genreml-Signature': APP_STATE.signer.sign(hashlib.sha256(raw_data).hexdigest()).decode('utf-8')
+    }
+
+
 async def feature_spectrogram_uploads(work):
     global APP_STATE
     if 'work' not in work:
@@ -111,148 +159,113 @@ async def feature_spectrogram_uploads(work):
         ext = work['ext']
     else:
         ext = 'music_file'
-    raw_data = base64.b64decode(item['data'])
-    del(item['data'])
     del(work['item'])
-    song_upload = {
-        'ext': ext,
-        'data': base64.b64encode(raw_data).decode('utf-8'),
-    }
-    async with httpx.AsyncClient() as client:
-        features = APP_STATE.loop.create_task(client.post(get_srv_record_url('GENREML_FEATURES_PORT', 'GENREML_FEATURES_ADDRESS', 'GENREML_FEATURES_SCHEMA', False)+'/requestfeatures', data=APP_STATE.serializer.dumps(song_upload), timeout=600.0))
-        spectrograms = APP_STATE.loop.create_task(client.post(get_srv_record_url('GENREML_SPECTRO_PORT', 'GENREML_SPECTRO_ADDRESS', 'GENREML_SPECTRO_SCHEMA', False)+'/melspectrogram', data=APP_STATE.serializer.dumps(song_upload), timeout=600.0))
-        while features.done() is False or spectrograms.done() is False:
-            await asyncio.sleep(0.2)
-        features = await features
-        spectrograms = await spectrograms
-        try:
-            spectrograms.raise_for_status()
-            features.raise_for_status()
-            features = features.json()
-            if 'msg' in features:
-                eprint(features['msg'])
-            if 'ex' in features:
-                eprint('problem with clip features request')
-                eprint(features['ex'])
-                return (False, dict(), dict(), dict())
-            spectrograms = spectrograms.json()
-            if 'msg' in spectrograms:
-                eprint(spectrograms['ex'])
-            if 'ex' in spectrograms:
-                eprint('problem with clip spectrograms request')
-                eprint(spectrograms['ex'])
-                return (False, dict(), dict(), dict())
-            spectrogram = base64.b64decode(spectrograms['image'])
-            return (True, features, spectrogram, item, hashlib.md5(raw_data).hexdigest())
-        except Exception as ex:
-            eprint("failure in spectrogram and feature parsing after return from api calls")
-            eprint(str(ex))
-            return (False, dict(),dict(), dict())
+    return await analyze_work_item(item, ext)
+
+
+async def analyze_work_item(item, ext='music_file'):
+    global APP_STATE
+    try:
+        raw_data = await get_work_audio(item)
+    except Exception as ex:
+        eprint("failure fetching clip audio")
+        eprint(str(ex))
+        return (False, dict(), dict(), dict())
+    try:
+        # the features service decodes the clip once and returns both model inputs
+        analysis = await get_service('features').post('/analyze', content=raw_data, headers=get_audio_upload_headers(raw_data, ext), timeout=600.0)
+        analysis.raise_for_status()
+        analysis = analysis.json()
+        if 'msg' in analysis:
+            eprint(analysis['msg'])
+        if 'ex' in analysis:
+            eprint('problem with clip analysis request')
+            eprint(analysis['ex'])
+            return (False, dict(), dict(), dict())
+        features = np.array(analysis['scaled_features'])
+        spectrogram = np.frombuffer(base64.b64decode(analysis['image']), dtype=np.uint8).reshape(analysis['image_shape'])
+        return (True, features, spectrogram, item, hashlib.md5(raw_data).hexdigest())
+    except Exception as ex:
+        eprint("failure in spectrogram and feature parsing after return from api calls")
+        eprint(str(ex))
+        return (False, dict(),dict(), dict())
     return (False, dict(), dict(), dict())
 
 
-def get_uid():
-    return str(uuid.uuid4()).replace('-', '')
+def format_prediction(genre_prediction, clip_hash, spectro_hash):
+    # this should be refactored to be part of the api
+    # as a parameter that can be passed
+    # Log top n predictions to console
+    n = 5
+    top_n_genres = []
+    top_n_pairs = []
+    top_n = np.argsort(genre_prediction)
+    top_n = top_n[::-1][:n]
+    full_genre_scores = []
+    for index in range(len(genre_prediction)):
+        full_genre_scores.append([classy.LABELS_DICT[index], np.float64(genre_prediction[index])])
+    for i, val in enumerate(top_n, start=0):
+        top_n_genres.append(classy.LABELS_DICT[val])
+        top_n_pairs.append([classy.LABELS_DICT[val], np.float64(genre_prediction[val])])
+    return {
+        "predictions": "|".join([str(x) for x in top_n_genres]),
+        "prediction_clip_hash": clip_hash,
+        "prediction_spectro_hash": spectro_hash,
+        "prediction_pairs": top_n_pairs,
+        "prediction_full_scores": full_genre_scores,
+    }
+
 
+async def run_model_batch(model_bundle, processed_items):
+    """ Predicts the genres of every analyzed clip of a lease with a single call to the model
 
-def cleanup_files(cleanup_paths):
-    for path in cleanup_paths:
+    Clips already predicted with the same model come from the prediction cache; the rest are stacked into one batch
+    of features and one of images. Returns one prediction per processed item, None where it failed.
+    """
+    predictions = [None for processed in processed_items]
+    pending = []
+    for index, processed in enumerate(processed_items):
         try:
-            if os.path.isfile(path):
-                os.remove(path)
+            # features come scaled and the image cropped and resized for the model from /analyze
+            spectro_hash = hashlib.md5(processed[2].tobytes()).hexdigest()
+            cache_key = (processed[-1], spectro_hash, APP_STATE.model_hash)
+            cached_prediction = APP_STATE.get_cached_prediction(cache_key)
+            if cached_prediction is not None:
+                predictions[index] = {"predictor_id": APP_STATE.uid, **cached_prediction, **processed[3]}
+                continue
+            pending.append((index, cache_key, processed))
         except Exception as ex:
-            eprint("exception in cleanup files")
+            eprint('error in model use attempt')
             eprint(str(ex))
-            pass
-
-
-async def run_model(model, processed):
-    cleanup_paths = list()
+    if len(pending) == 0:
+        return predictions
     try:
-        original_task = processed[3]
-        song_class = classy.Song()
-        features = processed[1]
-        spectrogram = processed[2]
-        #spectrogram = spectrogram['data']
-        clip_hash = processed[-1]
-        spectro_hash = hashlib.md5(spectrogram).hexdigest()
-        gray_path = get_uid()+'.gray.png'
-        with open(gray_path,'wb') as f:
-            f.write(spectrogram)
-        cleanup_paths.append(gray_path)
-        img_width = 335
-        img_height = 200
-        img = Image.open(gray_path).convert('L')
-        img = img.crop((55, 50, 390, 250))
-        img = img.resize((img_width, img_height))
-        img_data = list(img.getdata())
-        song_class.spectrograms.append(img_data)
-        if not isinstance(features, dict):
-            features = json.loads(features)
-        #eprint("creating series")
-        series = pd.Series(features)
-        # code from audio-classifier
-        features_sorted = []
-        for col in classy.FEATURE_COLS:
-            features_sorted.append(features[col])
-        features_sorted = np.array(features_sorted)
-        features_sorted = features_sorted[np.newaxis, :]
-        # load scaler object from binary exported from trained data
-        sc = pickle.load(open('./std_scaler_B.pkl', 'rb'))
-        features = sc.transform(features_sorted)[0]
-        song_class.features.append(features)
-        # audio-classifier code block
-        song_class.genre_prediction = np.array(
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-            dtype=np.float64
-        )
-        count = 0
-        for image, features in zip(song_class.spectrograms, song_class.features):
-            count += 1
-            # get prediction for each clip and and calculate average
-            image = np.array(image).reshape(classy.IMG_HEIGHT, classy.IMG_WIDTH, 1)
-            features = np.array(features)
-            eprint("running prediction")
-            prediction = model.predict([np.array([features]), np.array([image])])
-            song_class.genre_prediction += prediction[0]
-        # calculate average of each clip prediction self
-        song_class.genre_prediction = song_class.genre_prediction / count
-        # log top-n genres to console
-        #eprint("running get_predictions")
-        prediction_arr = song_class.get_predictions()
-        # this should be refactored to be part of the api
-        # as a parameter that can be passed
-        # Log top n predictions to console
-        n = 5
-        top_n_genres = []
-        top_n_pairs = []
-        top_n = np.argsort(prediction_arr)
-        top_n = top_n[::-1][:n]
-        full_genre_scores = []
-        for index in range(len(prediction_arr)):
-            full_genre_scores.append([classy.LABELS_DICT[index], np.float64(prediction_arr[index])])
-        #eprint("converting predictions to text")
-        for i, val in enumerate(top_n, start=0):
-            top_n_genres.append(classy.LABELS_DICT[val])
-            top_n_pairs.append([classy.LABELS_DICT[val], np.float64(prediction_arr[val])])
-        cleanup_files(cleanup_paths)
-        #eprint("|".join([str(x) for x in top_n_genres]))
-        return {
-            "predictor_id": APP_STATE.uid,
-            "predictions": "|".join([str(x) for x in top_n_genres]),
-            "prediction_clip_hash": clip_hash,
-            "prediction_spectro_hash": spectro_hash,
-            "prediction_pairs": top_n_pairs,
-            "prediction_full_scores": full_genre_scores,
-            **original_task
-        }
+        features = np.array([np.array(processed[1]) for index, cache_key, processed in pending])
+        images = np.array([
+            np.array(processed[2]).reshape(classy.IMG_HEIGHT, classy.IMG_WIDTH, 1)
+            for index, cache_key, processed in pending
+        ])
+        eprint("running prediction on "+str(len(pending))+" clips")
+        # the model runs on the inference thread so leases keep being fetched and results posted meanwhile
+        genre_predictions = await run_inference(model_bundle.model.predict, [features, images], batch_size=len(pending))
     except Exception as ex:
         eprint('error in model use attempt')
         eprint(str(ex))
-        cleanup_files(cleanup_paths)
-        return None
-    cleanup_files(cleanup_paths)
-    return None
+        return predictions
+    for (index, cache_key, processed), genre_prediction in zip(pending, genre_predictions):
+        prediction = format_prediction(np.array(genre_prediction, dtype=np.float64), cache_key[0], cache_key[1])
+        APP_STATE.cache_prediction(cache_key, prediction)
+        predictions[index] = {
+            "predictor_id": APP_STATE.uid,
+            **prediction,
+            **processed[3]
+        }
+    return predictions
+
+
+async def run_model(model_bundle, processed):
+    predictions = await run_model_batch(model_bundle, [processed])
+    return predictions[0]
 
 
 def log_feature_spectrogram_failures(processed):
@@ -270,61 +283,92 @@ def log_feature_spectrogram_failures(processed):
             return
 
 
+async def lease_work():
+    global APP_STATE
+    work = await get_service('frontend').post('/predictions?transfer=reference&max_items='+str(LEASE_SIZE), data=APP_STATE.signer.sign(APP_STATE.uid), timeout=60.0)
+    work.raise_for_status()
+    work = work.json()
+    if work.get('work') is not True:
+        return []
+    if 'items' in work:
+        return work['items']
+    # frontends without leases answer with a single item
+    if work.get('item') is not None:
+        return [work['item']]
+    return []
+
+
+async def post_prediction(prediction):
+    global APP_STATE
+    for i in range(POST_ATTEMPTS):
+        try:
+            send_back = await get_service('frontend').post('/finishedpredictions', data=APP_STATE.serializer.dumps(prediction), timeout=60.0)
+            send_back.raise_for_status()
+            if send_back.json()['received'] is True:
+                return True
+        except Exception as ex:
+            eprint("error in posting prediction results")
+            eprint(str(ex))
+        await asyncio.sleep(0.5 * 2 ** i)
+    # the frontend puts the clip back on its queue once the lease runs out
+    return False
+
+
 async def predictor(run_limit):
     global APP_STATE
     event_loop = APP_STATE.loop
-    model = tf.keras.models.load_model(APP_STATE.model_path)
+    # load the model up front; later calls reuse the bundle's copy instead of reading the file again
+    APP_STATE.model_bundle.model
     if re.match("^[0-9]+$", run_limit) is None:
         return
     run_limit = int(run_limit)
     if run_limit <= 0:
         return
+    next_lease = None
+    posts = []
     for i in range(run_limit):
-        async with httpx.AsyncClient() as client:
+        try:
+            if next_lease is None:
+                next_lease = event_loop.create_task(lease_work())
+            lease, next_lease = next_lease, None
+            items = await lease
+            if len(items) == 0:
+                continue
+            # the next lease is fetched while this one is analyzed and run through the model
+            if i + 1 < run_limit:
+                next_lease = event_loop.create_task(lease_work())
+            processed = await asyncio.gather(*[analyze_work_item(item) for item in items])
+            processed = [prep for prep in processed if prep[0] is True]
+            if len(processed) == 0:
+                continue
             try:
-                work = await client.post(get_srv_record_url('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA', False)+'/predictions', data=APP_STATE.signer.sign(APP_STATE.uid), timeout=60.0)
-                work.raise_for_status()
-                prep = await feature_spectrogram_uploads(work.json())
-                try:
-                    if prep[0] is True:
-                        prediction = await run_model(model, prep)
-                    else:
-                        continue
-                except Exception as ex:
-                    eprint("failure in prediction attempt")
-                    eprint(str(ex))
-                    continue
-                if prediction is not None:
-                    async with httpx.AsyncClient() as client:
-                        for i in range(5):
-                            try:
-                                send_back = await client.post(get_srv_record_url('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA', False)+'/finishedpredictions', data=APP_STATE.serializer.dumps(prediction), timeout=60.0)
-                                send_back.raise_for_status()
-                                if send_back.json()['received'] is not True:
-                                    continue
-                                break
-                            except Exception as ex:
-                                eprint("error in posting prediction results")
-                                eprint(str(ex))
-                                continue
+                predictions = await run_model_batch(APP_STATE.model_bundle, processed)
             except Exception as ex:
-                eprint("error client call")
+                eprint("failure in prediction attempt")
                 eprint(str(ex))
-                await asyncio.sleep(0.5)
                 continue
+            for prediction in predictions:
+                if prediction is not None:
+                    posts.append(event_loop.create_task(post_prediction(prediction)))
+        except Exception as ex:
+            eprint("error client call")
+            eprint(str(ex))
+            await asyncio.sleep(0.5)
+            continue
+    await asyncio.gather(*posts)
 
 
 async def check_before_exit():
-    async with httpx.AsyncClient() as client:
-        check = await client.post(get_srv_record_url('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA', False)+'/predictsafetoreboot', data=APP_STATE.signer.sign(APP_STATE.uid), timeout=60.0)
-        check = check.json()
-        return check["safe"]
+    check = await get_service('frontend').post('/predictsafetoreboot', data=APP_STATE.signer.sign(APP_STATE.uid), timeout=60.0)
+    check = check.json()
+    return check["safe"]
 
 
 async def runner(run_limit):
     global APP_STATE
     event_loop = APP_STATE.loop
-    model = tf.keras.models.load_model(APP_STATE.model_path)
+    # load the model up front; later calls reuse the bundle's copy instead of reading the file again
+    APP_STATE.model_bundle.model
     if re.match("^[0-9]+$", run_limit) is None:
         return
     run_limit = int(run_limit)
@@ -334,20 +378,21 @@ async def runner(run_limit):
     while await check_before_exit() is False:
         await predictor(str(run_limit))
         await asyncio.sleep(random.choice([0.05, 0.1, 0.15]))
-    async with httpx.AsyncClient() as client:
-        then = datetime.datetime.now()
-        eprint("initiating restarts: "+then.isoformat())
-        try:
-            restart_features = await client.post(get_srv_record_url('GENREML_FEATURES_PORT', 'GENREML_FEATURES_ADDRESS', 'GENREML_FEATURES_SCHEMA', False)+'/restartsignal', data=APP_STATE.serializer.dumps({'restart':True}), timeout=5.0)
-        except Exception as ex:
-            eprint(str(ex))
-            pass
-        try:
-            restart_spectrograms = await client.post(get_srv_record_url('GENREML_SPECTRO_PORT', 'GENREML_SPECTRO_ADDRESS', 'GENREML_SPECTRO_SCHEMA', False)+'/restartsignal', data=APP_STATE.serializer.dumps({'restart':True}), timeout=5.0)
-        except Exception as ex:
-            eprint(str(ex))
-            pass
-        eprint("restarts sent: "+str((then-datetime.datetime.now()).total_seconds()))
+    then = datetime.datetime.now()
+    eprint("initiating restarts: "+then.isoformat())
+    try:
+        restart_features = await get_service('features').post('/restartsignal', data=APP_STATE.serializer.dumps({'restart':True}), timeout=5.0)
+    except Exception as ex:
+        eprint(str(ex))
+        pass
+    try:
+        restart_spectrograms = await get_service('spectrograms').post('/restartsignal', data=APP_STATE.serializer.dumps({'restart':True}), timeout=5.0)
+    except Exception as ex:
+        eprint(str(ex))
+        pass
+    eprint("restarts sent: "+str((then-datetime.datetime.now()).total_seconds()))
+    await close_services()
+    shutdown_executors()
 
 
 event_loop = asyncio.get_event_loop()
@@ -6,15 +6,19 @@ warnings.filterwarnings('ignore', category=FutureWarning)
 warnings.filterwarnings('ignore', module='librosa')
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
+import audioread
+import hashlib
 import pickle
 import sys
 import tempfile
+import threading
 import time
 import librosa
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import simpleaudio as sa
+import soundfile
 import tensorflow as tf
 import youtube_dl
 from PIL import Image
@@ -26,11 +30,94 @@ IMG_WIDTH = 335
 IMG_HEIGHT = 200
 NUM_LABELS = 32
 MIN_CLIP_LENGTH = 29
+# seconds of extra audio decoded around the clips so resampling edge effects fall outside of them
+DECODE_MARGIN = 0.5
 NUM_FEATURES = 44
 NUM_MFCC_COEFF = 20
 SONG_EXT = 'mp3'
 LABELS_DICT = pd.read_csv('./labels_key.csv')['category']
 FEATURE_COLS = pd.read_csv('./feature_cols.csv')['feature_columns']
+MODEL_PATH = 'FMA_model_seperate_genres.h5'
+SCALER_PATH = './std_scaler_B.pkl'
+
+
+def hash_file(path):
+    """ sha256 of a file's contents, read a chunk at a time """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_duration(path):
+    """ Reads the duration of an audio file in seconds from its header without decoding it where possible """
+    try:
+        return soundfile.info(path).duration
+    except RuntimeError:
+        with audioread.audio_open(path) as f:
+            return f.duration
+
+
+class ModelBundle:
+    """ Lazily loads the keras model and feature scaler once and shares them across songs, calls and threads
+
+    Use ModelBundle.get to retrieve the bundle shared by the process for a model path
+    """
+    _bundles = {}
+    _bundles_lock = threading.Lock()
+
+    def __init__(self, model_path=MODEL_PATH, scaler_path=SCALER_PATH):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self._lock = threading.Lock()
+        self._model = None
+        self._scaler = None
+        self._content_hash = None
+        self._scaler_hash = None
+
+    @classmethod
+    def get(cls, model_path=MODEL_PATH, scaler_path=SCALER_PATH):
+        with cls._bundles_lock:
+            return cls._bundles.setdefault((model_path, scaler_path), cls(model_path, scaler_path))
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = tf.keras.models.load_model(self.model_path)
+        return self._model
+
+    @property
+    def scaler(self):
+        if self._scaler is None:
+            with self._lock:
+                if self._scaler is None:
+                    with open(self.scaler_path, 'rb') as f:
+                        self._scaler = pickle.load(f)
+        return self._scaler
+
+    @property
+    def content_hash(self):
+        """ sha256 of the model file, the same hash the model store names models by """
+        if self._content_hash is None:
+            self._content_hash = hash_file(self.model_path)
+        return self._content_hash
+
+    @property
+    def scaler_hash(self):
+        """ sha256 of the scaler file; cache anything scaled with it under this so a replaced scaler is never
+        served stale results
+        """
+        if self._scaler_hash is None:
+            self._scaler_hash = hash_file(self.scaler_path)
+        return self._scaler_hash
+
+    def invalidate(self):
+        """ Drops the cached model and scaler so they're read from disk again on next use """
+        with self._lock:
+            self._model, self._scaler, self._content_hash, self._scaler_hash = None, None, None, None
 
 
 class Song:
@@ -48,21 +135,35 @@ class Song:
         return self.genre_prediction
 
     @staticmethod
-    def __add_to_series(ds, name, values):
-        """ Calculates mean, min, max, and std deviation of each list of values passed to function,
-        then stores value in the data series
-        :param pandas.Series ds: Data series that will store audio feature data
-        :param string name: name of extracted feature. Must match column header
-        :param list values: python list of audio extracted data from librosa
+    def __aggregate(feature_frames):
+        """ Calculates mean, min, max, and std deviation of each feature but mfcc and the mean of each mfcc row,
+        with the sums, mins and maxes of every row computed in one vectorized pass over the stacked data
+        :param list feature_frames: (name, values) pairs of audio extracted data from librosa where values have
+        shape (rows, frames)
+        :returns numpy float32 array of the aggregations and the column names
         """
-        # set mean of values
-        ds['{}-mean'.format(name)] = np.mean(values)
-        # set min of values
-        ds['{}-min'.format(name)] = np.min(values)
-        # set max of values
-        ds['{}-max'.format(name)] = np.max(values)
-        # set std of values
-        ds['{}-std'.format(name)] = np.std(values)
+        stacked = np.concatenate([values for _, values in feature_frames], axis=0)
+        n_frames = stacked.shape[1]
+        row_sums = stacked.sum(axis=1, dtype=np.float64)
+        row_mins = stacked.min(axis=1)
+        row_maxs = stacked.max(axis=1)
+        columns = []
+        results = []
+        row = 0
+        for name, values in feature_frames:
+            rows = values.shape[0]
+            if name == 'mfcc':
+                columns.extend(['mfcc{}'.format(count) for count in range(rows)])
+                results.append(row_sums[row:row + rows] / n_frames)
+            else:
+                count = rows * n_frames
+                mean = row_sums[row:row + rows].sum() / count
+                std = np.sqrt(np.square(stacked[row:row + rows] - mean).sum(dtype=np.float64) / count)
+                columns.extend(['{}-{}'.format(name, aggregation) for aggregation in ['mean', 'min', 'max', 'std']])
+                results.append(np.array([
+                    mean, row_mins[row:row + rows].min(), row_maxs[row:row + rows].max(), std]))
+            row += rows
+        return np.concatenate(results).astype(np.float32), columns
 
     def __get_features(self, source, sr):
         """ Calls librosa library to extract audio feature data then stores in pandas data series
@@ -73,22 +174,19 @@ class Song:
         warnings.filterwarnings('ignore', module='librosa')
 
         try:
-            # define panda series to hold song data
-            ds = pd.Series(index=FEATURE_COLS, dtype=np.float32)
-            # extract specral features
-            self.__add_to_series(ds, 'chroma_stft', librosa.feature.chroma_stft(y=source, sr=sr))
-            self.__add_to_series(ds, 'rms', librosa.feature.rms(y=source))
-            self.__add_to_series(ds, 'spec_cent', librosa.feature.spectral_centroid(y=source, sr=sr))
-            self.__add_to_series(ds, 'spec_bw', librosa.feature.spectral_bandwidth(y=source, sr=sr))
-            self.__add_to_series(ds, 'spec_rolloff', librosa.feature.spectral_rolloff(y=source, sr=sr))
-            self.__add_to_series(ds, 'zcr', librosa.feature.zero_crossing_rate(source))
-
-            # add mfcc spectral coefficients
-            mfcc = librosa.feature.mfcc(y=source, sr=sr, n_mfcc=NUM_MFCC_COEFF)
-            for count, e in enumerate(mfcc, start=0):
-                ds['mfcc{}'.format(count)] = np.mean(e)
-
-            return ds
+            # extract specral features and mfcc spectral coefficients
+            feature_frames = [
+                ('chroma_stft', librosa.feature.chroma_stft(y=source, sr=sr)),
+                ('rms', librosa.feature.rms(y=source)),
+                ('spec_cent', librosa.feature.spectral_centroid(y=source, sr=sr)),
+                ('spec_bw', librosa.feature.spectral_bandwidth(y=source, sr=sr)),
+                ('spec_rolloff', librosa.feature.spectral_rolloff(y=source, sr=sr)),
+                ('zcr', librosa.feature.zero_crossing_rate(source)),
+                ('mfcc', librosa.feature.mfcc(y=source, sr=sr, n_mfcc=NUM_MFCC_COEFF))
+            ]
+            features, columns = self.__aggregate(feature_frames)
+            # pandas series holding the song data in the order of FEATURE_COLS
+            return pd.Series(features, index=columns).reindex(FEATURE_COLS)
 
         except Exception as e:
             print('ERROR: {}'.format(repr(e)))
@@ -106,9 +204,8 @@ class Song:
         features_sorted = np.array(features_sorted)
         features_sorted = features_sorted[np.newaxis, :]
 
-        # load scaler object from binary exported from trained data
-        sc = pickle.load(open('./std_scaler_B.pkl', 'rb'))
-        features = sc.transform(features_sorted)[0]
+        # scaler object loaded once from binary exported from trained data
+        features = ModelBundle.get().scaler.transform(features_sorted)[0]
         return features
 
     @staticmethod
@@ -207,11 +304,8 @@ class Song:
         If song less than 90sec, only middle 29sec clip extracted
         If less than 29sec, error is thrown
         """
-        y, sr = librosa.load(self.path)
-        self.sr = sr
-
-        # length of song in seconds
-        length = len(y) / sr
+        # length of song in seconds read from the file header so only the clipped audio has to be decoded
+        length = get_duration(self.path)
 
         # assert song length greater than or equal to minimum
         if length < MIN_CLIP_LENGTH:
@@ -219,22 +313,26 @@ class Song:
 
         # if length of song less than 3 * MIN_CLIP_LENGTH, take middle section
         elif length < MIN_CLIP_LENGTH * 3 + 1:
-            mid_index = int(len(y) / 2)
-            lower_index = mid_index - int(sr * MIN_CLIP_LENGTH / 2)
-            upper_index = lower_index + int(sr * MIN_CLIP_LENGTH)
-            self.clips.append(y[lower_index:upper_index])
+            num_clips = 1
 
         # else split song into three clips each at MIN_CLIP_LENGTH in duration
         else:
             num_clips = 3
-            mid_index = int(len(y) / 2)
-            lower_index = mid_index - int(
-                sr * (MIN_CLIP_LENGTH * num_clips / 2))
 
-            for i in range(num_clips):
-                upper_index = lower_index + int(sr * MIN_CLIP_LENGTH)
-                self.clips.append(y[lower_index:upper_index])
-                lower_index = upper_index
+        # decode the middle section covering the clips plus a margin for resampling on each side
+        window_length = MIN_CLIP_LENGTH * num_clips
+        start = (length - window_length) / 2
+        offset = max(0.0, start - DECODE_MARGIN)
+        y, sr = librosa.load(self.path, offset=offset, duration=window_length + 2 * DECODE_MARGIN)
+        self.sr = sr
+        lower_index = int(round((start - offset) * sr))
+        if lower_index + int(sr * MIN_CLIP_LENGTH) * num_clips > len(y):
+            raise Exception('Song is shorter than its reported length')
+
+        for i in range(num_clips):
+            upper_index = lower_index + int(sr * MIN_CLIP_LENGTH)
+            self.clips.append(y[lower_index:upper_index])
+            lower_index = upper_index
 
         # get song title and artist if avaliable
         tag = id3.Tag()
@@ -254,27 +352,21 @@ class Song:
             self.spectrograms.append(self.__extract_spectrogram(clip, self.sr, spect_output_path, count))
             count += 1
 
-    def predict(self):
-        """ Prediction method that loops through each clip in self.clips and runs ML prediction model to
+    def predict(self, bundle=None):
+        """ Prediction method that runs every clip in self.clips through the ML prediction model in one batch to
         classify song into categories defined in LABELS_DICT
+        :param bundle: ModelBundle holding the model; defaults to the process-wide bundle for MODEL_PATH
         """
         print(f'Running prediction model...')
-        self.genre_prediction = np.array(
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-            dtype=np.float64)
-        # model = tf.keras.models.load_model('FMA_model.h5')
-        model = tf.keras.models.load_model('FMA_model_seperate_genres.h5')
-        count = 0
-        for image, features in zip(self.spectrograms, self.features):
-            count += 1
-            # get prediction for each clip and and calculate average
-            image = np.array(image).reshape(IMG_HEIGHT, IMG_WIDTH, 1)
-            features = np.array(features)
-            prediction = model.predict([np.array([features]), np.array([image])])
-            self.genre_prediction += prediction[0]
+        # the model is only loaded from disk the first time any song is predicted
+        model = (bundle or ModelBundle.get()).model
+        # stack the clips into single image and feature tensors so the model only runs once
+        images = np.array([np.array(image).reshape(IMG_HEIGHT, IMG_WIDTH, 1) for image in self.spectrograms])
+        features = np.array([np.array(features) for features in self.features])
+        predictions = model.predict([features, images], batch_size=len(images))
 
         # calculate average of each clip prediction
-        self.genre_prediction = self.genre_prediction / count
+        self.genre_prediction = predictions.astype(np.float64).mean(axis=0)
 
 
 def main(dl_type, url_path, n):
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sys
+import time
+import dns.asyncresolver as asyncresolver
+import httpx
+
+try:
+    import h2
+    HTTP2 = True
+except ImportError:
+    # http/2 needs httpx[http2], fall back to keep-alive http/1.1 connections without it
+    HTTP2 = False
+
+# environment variables holding the port, address and schema of each upstream service
+SERVICES = {
+    'frontend': ('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA'),
+    'features': ('GENREML_FEATURES_PORT', 'GENREML_FEATURES_ADDRESS', 'GENREML_FEATURES_SCHEMA'),
+    'spectrograms': ('GENREML_SPECTRO_PORT', 'GENREML_SPECTRO_ADDRESS', 'GENREML_SPECTRO_SCHEMA')
+}
+# seconds a resolved url is used for when the SRV record has no ttl and before retrying a failed lookup
+DEFAULT_TTL = 30
+FAILED_LOOKUP_TTL = 5
+# connections kept open to each upstream between requests and how long idle ones are kept for
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60
+
+
+# simple logging snippet from https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+class ServiceClient:
+    """ One long lived pooled async http client for an upstream service found through its SRV record
+
+    The SRV lookup is cached for the ttl of the record; once it expires the stale url keeps being used while the
+    record is looked up again in the background so requests never wait on dns after the first one
+    """
+
+    def __init__(self, port_key, address_key, schema_key):
+        self.port_key = port_key
+        self.address_key = address_key
+        self.schema_key = schema_key
+        self.client = None
+        self.url = None
+        self.expires = 0
+        self.refresh_task = None
+
+    def get_url_for_host(self, host):
+        url = os.environ[self.schema_key]+"://"+host
+        if self.port_key in os.environ:
+            url += ":"+os.environ[self.port_key]
+        return url
+
+    async def refresh(self):
+        address = os.environ[self.address_key]
+        try:
+            answer = await asyncresolver.resolve(address, 'SRV')
+            self.url = self.get_url_for_host(answer[0].target.to_text().strip('.'))
+            self.expires = time.monotonic() + (answer.rrset.ttl or DEFAULT_TTL)
+        except Exception as ex:
+            eprint("exception in srv lookup of "+address)
+            eprint(str(ex))
+            # in most cases this is likely to be the wrong url
+            if self.url is None:
+                self.url = self.get_url_for_host(address)
+            self.expires = time.monotonic() + FAILED_LOOKUP_TTL
+
+    async def get_url(self):
+        if self.url is None:
+            await self.refresh()
+        elif time.monotonic() >= self.expires and (self.refresh_task is None or self.refresh_task.done()):
+            self.refresh_task = asyncio.get_event_loop().create_task(self.refresh())
+        return self.url
+
+    def get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                http2=HTTP2,
+                limits=httpx.Limits(
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry=KEEPALIVE_EXPIRY))
+        return self.client
+
+    async def get(self, path, **kwargs):
+        return await self.get_client().get(await self.get_url()+path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.get_client().post(await self.get_url()+path, **kwargs)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+SERVICE_CLIENTS = dict()
+
+
+def get_service(name):
+    """ Retrieves the client shared by the whole process for one of the SERVICES """
+    if name not in SERVICE_CLIENTS:
+        SERVICE_CLIENTS[name] = ServiceClient(*SERVICES[name])
+    return SERVICE_CLIENTS[name]
+
+
+async def close_services():
+    for service_client in SERVICE_CLIENTS.values():
+        await service_client.close()
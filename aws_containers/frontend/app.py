@@ -3,25 +3,62 @@ import base64
 import datetime
 import functools
 import hashlib
-import httpx
 import itsdangerous
 import json
 import os
 import re
-import requests
 import sys
+import time
 import uuid
-from quart import Quart, request, jsonify, abort, redirect, url_for, url_for, render_template, session
-import dns.resolver as resolver
+from quart import Quart, request, jsonify, abort, redirect, url_for, url_for, render_template, session, make_response
 import numpy as np
 import audio_classifier as classy
 import aiofiles as aiof
+from compute import run_cpu, shutdown_executors
+from job_store import get_batch_paths, open_job_store
+from work_queue import FairWorkQueue
+from genreml.model.processing.pcm import PCM_EXTENSION, encode_pcm
 from genreml.model.utils.file_handling import get_filetype, get_filename
 import downloader
 
 
 app = Quart(__name__, static_folder='./static', static_url_path='/static')
 app.secret_key = str(uuid.uuid4())
+# how long browsers wait on a result and workers wait on the work queues before being told to try again
+RESULT_WAIT_TIMEOUT = 15
+QUEUE_WAIT_TIMEOUT = 30
+# how long a batch results stream stays open and how often it sends a comment to keep proxies from closing it
+STREAM_TIMEOUT = 600
+STREAM_KEEPALIVE_INTERVAL = 15
+# result kind to the field holding the result in the batch store and the name of the field in responses
+RESULT_FIELDS = {
+    'predictions': ('result', 'prediction'),
+    'spectrograms': ('images', 'images')
+}
+# clips are handed to workers already decoded as int16 or float32 samples so they're never decoded or resampled again
+CLIP_SAMPLE_TYPE = os.environ.get('GENREML_CLIP_SAMPLE_TYPE', 'int16')
+# how many clips the work queues hold in total and for a single session before uploads are turned away
+# and how many seconds those uploads are told to wait before trying again
+QUEUE_MAXSIZE = int(os.environ.get('GENREML_QUEUE_MAXSIZE', '500'))
+QUEUE_MAX_PER_SESSION = int(os.environ.get('GENREML_QUEUE_MAX_PER_SESSION', '20'))
+QUEUE_RETRY_AFTER = int(os.environ.get('GENREML_QUEUE_RETRY_AFTER', '30'))
+QUEUE_FULL_MESSAGE = 'too much work is queued right now, please try again later'
+# where the clips of each kind of work are kept until workers fetch them by reference
+BLOB_STORES = {
+    'predictions': '/opt/prediction_store',
+    'spectrograms': '/opt/spectrogram_store'
+}
+# how long a worker has to post the result of leased work before it goes back on the queue
+# and how many items a single lease can hand out
+LEASE_TIMEOUT = int(os.environ.get('GENREML_LEASE_TIMEOUT', '300'))
+MAX_LEASE_ITEMS = int(os.environ.get('GENREML_MAX_LEASE_ITEMS', '16'))
+# how long batches and their clip files are kept and how often expired ones are swept out; batches are kept in
+# a SQLite database at GENREML_JOB_STORE if it's set so their work is resumed after a restart, otherwise in memory
+BATCH_TTL = int(os.environ.get('GENREML_BATCH_TTL', '600'))
+SWEEP_INTERVAL = int(os.environ.get('GENREML_SWEEP_INTERVAL', '30'))
+JOB_STORE_PATH = os.environ.get('GENREML_JOB_STORE', '')
+# where clip files that no batch refers to anymore are swept out of
+CLIP_STORE = '/opt/clip_store'
 
 
 class app_state:
@@ -44,37 +81,18 @@ class app_state:
             "image_db_spectrogram_image": "DB Spectrogram",
             "image_db_spectrogram_original_color": "DB Spectrogram"
         }
-        self.prediction_queue = asyncio.Queue()
-        self.spectrograms_queue = asyncio.Queue()
-        self.batch_store = dict()
+        # sessions take turns on the work queues so one big upload can't hold up everyone else's
+        self.prediction_queue = FairWorkQueue(QUEUE_MAXSIZE, QUEUE_MAX_PER_SESSION)
+        self.spectrograms_queue = FairWorkQueue(QUEUE_MAXSIZE, QUEUE_MAX_PER_SESSION)
+        self.batch_store = open_job_store(JOB_STORE_PATH, BATCH_TTL)
         self.predictor_connections = dict()
         self.spectrogram_connections = dict()
-
-
-def get_srv_record_url(port_key, address_key, schema_key, test_endpoint=True):
-    srv_schema = os.environ[schema_key]
-    srv_address = os.environ[address_key]
-    srv_url = srv_schema+"://"+os.environ[address_key]
-    if port_key in os.environ:
-        srv_url += ":"+os.environ[port_key]
-    try:
-        resolve_service_url = resolver.query(srv_address, 'SRV')
-        srv_address = re.split('\s+', resolve_service_url.rrset.to_text())[-1].strip('.')
-        srv_url = srv_schema+"://"+re.split('\s+', resolve_service_url.rrset.to_text())[-1].strip('.')
-        if port_key in os.environ:
-            srv_url += ":"+os.environ[port_key]
-        if test_endpoint:
-            req_test = requests.get(srv_url+"/test")
-            req_test.raise_for_status()
-    except Exception as ex:
-        eprint("domain discovery failed")
-        eprint(str(ex))
-        # in most cases this is likely to be the wrong url
-        srv_url = srv_schema+"://"+os.environ[address_key]
-        if port_key in os.environ:
-            srv_url += ":"+os.environ[port_key]
-        pass
-    return srv_url
+        # events set as soon as a result for a (kind, uid) arrives so waiting requests wake up right away
+        self.result_events = dict()
+        # queues of the open result streams of each batch id
+        self.batch_subscribers = dict()
+        # timers of the work handed out in leases by (kind, uid), cancelled when the result comes back
+        self.leases = dict()
 
 
 # simple logging snippet from https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
@@ -86,24 +104,138 @@ def get_uid():
     return str(uuid.uuid4()).replace('-', '')
 
 
-async def clean_up_file_later(path):
-    return
+def get_result_event(kind, uid):
+    global APP_STATE
+    key = (kind, uid)
+    if key not in APP_STATE.result_events:
+        APP_STATE.result_events[key] = asyncio.Event()
+    return APP_STATE.result_events[key]
+
+
+def notify_result(kind, uid, batch_id=None):
+    global APP_STATE
+    get_result_event(kind, uid).set()
+    for subscriber in APP_STATE.batch_subscribers.get(batch_id, list()):
+        subscriber.put_nowait((kind, uid))
+
+
+def discard_result_event(kind, uid):
+    global APP_STATE
+    APP_STATE.result_events.pop((kind, uid), None)
+
+
+def discard_batch_events(batch_id, batch):
     global APP_STATE
+    for kind in ['predictions', 'spectrograms']:
+        for uid in batch.get(kind, dict()):
+            discard_result_event(kind, uid)
+            release_lease(kind, uid)
+    discard_result_event('play_clips', batch_id)
+
+
+async def wait_for_result(kind, uid, is_ready, timeout=RESULT_WAIT_TIMEOUT):
+    # checks is_ready first and then sleeps until notify_result is called for the
+    # same kind and uid or the timeout passes instead of polling the batch store
+    if is_ready():
+        return True
+    try:
+        await asyncio.wait_for(get_result_event(kind, uid).wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return is_ready()
+
+
+def has_queue_capacity(batch_id, count=1):
+    global APP_STATE
+    return APP_STATE.prediction_queue.has_capacity(batch_id, count) and APP_STATE.spectrograms_queue.has_capacity(batch_id, count)
+
+
+def queue_full_response():
+    return jsonify({
+        'msg': QUEUE_FULL_MESSAGE,
+        'retry_after': QUEUE_RETRY_AFTER
+    }), 429, {'Retry-After': str(QUEUE_RETRY_AFTER)}
+
+
+def create_batch(batch_id):
+    # replaces any batch the session had before
+    global APP_STATE
+    APP_STATE.batch_store.create(batch_id, {
+        'batch_id': batch_id,
+        'time': datetime.datetime.now(),
+        'predictions': dict(),
+        'spectrograms': dict(),
+        'play_clips': dict(),
+        'model_hash': APP_STATE.model_hash
+    })
+
+
+def remove_file(path):
     try:
-        TASK_LIMIT = 600
-        then = datetime.datetime.now()
-        await asyncio.sleep(TASK_LIMIT)
         if os.path.isfile(path):
             os.remove(path)
-            eprint("deleted stale file: "+str(path))
-        if (datetime.datetime.now()-then).total_seconds() < TASK_LIMIT:
-            eprint("timer on file cleanup failed!")
     except Exception as ex:
-        eprint("exception in stale task cleanup")
         eprint(str(ex))
         pass
 
 
+def sweep_expired_batches():
+    global APP_STATE
+    for batch_id, batch in APP_STATE.batch_store.pop_expired():
+        discard_batch_events(batch_id, batch)
+        for path in get_batch_paths(batch):
+            remove_file(path)
+        eprint("deleted stale task: "+str(batch_id))
+
+
+def sweep_stale_files():
+    # clip files older than a batch lives that no batch refers to were left behind by a restart or a failed upload
+    global APP_STATE
+    live_paths = set()
+    for batch_id in APP_STATE.batch_store:
+        live_paths.update(get_batch_paths(APP_STATE.batch_store[batch_id]))
+    expired_before = time.time() - BATCH_TTL
+    for directory in [*BLOB_STORES.values(), CLIP_STORE, APP_STATE.filestore_directory]:
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.path not in live_paths and entry.stat().st_mtime < expired_before:
+                remove_file(entry.path)
+                eprint("deleted stale file: "+str(entry.path))
+
+
+async def sweeper():
+    # a single task expires batches and their files instead of a sleeping task per batch and per file
+    while True:
+        try:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            sweep_expired_batches()
+            sweep_stale_files()
+        except Exception as ex:
+            eprint("exception in stale task cleanup")
+            eprint(str(ex))
+            pass
+
+
+def resume_batches():
+    # work of the batches stored before a restart that has no result yet goes back on the queues
+    global APP_STATE
+    for batch_id in APP_STATE.batch_store.load():
+        for kind in RESULT_FIELDS:
+            for item in APP_STATE.batch_store[batch_id][kind].values():
+                if item[RESULT_FIELDS[kind][0]] is None and os.path.isfile(item['path']):
+                    get_work_queue(kind).requeue(item)
+        eprint("resumed batch id: "+batch_id)
+
+
+def split_song(upload_path):
+    # runs in the compute process pool and returns the clips of the song and their sample rate
+    song_class = classy.Song()
+    song_class.path = upload_path
+    song_class.extract_song_data()
+    return (song_class.clips, song_class.sr)
+
+
 async def create_clips(raw_data, bid, md5, model_hash, filename, name, ext, use_all=True, write_raw_data=True, passed_path=''):
     global APP_STATE
     return_state = True
@@ -124,25 +256,28 @@ async def create_clips(raw_data, bid, md5, model_hash, filename, name, ext, use_
             upload_path = passed_path
         if not os.path.isfile(upload_path):
             raise Exception("could not write data in create_clips or youtube file does not exist")
-        eprint("defining class")
-        song_class = classy.Song()
-        song_class.path = upload_path
         eprint("extracting song data")
-        song_class.extract_song_data()
+        # decoding runs in the compute process pool so the event loop keeps answering requests
+        clips, sample_rate = await run_cpu(split_song, upload_path)
         eprint("starting clips")
         if use_all is False:
-            song_class.clips = [song_class.clips[0]]
+            clips = [clips[0]]
         clip_count = 0
-        for clip in song_class.clips:
+        for clip in clips:
             clip_count += 1
+            clip_paths = list()
             try:
                 uid = get_uid()
                 # export wav file
-                scaled = np.int16(clip / np.max(np.abs(clip)) * 32767)
+                normalized = clip / np.max(np.abs(clip))
+                scaled = np.int16(normalized * 32767)
+                pcm_clip = encode_pcm(normalized, sample_rate, CLIP_SAMPLE_TYPE)
+                clip_item = None
                 if clip_count == 1:
-                    classy.write('/opt/clip_store/'+uid+'.'+'wav', song_class.sr, scaled)
+                    classy.write(CLIP_STORE+'/'+uid+'.'+'wav', sample_rate, scaled)
+                    clip_paths.append(CLIP_STORE+'/'+uid+'.'+'wav')
                     clip_item = {
-                        'path': '/opt/clip_store/'+uid+'.'+'wav',
+                        'path': CLIP_STORE+'/'+uid+'.'+'wav',
                         'filename': uid+'.'+'wav',
                         'ext': 'wav',
                         'uid': uid,
@@ -151,44 +286,62 @@ async def create_clips(raw_data, bid, md5, model_hash, filename, name, ext, use_
                         'model_hash': model_hash,
                         'result': None
                     }
-                    APP_STATE.batch_store[bid]['play_clips'][uid] = clip_item
-                    APP_STATE.loop.create_task(clean_up_file_later('/opt/clip_store/'+uid+'.'+'wav'))
-                classy.write('/opt/prediction_store/'+uid+'.'+'wav', song_class.sr, scaled)
                 prediction_work_item = {
-                    'path': '/opt/prediction_store/'+uid+'.'+'wav',
-                    'filename': uid+'.'+'wav',
-                    'ext': 'wav',
+                    'path': BLOB_STORES['predictions']+'/'+uid+'.'+PCM_EXTENSION,
+                    'filename': uid+'.'+PCM_EXTENSION,
+                    'ext': PCM_EXTENSION,
                     'uid': uid,
                     'batch_id': bid,
                     'source_md5': md5,
                     'model_hash': model_hash,
                     'result': None
                 }
-                prediction_work_items.append(prediction_work_item)
-                APP_STATE.batch_store[bid]['predictions'][uid] = prediction_work_item
-                await APP_STATE.prediction_queue.put(prediction_work_item)
-                APP_STATE.loop.create_task(clean_up_file_later('/opt/prediction_store/'+uid+'.'+'wav'))
-                eprint("prediction in the queue")
-                classy.write('/opt/spectrogram_store/'+uid+'.'+'wav', song_class.sr, scaled)
                 spectrogram_work_item = {
-                    'path': '/opt/spectrogram_store/'+uid+'.'+'wav',
-                    'filename': uid+'.'+'wav',
-                    'ext': 'wav',
+                    'path': BLOB_STORES['spectrograms']+'/'+uid+'.'+PCM_EXTENSION,
+                    'filename': uid+'.'+PCM_EXTENSION,
+                    'ext': PCM_EXTENSION,
                     'uid': uid,
                     'batch_id': bid,
                     'source_md5': md5,
                     'model_hash': model_hash,
                     'images': None
                 }
+                for work_item in [prediction_work_item, spectrogram_work_item]:
+                    async with aiof.open(work_item['path'], 'wb') as f:
+                        await f.write(pcm_clip)
+                    clip_paths.append(work_item['path'])
+                # both files are written before anything is queued so there's no await between the capacity check and
+                # the two puts, another request can't take the room in between and leave the clip on one queue only
+                if not has_queue_capacity(bid):
+                    raise asyncio.QueueFull("work queues are full")
+                APP_STATE.prediction_queue.put_nowait(prediction_work_item)
+                APP_STATE.spectrograms_queue.put_nowait(spectrogram_work_item)
+                prediction_work_items.append(prediction_work_item)
                 spectrogram_work_items.append(spectrogram_work_item)
+                APP_STATE.batch_store[bid]['predictions'][uid] = prediction_work_item
                 APP_STATE.batch_store[bid]['spectrograms'][uid] = spectrogram_work_item
-                await APP_STATE.spectrograms_queue.put(spectrogram_work_item)
-                APP_STATE.loop.create_task(clean_up_file_later('/opt/spectrogram_store/'+uid+'.'+'wav'))
-                eprint("spectrogram in the queue")
+                APP_STATE.batch_store.save_item(bid, 'predictions', uid)
+                APP_STATE.batch_store.save_item(bid, 'spectrograms', uid)
+                if clip_item is not None:
+                    APP_STATE.batch_store[bid]['play_clips'][uid] = clip_item
+                    APP_STATE.batch_store.save_item(bid, 'play_clips', uid)
+                if clip_item is not None:
+                    notify_result('play_clips', bid)
+                eprint("prediction and spectrogram in the queue")
+            except asyncio.QueueFull:
+                for path in clip_paths:
+                    remove_file(path)
+                raise
             except Exception as ex:
                 eprint("failure in clip processing")
                 eprint(str(ex))
+                for path in clip_paths:
+                    remove_file(path)
                 pass
+    except asyncio.QueueFull:
+        # raised again once the song file is removed below so the route can turn the upload away with a 429
+        eprint("work queues are full")
+        return_state = None
     except Exception as ex:
         eprint("failure in music file processing")
         eprint(str(ex))
@@ -200,36 +353,11 @@ async def create_clips(raw_data, bid, md5, model_hash, filename, name, ext, use_
     except Exception as ex:
         eprint(str(ex))
         pass
+    if return_state is None:
+        raise asyncio.QueueFull("work queues are full")
     return (return_state, prediction_work_items, spectrogram_work_items)
 
 
-async def clean_up_task_later(batch_id):
-    global APP_STATE
-    try:
-        TASK_LIMIT = 600
-        then = datetime.datetime.now()
-        await asyncio.sleep(TASK_LIMIT)
-        if batch_id not in APP_STATE.batch_store:
-            return
-        if 'time' in APP_STATE.batch_store[batch_id]:
-            then = APP_STATE.batch_store[batch_id]['time']
-        if len(APP_STATE.batch_store[batch_id]['predictions'].keys()) == 0 and len(APP_STATE.batch_store[batch_id]['spectrograms'].keys()) == 0:
-            if (datetime.datetime.now()-then).total_seconds() >= TASK_LIMIT:
-                eprint("deleted stale task: "+str(batch_id))
-            del(APP_STATE.batch_store[batch_id])
-        if batch_id not in APP_STATE.batch_store:
-            return
-        if (datetime.datetime.now()-then).total_seconds() < TASK_LIMIT:
-            eprint("timer on task cleanup failed!")            
-        if (datetime.datetime.now()-then).total_seconds() >= TASK_LIMIT:
-            del(APP_STATE.batch_store[batch_id])
-            eprint("deleted stale task: "+str(batch_id))
-    except Exception as ex:
-        eprint("exception in stale task cleanup")
-        eprint(str(ex))
-        pass
-
-
 @app.route('/download_youtube', methods=['POST'])
 async def process_youtube_video():
     global APP_STATE
@@ -241,24 +369,20 @@ async def process_youtube_video():
     else:
         batch_id = APP_STATE.session_signer.unsign(batch_id).decode('utf-8')
         eprint(str(batch_id))
-        APP_STATE.batch_store[batch_id] = {
-            'batch_id': batch_id,
-            'time': datetime.datetime.now(),
-            'predictions': dict(),
-            'spectrograms': dict(),
-            'play_clips': dict(),
-            'model_hash': APP_STATE.model_hash
-        }
-        APP_STATE.loop.create_task(clean_up_task_later(batch_id))
     background_work = []
     """ Route for downloading a Youtube video and performing feature extraction + prediction """
+    # turned away before the batch is replaced so the session's queued work can still be collected
+    if not has_queue_capacity(batch_id):
+        return queue_full_response()
+    create_batch(batch_id)
     try:
         filestore_directory = APP_STATE.filestore_directory
         # Get the Youtube link from the request
         youtube_url = (await request.form)['text']
         # Only process results if valid youtube video link
         if "youtube" in youtube_url and youtube_url[:8] == "https://" and "v=" in youtube_url:
-            filepath = downloader.download_link(youtube_url, directory_path=filestore_directory)
+            filepath = await APP_STATE.loop.run_in_executor(
+                None, functools.partial(downloader.download_link, youtube_url, directory_path=filestore_directory))
             async with aiof.open(filepath, 'rb') as f:
                 raw_data = await f.read()
             file_hash = hashlib.md5(raw_data).hexdigest()
@@ -268,6 +392,8 @@ async def process_youtube_video():
                 'work': start_work,
                 'filename': filepath.split('/')[-1]
             })
+    except asyncio.QueueFull:
+        return queue_full_response()
     except Exception as ex:
         eprint("error in youtube dl endpoint")
         eprint(str(ex))
@@ -296,7 +422,9 @@ async def render_prediction_view(background_work):
                 'spectro_uids': list(),
                 'predict_uids': list()
             }
-            if item['md5'] != 'unknown':
+            if 'msg' in item:
+                view_item['msg'] = item['msg']
+            elif item['md5'] != 'unknown':
                 view_item['msg'] = 'Please wait while we are getting your results in the background.'
             else:
                 view_item['msg'] = 'Something went wrong, please try again or use a different file.'
@@ -341,19 +469,26 @@ async def file_upload_handler():
     else:
         batch_id = APP_STATE.session_signer.unsign(batch_id).decode('utf-8')
         eprint(str(batch_id))
-        APP_STATE.batch_store[batch_id] = {
-            'batch_id': batch_id,
-            'time': datetime.datetime.now(),
-            'predictions': dict(),
-            'spectrograms': dict(),
-            'play_clips': dict(),
-            'model_hash': APP_STATE.model_hash
-        }
-    APP_STATE.loop.create_task(clean_up_task_later(batch_id))
     files = (await request.files).getlist("fileUploadForm")
+    # turn the whole upload away up front rather than writing clips that can't be queued, and before the batch is
+    # replaced so the session's queued work can still be collected
+    if not has_queue_capacity(batch_id, len(files)):
+        return queue_full_response()
+    create_batch(batch_id)
     background_work = []
+    queue_full = False
     for f in files:
         data = f.read()
+        if queue_full:
+            # the files queued so far are reported and the rest is marked for retrying instead of failing the
+            # whole upload, which would have the client send the queued files again
+            background_work.append({
+                'md5': 'unknown',
+                'work': tuple(),
+                'filename': f.filename,
+                'msg': QUEUE_FULL_MESSAGE
+            })
+            continue
         if type(data) == bytes:
             try:
                 file_hash = hashlib.md5(data).hexdigest()
@@ -370,6 +505,17 @@ async def file_upload_handler():
                         'work': start_work,
                         'filename': filename
                     })
+                except asyncio.QueueFull:
+                    # another request took the room left when the upload was let in
+                    if len(background_work) == 0:
+                        return queue_full_response()
+                    queue_full = True
+                    background_work.append({
+                        'md5': file_hash,
+                        'work': tuple(),
+                        'filename': filename,
+                        'msg': QUEUE_FULL_MESSAGE
+                    })
                 except Exception as ex:
                     background_work.append({
                         'md5': file_hash,
@@ -400,32 +546,111 @@ async def file_upload_handler():
 
 
 async def long_poll_queuer(queue):
-    then = datetime.datetime.now()
-    while (datetime.datetime.now()-then).total_seconds() < 30:
-        if not queue.empty():
-            return {
-                'work': True,
-                'item': await queue.get()
-            }
-        await asyncio.sleep(0.3)
-    return {'work': False, 'item': None}
+    # the worker is woken up as soon as an item is put on the queue
+    try:
+        item = await asyncio.wait_for(queue.get(), QUEUE_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {'work': False, 'item': None}
+    return {
+        'work': True,
+        'item': item
+    }
 
 
-async def prep_queue_item(data):
+async def long_poll_leaser(queue, max_items):
+    # waits on the first item like long_poll_queuer and then takes whatever else is already queued up to max_items
+    data = await long_poll_queuer(queue)
+    if data['item'] is None:
+        return []
+    items = [data['item']]
+    while len(items) < max_items and not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def get_work_queue(kind):
+    global APP_STATE
+    if kind == 'predictions':
+        return APP_STATE.prediction_queue
+    return APP_STATE.spectrograms_queue
+
+
+def lease_item(kind, item):
+    # the item goes back on its queue unless its result is posted before the lease runs out
+    global APP_STATE
+    release_lease(kind, item['uid'])
+    APP_STATE.leases[(kind, item['uid'])] = APP_STATE.loop.call_later(LEASE_TIMEOUT, expire_lease, kind, item)
+
+
+def release_lease(kind, uid):
+    global APP_STATE
+    lease = APP_STATE.leases.pop((kind, uid), None)
+    if lease is not None:
+        lease.cancel()
+
+
+def expire_lease(kind, item):
+    global APP_STATE
+    APP_STATE.leases.pop((kind, item['uid']), None)
+    if item['batch_id'] not in APP_STATE.batch_store:
+        return
+    if item['uid'] not in APP_STATE.batch_store[item['batch_id']][kind]:
+        return
+    if APP_STATE.batch_store[item['batch_id']][kind][item['uid']][RESULT_FIELDS[kind][0]] is not None:
+        return
+    if not os.path.isfile(item['path']):
+        return
+    eprint("lease on "+kind+" work "+item['uid']+" expired, putting it back on the queue")
+    get_work_queue(kind).requeue(item)
+
+
+async def prep_work_item(item, kind, transfer='inline'):
+    global APP_STATE
+    if transfer == 'reference':
+        # workers that ask for it get a signed url to fetch the raw clip from instead of base64 in the json
+        return {
+            **item,
+            'blob': '/blob/'+kind+'/'+APP_STATE.signer.sign(item['uid']).decode('utf-8')
+        }
+    async with aiof.open(item['path'], 'rb') as f:
+        return {
+            **item,
+            'data': base64.b64encode(await f.read()).decode('utf-8')
+        }
+
+
+async def prep_queue_item(data, kind, transfer='inline'):
+    global APP_STATE
     if data['item'] is None:
         return jsonify(data)
     if 'path' not in data['item']:
         return jsonify(data)
     if not os.path.isfile(data['item']['path']):
         return jsonify(data)
-    async with aiof.open(data['item']['path'], 'rb') as f:
-        data['item']['data'] = base64.b64encode(await f.read()).decode('utf-8')
-    send_back = jsonify(data)
-    del(data['item']['data'])
+    send_back = jsonify({**data, 'item': await prep_work_item(data['item'], kind, transfer)})
     eprint("queue work prepped")
     return send_back
 
 
+async def lease_work(kind, max_items, transfer='inline'):
+    # hands out up to max_items at once so workers can fetch their next batch while they compute the current one
+    global APP_STATE
+    items = await long_poll_leaser(get_work_queue(kind), min(max(max_items, 1), MAX_LEASE_ITEMS))
+    leased_items = []
+    for item in items:
+        if 'path' not in item or not os.path.isfile(item['path']):
+            continue
+        lease_item(kind, item)
+        leased_items.append(await prep_work_item(item, kind, transfer))
+    if len(leased_items) > 0:
+        eprint(str(len(leased_items))+" "+kind+" work items leased")
+    return jsonify({
+        'work': len(leased_items) > 0,
+        'items': leased_items,
+        'lease_timeout': LEASE_TIMEOUT
+    })
+
+
 @app.route('/predictions', methods=['POST'])
 async def get_prediction_work():
     global APP_STATE
@@ -437,9 +662,13 @@ async def get_prediction_work():
             #eprint("validated prediction request")
             predictor_id = APP_STATE.signer.unsign(req_data).decode('utf-8')
             APP_STATE.predictor_connections[predictor_id] = True
+            if 'max_items' in request.args:
+                send_back = await lease_work('predictions', int(request.args['max_items']), request.args.get('transfer', 'inline'))
+                del(APP_STATE.predictor_connections[predictor_id])
+                return send_back
             data = await long_poll_queuer(APP_STATE.prediction_queue)
             del(APP_STATE.predictor_connections[predictor_id])
-            return await prep_queue_item(data)
+            return await prep_queue_item(data, 'predictions', request.args.get('transfer', 'inline'))
     except Exception as ex:
         eprint("error when prepping prediction queue")
         eprint(str(ex))
@@ -458,6 +687,33 @@ async def get_prediction_work():
     })
 
 
+# workers fetch the raw bytes of a clip by the signed uid they were handed with the work item
+@app.route('/blob/<kind>/<token>', methods=['GET'])
+async def get_blob(kind, token):
+    global APP_STATE
+    if kind not in BLOB_STORES:
+        abort(404)
+    try:
+        uid = APP_STATE.signer.unsign(token).decode('utf-8')
+    except itsdangerous.BadSignature:
+        abort(403)
+    path = BLOB_STORES[kind]+'/'+uid+'.'+PCM_EXTENSION
+    if re.match('^[0-9a-f]+$', uid) is None or not os.path.isfile(path):
+        abort(404)
+    async with aiof.open(path, 'rb') as f:
+        raw_data = await f.read()
+    return raw_data, 200, {'Content-Type': 'application/octet-stream'}
+
+
+@app.route('/queuestats', methods=['GET'])
+async def get_queue_stats():
+    global APP_STATE
+    return jsonify({
+        'predictions': APP_STATE.prediction_queue.stats(),
+        'spectrograms': APP_STATE.spectrograms_queue.stats()
+    })
+
+
 @app.route('/predictsafetoreboot', methods=['POST'])
 async def predict_safe_to_reboot():
     req_data = await request.get_data()
@@ -495,9 +751,13 @@ async def get_spectrogram_work():
             #eprint("validated spectrogram request")
             spectrogram_id = APP_STATE.signer.unsign(req_data).decode('utf-8')
             APP_STATE.spectrogram_connections[spectrogram_id] = True
+            if 'max_items' in request.args:
+                send_back = await lease_work('spectrograms', int(request.args['max_items']), request.args.get('transfer', 'inline'))
+                del(APP_STATE.spectrogram_connections[spectrogram_id])
+                return send_back
             data = await long_poll_queuer(APP_STATE.spectrograms_queue)
             del(APP_STATE.spectrogram_connections[spectrogram_id])
-            return await prep_queue_item(data)
+            return await prep_queue_item(data, 'spectrograms', request.args.get('transfer', 'inline'))
     except Exception as ex:
         eprint("error when prepping predispectrogram queue")
         eprint(str(ex))
@@ -530,9 +790,12 @@ async def post_spectrograms():
     req_data = await request.get_data()
     try:
         req_json = APP_STATE.serializer.loads(req_data)
+        release_lease('spectrograms', req_json['uid'])
         if req_json['batch_id'] in APP_STATE.batch_store and req_json['uid'] in APP_STATE.batch_store[req_json['batch_id']]['spectrograms']:
             eprint("spectrogram result from batch id: "+req_json["batch_id"])
             APP_STATE.batch_store[req_json['batch_id']]['spectrograms'][req_json['uid']]['images'] = req_json
+            APP_STATE.batch_store.save_item(req_json['batch_id'], 'spectrograms', req_json['uid'])
+            notify_result('spectrograms', req_json['uid'], req_json['batch_id'])
             try:
                 if os.path.isfile(APP_STATE.batch_store[req_json['batch_id']]['spectrograms'][req_json['uid']]['path']):
                     os.remove(APP_STATE.batch_store[req_json['batch_id']]['spectrograms'][req_json['uid']]['path'])
@@ -562,6 +825,7 @@ async def post_predictions():
     try:
         req_json = APP_STATE.serializer.loads(req_data)
         if 'predictor_id' in req_json and 'predictions' in req_json:
+            release_lease('predictions', req_json['uid'])
             eprint(" ".join(["container", req_json['predictor_id'], "predicted", req_json['predictions']]))
             if req_json['batch_id'] in APP_STATE.batch_store and req_json['uid'] in APP_STATE.batch_store[req_json['batch_id']]['predictions']:
                 eprint("prediction result from batch id: "+req_json["batch_id"])
@@ -578,6 +842,8 @@ async def post_predictions():
                 #     'uid': '84a655b173a84071b09f9e3cc5d4a683'
                 # }
                 APP_STATE.batch_store[req_json['batch_id']]['predictions'][req_json['uid']]['result'] = {x:req_json[x] for x in req_json if x.startswith('predict')}
+                APP_STATE.batch_store.save_item(req_json['batch_id'], 'predictions', req_json['uid'])
+                notify_result('predictions', req_json['uid'], req_json['batch_id'])
                 try:
                     if os.path.isfile(APP_STATE.batch_store[req_json['batch_id']]['predictions'][req_json['uid']]['path']):
                         os.remove(APP_STATE.batch_store[req_json['batch_id']]['predictions'][req_json['uid']]['path'])
@@ -603,7 +869,6 @@ async def post_predictions():
 async def get_prediction_by_uid(uid):
     global APP_STATE
     try:
-        then = datetime.datetime.now()
         batch_id = session.get('batchid')
         if APP_STATE.session_signer.validate(batch_id) is not True:
             return jsonify({
@@ -615,8 +880,12 @@ async def get_prediction_by_uid(uid):
             })
         else:
             batch_id = APP_STATE.session_signer.unsign(batch_id).decode('utf-8')
-        while batch_id not in APP_STATE.batch_store and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
+
+        def result_ready():
+            return batch_id in APP_STATE.batch_store and uid in APP_STATE.batch_store[batch_id].get('predictions', dict()) \
+                and APP_STATE.batch_store[batch_id]['predictions'][uid]['result'] is not None
+
+        await wait_for_result('predictions', uid, result_ready)
         if batch_id not in APP_STATE.batch_store:
             return jsonify({
                 'msg': 'batch id not found',
@@ -625,8 +894,6 @@ async def get_prediction_by_uid(uid):
                 'ready': False,
                 'prediction': None
             })
-        while 'predictions' not in APP_STATE.batch_store[batch_id] and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
         if 'predictions' not in APP_STATE.batch_store[batch_id]:
             return jsonify({
                 'msg': 'predictions not found in data store',
@@ -635,8 +902,6 @@ async def get_prediction_by_uid(uid):
                 'ready': False,
                 'prediction': None
             })
-        while uid not in APP_STATE.batch_store[batch_id]['predictions'] and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
         if uid not in APP_STATE.batch_store[batch_id]['predictions']:
             return jsonify({
                 'msg': 'uid not found',
@@ -645,8 +910,6 @@ async def get_prediction_by_uid(uid):
                 'ready': False,
                 'prediction': None
             })
-        while APP_STATE.batch_store[batch_id]['predictions'][uid]['result'] is None and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
         if APP_STATE.batch_store[batch_id]['predictions'][uid]['result'] is None:
             return jsonify({
                 'batch_id': batch_id,
@@ -657,6 +920,8 @@ async def get_prediction_by_uid(uid):
         else:
             return_value = APP_STATE.batch_store[batch_id]['predictions'][uid]['result']
             del(APP_STATE.batch_store[batch_id]['predictions'][uid])
+            APP_STATE.batch_store.save_item(batch_id, 'predictions', uid)
+            discard_result_event('predictions', uid)
             return jsonify({
                 'batch_id': batch_id,
                 'uid': uid,
@@ -679,7 +944,6 @@ async def get_prediction_by_uid(uid):
 async def get_spectrograms_by_uid(uid):
     global APP_STATE
     try:
-        then = datetime.datetime.now()
         batch_id = session.get('batchid')
         if APP_STATE.session_signer.validate(batch_id) is not True:
             return jsonify({
@@ -691,8 +955,12 @@ async def get_spectrograms_by_uid(uid):
             })
         else:
             batch_id = APP_STATE.session_signer.unsign(batch_id).decode('utf-8')
-        while batch_id not in APP_STATE.batch_store and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
+
+        def result_ready():
+            return batch_id in APP_STATE.batch_store and uid in APP_STATE.batch_store[batch_id].get('spectrograms', dict()) \
+                and APP_STATE.batch_store[batch_id]['spectrograms'][uid]['images'] is not None
+
+        await wait_for_result('spectrograms', uid, result_ready)
         if batch_id not in APP_STATE.batch_store:
             return jsonify({
                 'msg': 'batch id not found',
@@ -701,8 +969,6 @@ async def get_spectrograms_by_uid(uid):
                 'ready': False,
                 'images': None
             })
-        while 'spectrograms' not in APP_STATE.batch_store[batch_id] and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
         if 'spectrograms' not in APP_STATE.batch_store[batch_id]:
             return jsonify({
                 'msg': 'spectrograms not found in data store',
@@ -711,8 +977,6 @@ async def get_spectrograms_by_uid(uid):
                 'ready': False,
                 'images': None
             })
-        while uid not in APP_STATE.batch_store[batch_id]['spectrograms'] and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
         if uid not in APP_STATE.batch_store[batch_id]['spectrograms']:
             return jsonify({
                 'msg': 'uid not found',
@@ -721,8 +985,6 @@ async def get_spectrograms_by_uid(uid):
                 'ready': False,
                 'images': None
             })
-        while APP_STATE.batch_store[batch_id]['spectrograms'][uid]['images'] is None and (datetime.datetime.now() - then).total_seconds() < 15:
-            await asyncio.sleep(0.3)
         if APP_STATE.batch_store[batch_id]['spectrograms'][uid]['images'] is None:
             return jsonify({
                 'batch_id': batch_id,
@@ -733,6 +995,8 @@ async def get_spectrograms_by_uid(uid):
         else:
             return_value = APP_STATE.batch_store[batch_id]['spectrograms'][uid]['images']
             del(APP_STATE.batch_store[batch_id]['spectrograms'][uid])
+            APP_STATE.batch_store.save_item(batch_id, 'spectrograms', uid)
+            discard_result_event('spectrograms', uid)
             return jsonify({
                 'batch_id': batch_id,
                 'uid': uid,
@@ -751,6 +1015,86 @@ async def get_spectrograms_by_uid(uid):
     })
 
 
+def take_batch_result(batch_id, kind, uid):
+    # returns the response for a finished result and removes it from the batch store
+    # the same way the by uid routes do or None if the result isn't ready
+    global APP_STATE
+    field, label = RESULT_FIELDS[kind]
+    items = APP_STATE.batch_store.get(batch_id, dict()).get(kind, dict())
+    if uid not in items or items[uid][field] is None:
+        return None
+    return_value = items[uid][field]
+    del(items[uid])
+    APP_STATE.batch_store.save_item(batch_id, kind, uid)
+    discard_result_event(kind, uid)
+    return {
+        'batch_id': batch_id,
+        'uid': uid,
+        'ready': True,
+        label: return_value
+    }
+
+
+def format_server_sent_event(event, data):
+    return ('event: ' + event + '\ndata: ' + json.dumps(data) + '\n\n').encode('utf-8')
+
+
+async def stream_batch_results(batch_id):
+    global APP_STATE
+    subscriber = asyncio.Queue()
+    APP_STATE.batch_subscribers.setdefault(batch_id, list()).append(subscriber)
+    try:
+        pending = set()
+        if batch_id in APP_STATE.batch_store:
+            for kind in RESULT_FIELDS:
+                for uid in list(APP_STATE.batch_store[batch_id][kind]):
+                    pending.add((kind, uid))
+                    # results that finished before the stream was opened are sent right away
+                    subscriber.put_nowait((kind, uid))
+        then = datetime.datetime.now()
+        while len(pending) > 0 and (datetime.datetime.now() - then).total_seconds() < STREAM_TIMEOUT:
+            try:
+                kind, uid = await asyncio.wait_for(subscriber.get(), STREAM_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            result = take_batch_result(batch_id, kind, uid)
+            if result is None:
+                continue
+            pending.discard((kind, uid))
+            yield format_server_sent_event(kind, result)
+        yield format_server_sent_event('done', {
+            'batch_id': batch_id,
+            'pending': [uid for _, uid in pending]
+        })
+    finally:
+        APP_STATE.batch_subscribers[batch_id].remove(subscriber)
+        if len(APP_STATE.batch_subscribers[batch_id]) == 0:
+            del(APP_STATE.batch_subscribers[batch_id])
+
+
+# one server-sent events stream per batch pushes every prediction and spectrogram
+# as soon as it's posted instead of the browser long polling for each uid
+@app.route('/batchresults', methods=['GET'])
+async def get_batch_results():
+    global APP_STATE
+    batch_id = session.get('batchid')
+    if APP_STATE.session_signer.validate(batch_id) is not True:
+        return jsonify({
+            'msg': 'batch id not validated',
+            'batch_id': batch_id,
+            'ready': False
+        })
+    batch_id = APP_STATE.session_signer.unsign(batch_id).decode('utf-8')
+    response = await make_response(stream_batch_results(batch_id), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None
+    return response
+
+
 # this route and method is dirty, it will hold the connection until it times out
 # or it will return what is being requested. It shouldn't be a problem but 
 # it was expediently coded
@@ -758,7 +1102,6 @@ async def get_spectrograms_by_uid(uid):
 async def get_a_clip():
     global APP_STATE
     try:
-        then = datetime.datetime.now()
         batch_id = session.get('batchid')
         if APP_STATE.session_signer.validate(batch_id) is not True:
             return jsonify({
@@ -769,10 +1112,17 @@ async def get_a_clip():
             })
         else:
             batch_id = APP_STATE.session_signer.unsign(batch_id).decode('utf-8')
-        while 'play_clips' not in APP_STATE.batch_store[batch_id]:
-            await asyncio.sleep(0.3)
-        while len(APP_STATE.batch_store[batch_id]['play_clips'].values()) == 0:
-            await asyncio.sleep(0.3)
+
+        def clip_ready():
+            return batch_id in APP_STATE.batch_store and len(APP_STATE.batch_store[batch_id]['play_clips'].values()) > 0
+
+        if not await wait_for_result('play_clips', batch_id, clip_ready):
+            return jsonify({
+                'msg': 'sample does not exist',
+                'ready': False,
+                'sample': None
+            })
+        discard_result_event('play_clips', batch_id)
         for item in APP_STATE.batch_store[batch_id]['play_clips'].values():
             if 'path' in item:
                 clip = item
@@ -862,7 +1212,15 @@ async def start():
     global APP_STATE
     event_loop = asyncio.get_event_loop()
     APP_STATE = app_state(event_loop)
+    resume_batches()
     event_loop.create_task(watcher())
+    event_loop.create_task(sweeper())
     default_image = b'iVBORw0KGgoAAAANSUhEUgAAACgAAAAoCAYAAACM/rhtAAAAAXNSR0IArs4c6QAAAAlwSFlzAAAOxAAADsQBlSsOGwAAAVlpVFh0WE1MOmNvbS5hZG9iZS54bXAAAAAAADx4OnhtcG1ldGEgeG1sbnM6eD0iYWRvYmU6bnM6bWV0YS8iIHg6eG1wdGs9IlhNUCBDb3JlIDUuNC4wIj4KICAgPHJkZjpSREYgeG1sbnM6cmRmPSJodHRwOi8vd3d3LnczLm9yZy8xOTk5LzAyLzIyLXJkZi1zeW50YXgtbnMjIj4KICAgICAgPHJkZjpEZXNjcmlwdGlvbiByZGY6YWJvdXQ9IiIKICAgICAgICAgICAgeG1sbnM6dGlmZj0iaHR0cDovL25zLmFkb2JlLmNvbS90aWZmLzEuMC8iPgogICAgICAgICA8dGlmZjpPcmllbnRhdGlvbj4xPC90aWZmOk9yaWVudGF0aW9uPgogICAgICA8L3JkZjpEZXNjcmlwdGlvbj4KICAgPC9yZGY6UkRGPgo8L3g6eG1wbWV0YT4KTMInWQAACJdJREFUWAnNWFtvVNcZXec64wtgBxObYPAFbLCJAXMn4SW9kaqtGiXkoYrSVmqlSFWe8hPah771raoqtTw0aRu1oSpSIrWNFEqikJS2qSEJKZdiY7AN+AK+zu3MnK61x2d8PLYTXx6SLZ3ZM+fss/fa6/u+9X17rOSLt0KssYVhCMuyoD7MA7Zb/K57a232WifQ+wJSKITwkhZqGh0UgjnAa51/zQDFGkhUPgvU73Kx+xtJuAQaEvDnzmBkWjFW+ZBlAAbZENsOeAhyohbG7Gthcc0MGvYIpuWIj6nhAi7+KYWGThfr623kc2s39aoBGvZsi6YNjd/VNjno/1cOk3cLGL6eR8tjvgkYbWAtpl41QLMo3U8u2Eowdz8JMHmvAL/KRt/7WVRttLFph4MgU/RR46ursPWqAEaBocUVGMl1Fm6SPdenxDhAejLEQE8OzUd9OC5RCeMqJWdVALWYotRNAM30vf5/55Cdpr85ug/etzBwkY5J8z6yx0MuvXoWVwxwjj2gsds3Jhz6KGc0UEwVfZOyQ3wydWO3ZxgO86uTnRUBNItLlCUrNRbZcdH7XpYiPScpkW9KC4ev5TEzWkATWQ6ok2LUbHAFvrgigGZeLiJ2mo/5mBgqYLQvD4+mpnFhczbLIo2GSn6nP97gBhQs6xtWJzvLBlg03ZysPERZEXsKgkLBQmrGK11hyF0QpONZZhMj/6PscEPK02JxJQGzbICR6eKyMjWcN4Fh2wU899TH+MlL7+CZr18xLBqQHOwwsvv+kUV1nY26VcjOsgAav+HOy2XFp59l0i5OnriKhroZnP5rO7p2DuPpr11DJuMSqGTHQnoixG1GdQtlx16h7CwL4GKykpsJUaC91lVnsKPpAV4504Ge97bhV3/Yg50tY6ioUPAQIVk0skNdFOAtXSuTnc8EOMfefFmRBiowUmQqF9g4tn8QqE3j0J47mKI/pg2DChiO4yoKrF6aunG/hwSFfbmy86kATWAsKSuWYUQsvfrGLnR33MNPX3ob+zvv4rW/tINp2jwv+iLFO5KdMcrO4eXLzqcCLG5/vqyMUVZkMplO4BJ+Htf7avHz3+4Tpfjlq3vRe6sWPu/ruWTHWEHJhM97z2fxcNvyq50lARr2YtVKJCvKtUbmzIJaHPAIRkyNTyQQ0Nyep98CxA+iNj7MG47PMdTOkRvBsqudJQHGZWX74x6Gr+QwMyL2igsXRZlRajOFEYZ6xyleIDBznw8EUpfG2+y9RIj+CxlUb6LsbP/sakdBv6BF7AVM8g0dHJLwcPkcVTbvIzdVNlzoyNo0WcvTpNMpRuk0x3nMfyKwvHF8epwgPyCLFO+xmykzzhBSPpa/FwUYl5WtBxNIjN7B8b3jcIzvLZxFvlZVkUPNugwe6x7ABAGKzUUB8vUgb+GT6xu5+RpsYbWjasirUCW0sKBYADDOXsuxBMKggC9tv4Rci4uR+xVwnQLXFW3Fpm+cFz4ZqyTIXa1jyOQcE8XlBEqWsny2r2MYvz/Thktvr8PeEx7uXglMZW4p9MvaPIAGXCQrtTY2U1RvnJ1B6gkXr7z+KG711tLcAZmJTaSvNHH1hhRefP4/OHW6Cw9GKhk5i5iYPogZH9//7georA7x4HyAmcOukZ2rb2XIIqcuY3EeQAOeC0pUlZYmhvIY6WW18iRQmczBqcwhSYCFGEAFgCK3is8cBopYnK7KwnPJdGyc5lbgTLNPzEa5aJbs7P5WBYY+5nsszZyyQ38piiPTxg9BqlaUS9UEKrq0cHTJ/8x99mohe126H42Jet0T+5Ig0zxgfDCPUcnOEtVOCWBcVswh6L+BOUa6vmajTMg8Ja+PVij2giZ21KzZ3vyIjS+B4jwSbDGvJm1UtbPuYQd1rQtlxwAUe/L7UrWy3kL/P7MmY6RYrciEM+zFjJoYEVj1WkwMSl7MOPbR/fg4vWdApT0TRMrVyNmsGZnPKTsDF7OmCI4SQSQ7BmBcVswhiCe0rKqV0MaRPUOmWjl+YADJJKONEqGFiiCK6c5z83jqK9fRsWMUX328Dy79T+aMj5MFBOrQ4Vs4uncIxw/cRv3mCZZrDvwkcJvVjv50eqSs2rHn2CtWK/LBO5ezCODhUNcQa7urePlMJ5q2TOAHz35IDSt6hRYXe6r7njH14DR+duogOgny2SevlOrBaFw666Jz+6iZ79Rrj6J/cD1+9FwPKrhplW3RIWurqp1q+unsIcsWe/FD0A1GlY6OcuYnjvTjd6934OybbSwGulG/cRqNDZNGywRObKoebGu+j5f/3IlLF7bi13/sMr9L9aBsyxYGFo52D+Kt97fhwrvN+A2LCm22ne9mUq5h8d7VgOZmtXOI7jJ7yLLle9EhaJKJfK5aASamEkZ4pX2bN00xldmYjGUJBYbMpoWOcXGrJkXW72CSWqf7UeAYhFxnZKwCB/m8qn4K7buGjTRJ/G1JEgdp06ba2ekxaGwU9N+O90J/uGGzg93fTKLndAqp+9Qihn+ODlzPMv6F7/QoHqh/ebzx91acI0vGLPQx+ZWyRuvWB3j+25eL6Y0LyYR9AxuM3imAZGb5pLTxe09/hC0EKC1883wT/vZOi/FtHV2VSXKpEB0nEib1fXgmzTPPD/vDfSeTmOL/KtfOZeErJzKquRlkA8fk2LbmMYxypzfpN0mVVoaS4ofxw6xjhLyxYQqD96pYUfumTixJy+x4gZRbNDdOGIY1VvVkvMm9/EoL+05W4NrZDKyWXwyF7V9OYHqEkcexWjACIIbyNF+aAFwm/4Q/P4tEE5txNH+WrPtkyWG+FnPlzdzhR4bz6R2fLJaP0xjh0ClwUqfGuh8PhNIehbjAldBFs3Oi6H5R16IHZb3GRa8vAi4+WiZXW3I+TlRgFOsc7Y7fnjVZRFt8ps/zu3bL5irVmK0Xf3/hPovVzBeNvRhN/wen95nCxxDGAAAAAABJRU5ErkJggg=='
     with open('/opt/static/favicon.png', 'wb') as f:
         f.write(base64.b64decode(default_image))
+
+
+@app.after_serving
+async def stop():
+    shutdown_executors()
+    APP_STATE.batch_store.close()
@@ -0,0 +1,201 @@
+import concurrent.futures
+import heapq
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+
+# seconds a batch is kept for after it was created
+BATCH_TTL = 600
+# the fields of a batch holding its work items and the clips played back in the browser
+ITEM_KINDS = ('predictions', 'spectrograms', 'play_clips')
+
+
+class JobStore:
+    """ Keeps the batches of the sessions in memory along with when each of them expires
+
+    Batches are read and changed in place like the dict this replaces (store[batch_id]['predictions'][uid]) and
+    save_item(batch_id, kind, uid) is called after adding, changing or removing one of their items. Expiry times are indexed by batch id and kept in a heap so pop_expired
+    only looks at the batches that are due; an entry whose batch was created again or deleted is skipped when it comes
+    up instead of being searched for and removed from the heap.
+    """
+
+    def __init__(self, ttl=BATCH_TTL):
+        self.ttl = ttl
+        self.batches = dict()
+        self.expiry_index = dict()
+        self.expiry_heap = []
+
+    def __contains__(self, batch_id):
+        return batch_id in self.batches
+
+    def __getitem__(self, batch_id):
+        return self.batches[batch_id]
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def get(self, batch_id, default=None):
+        return self.batches.get(batch_id, default)
+
+    def create(self, batch_id, batch):
+        """ Stores a new batch, replacing any batch with the same id, that expires ttl seconds from now """
+        self.batches[batch_id] = batch
+        self.set_expiry(batch_id, time.time() + self.ttl)
+        self.save(batch_id)
+
+    def set_expiry(self, batch_id, expires_at):
+        self.expiry_index[batch_id] = expires_at
+        heapq.heappush(self.expiry_heap, (expires_at, batch_id))
+
+    def save(self, batch_id):
+        """ Persists a batch apart from its items; batches only live in memory in this store """
+        pass
+
+    def save_item(self, batch_id, kind, uid):
+        """ Persists a single item of a batch or forgets it if it was removed from the batch """
+        pass
+
+    def delete(self, batch_id):
+        self.expiry_index.pop(batch_id, None)
+        return self.batches.pop(batch_id, None)
+
+    def pop_expired(self, now=None):
+        """ Removes every batch that has expired and returns them as (batch_id, batch) pairs """
+        now = time.time() if now is None else now
+        expired = []
+        while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] <= now:
+            expires_at, batch_id = heapq.heappop(self.expiry_heap)
+            if self.expiry_index.get(batch_id) != expires_at:
+                continue
+            expired.append((batch_id, self.delete(batch_id)))
+        return expired
+
+    def load(self):
+        """ Reads back the batches persisted before a restart and returns their ids """
+        return []
+
+    def close(self):
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    """ A JobStore that writes saved batches and items through to a SQLite database so batches outlive a restart
+
+    Batches are still read from memory; the database is only read from by load. Each item is its own row so saving a
+    finished result writes that result alone rather than the whole batch with the images of every result before it.
+    Rows are pickled when they're saved and written on a single writer thread that commits everything saved since its
+    last commit at once, so saves never wait on the disk.
+    """
+
+    def __init__(self, path, ttl=BATCH_TTL):
+        super().__init__(ttl)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        # only used by the writer thread once load has run
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # the write ahead log keeps the many small writes from syncing the whole database each time
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, data BLOB NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS batches_expires_at ON batches (expires_at)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS items (batch_id TEXT NOT NULL, kind TEXT NOT NULL, uid TEXT NOT NULL, '
+            'data BLOB NOT NULL, PRIMARY KEY (batch_id, kind, uid))')
+        self.connection.commit()
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending_writes = []
+        self.pending_lock = threading.Lock()
+
+    def _write(self, statement, parameters):
+        with self.pending_lock:
+            self.pending_writes.append((statement, parameters))
+            if len(self.pending_writes) == 1:
+                self.writer.submit(self._flush)
+
+    def _flush(self):
+        with self.pending_lock:
+            writes, self.pending_writes = self.pending_writes, []
+        try:
+            with self.connection:
+                for statement, parameters in writes:
+                    self.connection.execute(statement, parameters)
+        except Exception as ex:
+            print("failed to write {0} job store changes: {1}".format(len(writes), ex), file=sys.stderr)
+
+    def create(self, batch_id, batch):
+        # the items of the batch this one replaces go with it
+        self._write('DELETE FROM items WHERE batch_id = ?', (batch_id,))
+        super().create(batch_id, batch)
+        for kind in ITEM_KINDS:
+            for uid in batch.get(kind, dict()):
+                self.save_item(batch_id, kind, uid)
+
+    def save(self, batch_id):
+        if batch_id not in self.batches:
+            return
+        batch = {key: value for key, value in self.batches[batch_id].items() if key not in ITEM_KINDS}
+        self._write(
+            'INSERT OR REPLACE INTO batches (batch_id, expires_at, data) VALUES (?, ?, ?)',
+            (batch_id, self.expiry_index[batch_id], pickle.dumps(batch)))
+
+    def save_item(self, batch_id, kind, uid):
+        item = self.batches.get(batch_id, dict()).get(kind, dict()).get(uid)
+        if item is None:
+            self._write('DELETE FROM items WHERE batch_id = ? AND kind = ? AND uid = ?', (batch_id, kind, uid))
+        else:
+            self._write(
+                'INSERT OR REPLACE INTO items (batch_id, kind, uid, data) VALUES (?, ?, ?, ?)',
+                (batch_id, kind, uid, pickle.dumps(item)))
+
+    def delete(self, batch_id):
+        self._write('DELETE FROM batches WHERE batch_id = ?', (batch_id,))
+        self._write('DELETE FROM items WHERE batch_id = ?', (batch_id,))
+        return super().delete(batch_id)
+
+    def load(self):
+        batch_ids = []
+        now = time.time()
+        for batch_id, expires_at, data in self.connection.execute('SELECT batch_id, expires_at, data FROM batches'):
+            batch = pickle.loads(data)
+            for kind in ITEM_KINDS:
+                batch.setdefault(kind, dict())
+            self.batches[batch_id] = batch
+            self.set_expiry(batch_id, expires_at)
+            # batches that expired while the frontend was down go out with the next sweep instead of being resumed
+            if expires_at > now:
+                batch_ids.append(batch_id)
+        for batch_id, kind, uid, data in self.connection.execute('SELECT batch_id, kind, uid, data FROM items'):
+            if batch_id in self.batches:
+                self.batches[batch_id][kind][uid] = pickle.loads(data)
+        return batch_ids
+
+    def close(self):
+        # waits for the writes still pending
+        self.writer.shutdown(wait=True)
+        self.connection.close()
+
+
+def open_job_store(path=None, ttl=BATCH_TTL):
+    """ Opens a SQLite job store at path or an in-memory one without a path """
+    if path is None or path == '':
+        return JobStore(ttl)
+    return SQLiteJobStore(path, ttl)
+
+
+def get_batch_paths(batch):
+    """ The paths of the clip files of every item in a batch """
+    paths = []
+    for kind in ITEM_KINDS:
+        for item in batch.get(kind, dict()).values():
+            if 'path' in item:
+                paths.append(item['path'])
+    return paths
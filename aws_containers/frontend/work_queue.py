@@ -0,0 +1,112 @@
+import asyncio
+import collections
+import time
+import numpy as np
+
+# work items are grouped by the batch id of the session they came from
+OWNER_KEY = 'batch_id'
+# when an item was first queued; kept on the item so work that's requeued after a lease expires or a restart keeps
+# counting its wait from then
+QUEUED_AT_KEY = 'queued_at'
+# how many of the latest queue wait times the stats are computed from
+WAIT_TIME_SAMPLES = 1000
+
+
+class FairWorkQueue(asyncio.Queue):
+    """ A bounded asyncio queue that serves the sessions it holds work for round robin
+
+    Items are kept in one line per owner (the batch id of the session they came from) and every get takes the next
+    item of the owner at the front and sends that owner to the back, so a session that queued 50 clips only gets every
+    n-th turn when n sessions are waiting instead of making everyone else wait behind it. maxsize bounds the items
+    across all owners and max_per_owner the items of a single owner; put_nowait raises asyncio.QueueFull past either.
+    """
+
+    def __init__(self, maxsize=0, max_per_owner=0):
+        self.max_per_owner = max_per_owner
+        self.enqueued = 0
+        self.dequeued = 0
+        self.rejected = 0
+        self.requeued = 0
+        self.wait_times = collections.deque(maxlen=WAIT_TIME_SAMPLES)
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        # owner to its items and the times they were queued at, in the order the owners are served in
+        self._queue = collections.OrderedDict()
+        self._size = 0
+        # set while requeue puts an item so it goes to the front of its owner's line past the size limits
+        self._requeueing = False
+
+    def _put(self, item):
+        owner = item[OWNER_KEY]
+        if not self._requeueing:
+            item[QUEUED_AT_KEY] = time.time()
+            self._queue.setdefault(owner, collections.deque()).append((item[QUEUED_AT_KEY], item))
+            self.enqueued += 1
+        else:
+            self._queue.setdefault(owner, collections.deque()).appendleft((item.get(QUEUED_AT_KEY, time.time()), item))
+            self._queue.move_to_end(owner, last=False)
+            self.requeued += 1
+        self._size += 1
+
+    def _get(self):
+        owner, items = next(iter(self._queue.items()))
+        queued_at, item = items.popleft()
+        if len(items) > 0:
+            self._queue.move_to_end(owner)
+        else:
+            del(self._queue[owner])
+        self._size -= 1
+        self.dequeued += 1
+        self.wait_times.append(time.time() - queued_at)
+        return item
+
+    def qsize(self):
+        return self._size
+
+    def owner_size(self, owner):
+        return len(self._queue.get(owner, tuple()))
+
+    def has_capacity(self, owner, count=1):
+        if self.maxsize > 0 and self._size + count > self.maxsize:
+            return False
+        return self.max_per_owner <= 0 or self.owner_size(owner) + count <= self.max_per_owner
+
+    def full(self):
+        return not self._requeueing and super().full()
+
+    def put_nowait(self, item):
+        if not self._requeueing and not self.has_capacity(item[OWNER_KEY]):
+            self.rejected += 1
+            raise asyncio.QueueFull
+        super().put_nowait(item)
+
+    def requeue(self, item):
+        """ Puts an item that was already let in back at the front of its owner's line, past the size limits
+
+        Used for work a worker leased and never finished so it's picked up again before anything queued after it; its
+        owner is served next and the item's wait still counts from when it was first queued
+        """
+        self._requeueing = True
+        try:
+            self.put_nowait(item)
+        finally:
+            self._requeueing = False
+
+    def stats(self):
+        now = time.time()
+        oldest = [items[0][0] for items in self._queue.values()]
+        wait_times = list(self.wait_times)
+        return {
+            'depth': self._size,
+            'maxsize': self.maxsize,
+            'max_per_owner': self.max_per_owner,
+            'owners': len(self._queue),
+            'enqueued': self.enqueued,
+            'dequeued': self.dequeued,
+            'rejected': self.rejected,
+            'requeued': self.requeued,
+            'oldest_wait_seconds': now - min(oldest) if len(oldest) > 0 else 0.0,
+            'wait_p50_seconds': float(np.percentile(wait_times, 50)) if len(wait_times) > 0 else None,
+            'wait_p95_seconds': float(np.percentile(wait_times, 95)) if len(wait_times) > 0 else None
+        }
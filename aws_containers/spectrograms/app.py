@@ -15,12 +15,16 @@ import numpy as np
 import pandas as pd
 from genreml.model.processing.audio import AudioFile
 from genreml.model.processing.audio_features import SpectrogramGenerator
+from genreml.model.processing.cache import FeatureCache, hash_bytes
+from genreml.model.processing.config import FeatureExtractorConfig
+from genreml.model.processing.pcm import decode_pcm, is_pcm
+from genreml.model.processing.spectral import SpectralEngine
 from PIL import Image
 from quart import Quart, request, jsonify, abort, redirect, url_for
 import aiofiles as aiof
+from compute import run_cpu, shutdown_executors
+from service_client import close_services, get_service
 import datetime
-import httpx
-import dns.resolver as resolver
 import random
 import decimal
 import math
@@ -42,36 +46,22 @@ class app_state:
         self.signer = itsdangerous.Signer(os.environ['GENREML_SIGNING_TOKEN'])
         self.serializer = itsdangerous.Serializer(os.environ['GENREML_SIGNING_TOKEN'])
         self.uid = str(uuid.uuid4())
+        # images already generated for the same audio are served from here instead of being rendered again
+        self.feature_cache = FeatureCache(directory=os.environ.get('GENREML_CACHE_DIR', '/opt/cache'))
 
 
 app = Quart(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024
-
-
-def get_srv_record_url(port_key, address_key, schema_key, test_endpoint=True):
-    srv_schema = os.environ[schema_key]
-    srv_address = os.environ[address_key]
-    srv_url = srv_schema+"://"+os.environ[address_key]
-    if port_key in os.environ:
-        srv_url += ":"+os.environ[port_key]
-    try:
-        resolve_service_url = resolver.query(srv_address, 'SRV')
-        srv_address = re.split('\s+', resolve_service_url.rrset.to_text())[-1].strip('.')
-        srv_url = srv_schema+"://"+re.split('\s+', resolve_service_url.rrset.to_text())[-1].strip('.')
-        if port_key in os.environ:
-            srv_url += ":"+os.environ[port_key]
-        if test_endpoint:
-            req_test = requests.get(srv_url+"/test")
-            req_test.raise_for_status()
-    except Exception as ex:
-        eprint("exception in get srv record")
-        eprint(str(ex))
-        # in most cases this is likely to be the wrong url
-        srv_url = srv_schema+"://"+os.environ[address_key]
-        if port_key in os.environ:
-            srv_url += ":"+os.environ[port_key]
-        pass
-    return srv_url
+# audio sent as the raw file with a signature of its digest instead of base64 in signed json
+AUDIO_CONTENT_TYPE = 'application/octet-stream'
+# how many clips are leased from the frontend at once, the next lease is fetched while these are rendered
+LEASE_SIZE = int(os.environ.get('GENREML_LEASE_SIZE', '4'))
+# only the first MIN_CLIP_LENGTH seconds of a clip are drawn
+MIN_CLIP_LENGTH = 29
+# the spectrograms drawn for a work item that doesn't ask for a single spectro_type and the size of the model input
+SPECTRO_TYPES = ("melspectrogram", "chromagram", "dbspectrogram")
+IMG_WIDTH = 335
+IMG_HEIGHT = 200
 
 
 # simple logging snippet from https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
@@ -84,105 +74,139 @@ async def test_server():
     return jsonify({'msg': 'server up'})
 
 
-async def gen_spectrogram(raw_data, file_location, spectro_type="melspectrogram"):
-    MIN_CLIP_LENGTH = 29
-    cleanup_paths = []
-    images = {}
-    file_uid = str(uuid.uuid4())
-    audio_signal, sample_rate = librosa.load(file_location)
-    # length of song in seconds
-    length = len(audio_signal) / sample_rate
-    # assert song length greater than or equal to minimum
-    if length >= MIN_CLIP_LENGTH:
-        clip_index = int(sample_rate * MIN_CLIP_LENGTH)
-        audio_signal = audio_signal[:clip_index]
-    spectrogram = SpectrogramGenerator(audio_signal, sample_rate)
-    # spectrogram
-    if spectro_type == "melspectrogram":
-        spectrogram.spectrogram_type = "melspectrogram"
-        mel_spect = spectrogram._create_db_melspectrogram_data(spectrogram.audio_signal, spectrogram.sample_rate)
-        norm_mel_spect = spectrogram.normalize(mel_spect)
-        eight_bit_spectrogram = spectrogram.convert_pixels_to_8_bits(norm_mel_spect)
-        final_spectrogram = spectrogram.flip_and_invert(eight_bit_spectrogram)
-    elif spectro_type == "chromagram":
-        spectrogram.spectrogram_type = "chromagram"
-        chroma_spect = spectrogram._create_chromagram_data(spectrogram.audio_signal, spectrogram.sample_rate)
-        final_spectrogram = chroma_spect
-    elif spectro_type == "dbspectrogram":
-        spectrogram.spectrogram_type = "dbspectrogram"
-        db_spect = spectrogram._create_db_spectrogram_data(spectrogram.audio_signal)
-        final_spectrogram = db_spect
-    else:
-        return await gen_spectrogram(raw_data, file_location, "melspectrogram")
-    # matplot 1
+def read_audio_upload(req_data):
+    # returns the audio and its extension or None if the request has no audio
+    if request.mimetype == AUDIO_CONTENT_TYPE:
+        if APP_STATE.signer.unsign(request.headers.get('X-Genreml-Signature', '')).decode('utf-8') != hash_bytes(req_data):
+            raise itsdangerous.BadSignature('audio does not match its signature')
+        return (req_data, request.headers.get('X-Genreml-Ext', 'music_file'))
+    req_json = APP_STATE.serializer.loads(req_data)
+    if 'data' not in req_json or 'ext' not in req_json:
+        return None
+    return (base64.b64decode(req_json['data']), req_json['ext'])
+
+
+async def get_work_audio(item):
+    # older frontends inline the clip as base64 and newer ones hand out a reference to it that's
+    # either a path on a store shared with this container or a signed url on the frontend
+    if 'data' in item:
+        return base64.b64decode(item.pop('data'))
+    if os.environ.get('GENREML_SHARED_STORE') == 'true' and os.path.isfile(item.get('path', '')):
+        async with aiof.open(item['path'], 'rb') as f:
+            return await f.read()
+    blob = await get_service('frontend').get(item['blob'], timeout=60.0)
+    blob.raise_for_status()
+    return blob.content
+
+
+def load_audio(raw_data, file_location, **kwargs):
+    # decoded clips from the frontend are used as they are without decoding or resampling them again,
+    # wav and the other formats libsndfile reads are decoded straight from memory
+    # and the rest (mp3) go through audioread which needs a file on disk
+    if is_pcm(raw_data):
+        audio_signal, sample_rate = decode_pcm(raw_data)
+        if kwargs.get('duration') is not None:
+            audio_signal = audio_signal[:int(kwargs['duration'] * sample_rate)]
+        return audio_signal, sample_rate
+    try:
+        return librosa.load(io.BytesIO(raw_data), **kwargs)
+    except Exception:
+        pass
+    with open(file_location, 'wb') as f:
+        f.write(raw_data)
+    try:
+        return librosa.load(file_location, **kwargs)
+    finally:
+        os.remove(file_location)
+
+
+def compute_spectrogram_views(raw_data, file_location, spectro_types):
+    # one decode and one stft at the hop length of the images give the data of every view
+    audio_signal, sample_rate = load_audio(raw_data, file_location, duration=MIN_CLIP_LENGTH)
+    audio_signal = audio_signal[:int(sample_rate * MIN_CLIP_LENGTH)]
+    spectral_engine = SpectralEngine(audio_signal, sample_rate, base_hop_length=FeatureExtractorConfig.HOP_LENGTH)
+    spectrogram = SpectrogramGenerator(audio_signal, sample_rate, spectral_engine=spectral_engine)
+    views = dict()
+    for spectro_type in spectro_types:
+        spectrogram.spectrogram_type = spectro_type
+        views[spectro_type] = spectrogram._create_spectrogram_data()
+    return views
+
+
+def draw_spectrogram(spectrogram_data, cmap=None):
     fig = plt.figure(frameon=False)
     ax = plt.Axes(fig, [0., 0., 1., 1.])
     ax.set_axis_off()
     fig.add_axes(ax)
-    # save file 1
-    temp = ax.imshow(final_spectrogram, aspect='auto', cmap='Greys')
-    fig.savefig(file_uid+'_g'+'.png')
-    cleanup_paths.append(file_uid+'_g'+'.png')
+    ax.imshow(spectrogram_data, aspect='auto', cmap=cmap)
+    image_file = io.BytesIO()
+    fig.savefig(image_file, format='png')
     plt.close(fig)
-    # matplot 2
-    fig2 = plt.figure(frameon=False)
-    ax2 = plt.Axes(fig2, [0., 0., 1., 1.])
-    ax2.set_axis_off()
-    fig2.add_axes(ax2)
-    # save file 2
-    temp2 = ax2.imshow(final_spectrogram, aspect='auto')
-    fig2.savefig(file_uid+'_c'+'.png')
-    cleanup_paths.append(file_uid+'_c'+'.png')
-    plt.close(fig2)
-    # shape image for NN
-    dest = file_uid+'_g'+'.png'
-    img_width = 335
-    img_height = 200
-    img = Image.open(dest).convert('L')
+    return image_file.getvalue()
+
+
+def render_view_images(spectrogram_data):
+    # the grayscale and color images of a view and the grayscale one shaped for the model, all encoded in memory
+    grayscale = draw_spectrogram(spectrogram_data, 'Greys')
+    color = draw_spectrogram(spectrogram_data)
+    img = Image.open(io.BytesIO(grayscale)).convert('L')
     img = img.crop((55, 50, 390, 250))
-    img = img.resize((img_width, img_height))
-    img.save(file_uid+'_input'+'.png')
-    cleanup_paths.append(file_uid+'_input'+'.png')
-    img_array = np.array(img, dtype=np.float32)
-    # refactor with aio files later
-    async with aiof.open(file_uid+'_g'+'.png', 'rb') as gray:
-        images['grayscale_original'] = base64.b64encode(await gray.read()).decode('utf-8')
-    async with aiof.open(file_uid+'_c'+'.png', 'rb') as color:
-        images['original_color'] = base64.b64encode(await color.read()).decode('utf-8')
-    async with aiof.open(file_uid+'_input'+'.png', 'rb') as shaped:
-        images['image'] = base64.b64encode(await shaped.read()).decode('utf-8')
-    for path in cleanup_paths:
-        try:
-            if os.path.isfile(path):
-                os.remove(path)
-        except Exception as ex:
-            eprint(str(ex))
-            pass
+    img = img.resize((IMG_WIDTH, IMG_HEIGHT))
+    shaped = io.BytesIO()
+    img.save(shaped, format='png')
+    return {
+        'grayscale_original': base64.b64encode(grayscale).decode('utf-8'),
+        'original_color': base64.b64encode(color).decode('utf-8'),
+        'image': base64.b64encode(shaped.getvalue()).decode('utf-8')
+    }
+
+
+async def gen_spectrograms(raw_data, file_location, spectro_types=SPECTRO_TYPES):
+    # returns the images of each of the spectro_types; the clip is decoded and transformed once for the
+    # views that aren't cached and those are drawn in parallel in the compute process pool
+    data_hash = hash_bytes(raw_data)
+    images = dict()
+    cache_keys = dict()
+    for spectro_type in spectro_types:
+        cache_keys[spectro_type] = APP_STATE.feature_cache.make_key(
+            data_hash, "spectrogram_images", min_clip_length=MIN_CLIP_LENGTH, spectro_type=spectro_type)
+        cached_images = APP_STATE.feature_cache.get(cache_keys[spectro_type])
+        if cached_images is not None:
+            images[spectro_type] = cached_images
+    missing_types = [spectro_type for spectro_type in spectro_types if spectro_type not in images]
+    if len(missing_types) == 0:
+        return images
+    views = await run_cpu(compute_spectrogram_views, raw_data, file_location, missing_types)
+    rendered = await asyncio.gather(*[run_cpu(render_view_images, views[spectro_type]) for spectro_type in missing_types])
+    for spectro_type, view_images in zip(missing_types, rendered):
+        APP_STATE.feature_cache.put(cache_keys[spectro_type], view_images)
+        images[spectro_type] = view_images
     return images
 
 
+async def gen_spectrogram(raw_data, file_location, spectro_type="melspectrogram"):
+    if spectro_type not in SPECTRO_TYPES:
+        spectro_type = "melspectrogram"
+    images = await gen_spectrograms(raw_data, file_location, [spectro_type])
+    return images[spectro_type]
+
+
 async def handle_spectrogram_request(req_data, spectro_type):
     global APP_STATE
     try:
-        req_json = APP_STATE.serializer.loads(req_data)
+        upload = read_audio_upload(req_data)
     except Exception as ex:
         eprint(str(ex))
         return jsonify({
             'msg': 'payload did not have valid signature',
             'ex': str(ex)
             })
-    if 'data' in req_json and 'ext' in req_json:
-        data = req_json['data']
-        cleanup_paths = []
+    if upload is not None:
+        raw_data, ext = upload
         try:
             # this will be audio
-            raw_data = base64.b64decode(data)
             file_uid = str(uuid.uuid4()).replace('-', '')
-            upload_path = file_uid+'.'+req_json['ext']
-            async with aiof.open(upload_path, 'wb') as f:
-                await f.write(raw_data)
-            cleanup_paths.append(upload_path)
-            file_location = file_uid+'.'+req_json['ext']
+            file_location = file_uid+'.'+ext
             return_data = await gen_spectrogram(raw_data, file_location, spectro_type)
         except Exception as ex:
             eprint(str(ex))
@@ -191,13 +215,6 @@ async def handle_spectrogram_request(req_data, spectro_type):
                 'ex': str(ex)
             }
             pass
-        try:
-            for path in cleanup_paths:
-                if os.path.isfile(path):
-                    os.remove(path)
-        except Exception as ex:
-            eprint(str(ex))
-            pass
         return return_data
     return {'msg':'something went wrong'}
 
@@ -244,30 +261,29 @@ async def handle_work_queue_spectrograms(work):
         ext = work['ext']
     else:
         ext = 'music_file'
-    raw_data = base64.b64decode(item['data'])
-    del(item['data'])
     del(work['item'])
+    post_data = await handle_work_item(item, ext)
+    if post_data[0] is not True:
+        return post_data
+    return (True, {**post_data[1], **work})
+
+
+async def handle_work_item(item, ext='music_file'):
+    global APP_STATE
     uid = str(uuid.uuid4())
     file_location = uid+'.'+ext
     try:
-        async with aiof.open(file_location, 'wb') as f:
-            await f.write(raw_data)
+        raw_data = await get_work_audio(item)
         if 'spectro_type' not in item:
-            return_data = [{spec_type: await gen_spectrogram(raw_data, file_location, spec_type)} for spec_type in ["melspectrogram", "chromagram", "dbspectrogram"]]
+            images = await gen_spectrograms(raw_data, file_location)
+            return_data = [{spec_type: images[spec_type]} for spec_type in SPECTRO_TYPES]
         if 'spectro_type' in item:
             return_data = await gen_spectrogram(raw_data, file_location, item['spectro_type'])
     except Exception as ex:
         eprint(str(ex))
         return (False, dict())
         pass
-    try:
-        if os.path.isfile(file_location):
-            os.remove(file_location)
-    except Exception as ex:
-        eprint(str(ex))
-        return (False, dict())
-        pass
-    return (True, {**item, **work, 'spectrograms': return_data})
+    return (True, {**item, 'spectrograms': return_data})
 
 
 async def watcher(event_loop):
@@ -297,34 +313,51 @@ async def watcher(event_loop):
 
 async def check_before_exit():
     global APP_STATE
-    async with httpx.AsyncClient() as client:
-        check = await client.post(get_srv_record_url('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA', False)+'/spectrogramsafetoreboot', data=APP_STATE.signer.sign(APP_STATE.uid), timeout=60.0)
-        check = check.json()
-        return check["safe"]
+    check = await get_service('frontend').post('/spectrogramsafetoreboot', data=APP_STATE.signer.sign(APP_STATE.uid), timeout=60.0)
+    check = check.json()
+    return check["safe"]
 
 
-async def single_pull():
+async def lease_work():
+    global APP_STATE
+    work = await get_service('frontend').post('/spectrograms?transfer=reference&max_items='+str(LEASE_SIZE), data=APP_STATE.signer.sign(APP_STATE.uid), timeout=600.0)
+    work.raise_for_status()
+    work = work.json()
+    if work.get('work') is not True:
+        return []
+    if 'items' in work:
+        return work['items']
+    # frontends without leases answer with a single item
+    if work.get('item') is not None:
+        return [work['item']]
+    return []
+
+
+async def handle_lease(items):
     global APP_STATE
-    async with httpx.AsyncClient() as client:
+    for item in items:
+        post_data = await handle_work_item(item)
+        if post_data[0] is not True:
+            continue
         try:
-            work = await client.post(get_srv_record_url('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA', False)+'/spectrograms', data=APP_STATE.signer.sign(APP_STATE.uid), timeout=600.0)
-            work.raise_for_status()
+            send_back = await get_service('frontend').post('/finishedspectrograms', data=APP_STATE.serializer.dumps(post_data[1]), timeout=600.0)
+            send_back.raise_for_status()
         except Exception as ex:
-            eprint("error single_pull get work call")
+            # the frontend puts the clip back on its queue once the lease runs out
+            eprint("error in posting spectrogram results")
             eprint(str(ex))
-            await asyncio.sleep(0.5)
-            return
-        post_data = await handle_work_queue_spectrograms(work.json())
-        if post_data[0] is True:
-            post_data = post_data[1]
-            async with httpx.AsyncClient() as client:
-                try:
-                    send_back = await client.post(get_srv_record_url('GENREML_FRONTEND_PORT', 'GENREML_FRONTEND_ADDRESS', 'GENREML_FRONTEND_SCHEMA', False)+'/finishedspectrograms', data=APP_STATE.serializer.dumps(post_data), timeout=600.0)
-                    send_back.raise_for_status()
-                except Exception as ex:
-                    eprint("error in posting spectrogram results")
-                    eprint(str(ex))
-                    return
+
+
+async def single_pull():
+    global APP_STATE
+    try:
+        items = await lease_work()
+    except Exception as ex:
+        eprint("error single_pull get work call")
+        eprint(str(ex))
+        await asyncio.sleep(0.5)
+        return
+    await handle_lease(items)
 
 
 async def puller():
@@ -332,8 +365,22 @@ async def puller():
     run_limit = 10
     if 'RUN_LIMIT' in os.environ and (re.match("^[0-9]+$", os.environ['RUN_LIMIT']) is not None):
         run_limit = int(os.environ['RUN_LIMIT'])
+    next_lease = None
     for i in range(run_limit):
-        await single_pull()
+        try:
+            if next_lease is None:
+                next_lease = APP_STATE.loop.create_task(lease_work())
+            lease, next_lease = next_lease, None
+            items = await lease
+        except Exception as ex:
+            eprint("error puller get work call")
+            eprint(str(ex))
+            await asyncio.sleep(0.5)
+            continue
+        # the next lease is fetched while this one's spectrograms are rendered
+        if len(items) > 0 and i + 1 < run_limit:
+            next_lease = APP_STATE.loop.create_task(lease_work())
+        await handle_lease(items)
 
 
 event_loop = None
@@ -346,3 +393,9 @@ async def start():
     APP_STATE = app_state(event_loop)
     if 'ENABLE_PULL_SERVICE' in os.environ and os.environ['ENABLE_PULL_SERVICE'] == 'true':
         event_loop.create_task(watcher(event_loop))
+
+
+@app.after_serving
+async def stop():
+    await close_services()
+    shutdown_executors()
@@ -0,0 +1,83 @@
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import sys
+
+# how many processes decode, extract features and render images (librosa, matplotlib, PIL) off the event loop
+CPU_WORKERS = max(1, int(os.environ.get('GENREML_CPU_WORKERS', str(os.cpu_count() or 1))))
+# how many threads call the model; one keeps keras from being called concurrently
+INFERENCE_THREADS = max(1, int(os.environ.get('GENREML_INFERENCE_THREADS', '1')))
+# pool processes are spawned because forking a process with tensorflow or event loop threads running can deadlock
+CPU_START_METHOD = os.environ.get('GENREML_CPU_START_METHOD', 'spawn')
+
+
+# simple logging snippet from https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+class ComputeExecutors:
+    """ The process pool DSP work runs in and the thread inference runs on so neither blocks the event loop
+
+    Both are created on first use. Functions sent to the process pool and their arguments and results have to be
+    picklable, so they have to be module level functions; a pool broken by a crashed process is replaced on the next
+    call.
+    """
+
+    def __init__(self, cpu_workers=CPU_WORKERS, inference_threads=INFERENCE_THREADS):
+        self.cpu_workers = cpu_workers
+        self.inference_threads = inference_threads
+        self.cpu_pool = None
+        self.inference_pool = None
+
+    def get_cpu_pool(self):
+        if self.cpu_pool is None:
+            self.cpu_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.cpu_workers, mp_context=multiprocessing.get_context(CPU_START_METHOD))
+        return self.cpu_pool
+
+    def get_inference_pool(self):
+        if self.inference_pool is None:
+            self.inference_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.inference_threads, thread_name_prefix='inference')
+        return self.inference_pool
+
+    async def run_cpu(self, func, *args, **kwargs):
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.get_cpu_pool(), functools.partial(func, *args, **kwargs))
+        except concurrent.futures.process.BrokenProcessPool:
+            eprint("compute process pool broke, starting a new one")
+            self.cpu_pool = None
+            raise
+
+    async def run_inference(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.get_inference_pool(), functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown(wait=False)
+            self.cpu_pool = None
+        if self.inference_pool is not None:
+            self.inference_pool.shutdown(wait=False)
+            self.inference_pool = None
+
+
+COMPUTE_EXECUTORS = ComputeExecutors()
+
+
+async def run_cpu(func, *args, **kwargs):
+    """ Runs a module level function in the process pool shared by the whole process """
+    return await COMPUTE_EXECUTORS.run_cpu(func, *args, **kwargs)
+
+
+async def run_inference(func, *args, **kwargs):
+    """ Runs a model call on the inference thread shared by the whole process """
+    return await COMPUTE_EXECUTORS.run_inference(func, *args, **kwargs)
+
+
+def shutdown_executors():
+    COMPUTE_EXECUTORS.shutdown()
@@ -0,0 +1,13 @@
+# Builds a wheel of genreml from this checkout into the build context of every container that installs the package,
+# so the images run the same genreml as the service code they're built with. Run it from the root of the repo before
+# building the frontend, fma_features or spectrograms images.
+for container in frontend fma_features spectrograms; do
+  rm -rf "aws_containers/$container/genreml_dist"
+  {
+    python setup.py bdist_wheel -d "aws_containers/$container/genreml_dist"
+  } ||
+  {
+    python3 setup.py bdist_wheel -d "aws_containers/$container/genreml_dist"
+  }
+done
+rm -rf ./build ./*.egg-info
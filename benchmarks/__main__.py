@@ -0,0 +1,70 @@
+# Name: __main__.py
+# Description: command line entry point of the benchmark suite; run with python -m benchmarks
+
+import argparse
+import logging
+import sys
+
+from tabulate import tabulate
+
+from benchmarks import harness, stages
+
+
+def parse_args():
+    """ Parses the arguments passed in via the command line """
+    parser = argparse.ArgumentParser(description='benchmark the genreml processing and inference hot paths')
+    parser.add_argument('operation', choices=['run', 'compare'], help='''the operation to perform:
+    run - time every stage and save the results as JSON
+    compare - compare the results of two runs and fail if any stage got slower than the threshold
+    ''')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='where to save the results of a run')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='how many timed calls to make to each stage')
+    parser.add_argument('-wu', '--warmup', type=int, default=1, help='how many untimed calls to make to each stage')
+    parser.add_argument(
+        '-s', '--stages', nargs='*', help='only run stages whose name contains one of these (e.g. feature inference)')
+    parser.add_argument('-b', '--baseline', help='the results of the reference run to compare against')
+    parser.add_argument('-c', '--candidate', help='the results of the run to check')
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=0.1, help='the relative slowdown that counts as a regression')
+    parser.add_argument('-m', '--metric', default='p50_ms', help='the timing statistic to compare')
+    return parser.parse_args()
+
+
+def print_results(results: dict) -> None:
+    rows = [(stage, summary['p50_ms'], summary['p95_ms'], summary['items_per_second'], summary['peak_rss_mb'])
+            for stage, summary in results['stages'].items()]
+    print(tabulate(rows, headers=['stage', 'p50 ms', 'p95 ms', 'items/s', 'peak rss mb'], floatfmt='.2f'))
+
+
+def print_comparison(comparison: list) -> None:
+    rows = [(stage, baseline, candidate, '{0:+.1%}'.format(change), 'REGRESSION' if regression else '')
+            for stage, baseline, candidate, change, regression in comparison]
+    print(tabulate(rows, headers=['stage', 'baseline', 'candidate', 'change', ''], floatfmt='.2f'))
+
+
+def run(args) -> int:
+    """ Runs the operation specified via command line and returns the exit code """
+    if args.operation == 'run':
+        runner = harness.BenchmarkRunner(repeat=args.repeat, warmup=args.warmup, stage_filter=args.stages)
+        stages.run_all(runner)
+        runner.save(args.output)
+        print_results(runner.to_dict())
+        print('\nSaved results to {0}'.format(args.output))
+        return 0
+    if not (args.baseline and args.candidate):
+        raise ValueError('comparing runs requires both a baseline and a candidate results file')
+    comparison = harness.compare_results(
+        harness.load_results(args.baseline), harness.load_results(args.candidate),
+        threshold=args.threshold, metric=args.metric)
+    print_comparison(comparison)
+    return 1 if any(regression for *_, regression in comparison) else 0
+
+
+def main():
+    # Per-file processing logs would drown out the results
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(run(parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Name: harness.py
+# Description: defines how benchmark stages are timed, summarized, saved and compared across runs
+
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; memory usage won't be reported there
+    resource = None
+
+# Percentiles reported for every stage
+PERCENTILES = (50, 95)
+
+
+def get_peak_rss_mb() -> float:
+    """ Retrieves the highest resident set size the process has reached so far in megabytes """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def summarize_timings(timings: list, items_per_call: int = 1) -> dict:
+    """ Summarizes the durations of the calls made to a stage
+
+    :param timings: the duration of each call in seconds
+    :param items_per_call: how many tracks (or rows) each call processes
+    :returns a dictionary of statistics with the durations in milliseconds
+    """
+    timings_ms = np.array(timings, dtype=np.float64) * 1000
+    summary = {'calls': len(timings), 'items_per_call': items_per_call}
+    for percentile in PERCENTILES:
+        summary['p{0}_ms'.format(percentile)] = float(np.percentile(timings_ms, percentile))
+    summary['mean_ms'] = float(timings_ms.mean())
+    summary['min_ms'] = float(timings_ms.min())
+    summary['max_ms'] = float(timings_ms.max())
+    total_seconds = timings_ms.sum() / 1000
+    summary['items_per_second'] = float(len(timings) * items_per_call / total_seconds) if total_seconds else None
+    return summary
+
+
+def get_metadata() -> dict:
+    """ Describes the environment a benchmark run happened in so results from different machines aren't mixed up """
+    metadata = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__
+    }
+    for module_name in ('librosa', 'tensorflow', 'pandas'):
+        module = sys.modules.get(module_name)
+        if module is not None:
+            metadata[module_name] = getattr(module, '__version__', None)
+    try:
+        metadata['git_commit'] = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        metadata['git_commit'] = None
+    return metadata
+
+
+class BenchmarkRunner(object):
+    """ Times benchmark stages and collects their results
+
+    Each stage is a function that's called repeat times after warmup untimed calls. An optional setup function is
+    called before every call, outside of the timed region, and its return value is passed to the stage; this is how
+    stages get fresh inputs without timing their creation.
+    """
+
+    def __init__(self, repeat: int = 5, warmup: int = 1, stage_filter: list = None):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.stage_filter = stage_filter
+        self.results = {}
+
+    def should_run(self, name: str) -> bool:
+        """ Whether a stage matches the filter the runner was created with """
+        return not self.stage_filter or any(stage_filter in name for stage_filter in self.stage_filter)
+
+    def measure(self, name: str, stage_function, setup_function=None, items_per_call: int = 1,
+                repeat: int = None) -> dict:
+        """ Times a stage and stores its summary under the given name
+
+        :param name: the name of the stage, namespaced with dots like "feature.mfcc"
+        :param stage_function: the function to time; takes the setup result if there is a setup function
+        :param setup_function: an optional function preparing the input of every call
+        :param items_per_call: how many tracks (or rows) each call processes
+        :param repeat: the number of timed calls; defaults to the runner's
+        :returns the summary of the stage or None if it was filtered out
+        """
+        if not self.should_run(name):
+            return None
+        repeat = repeat or self.repeat
+        timings = []
+        for iteration in range(self.warmup + repeat):
+            stage_input = setup_function() if setup_function else None
+            start = time.perf_counter()
+            if setup_function:
+                stage_function(stage_input)
+            else:
+                stage_function()
+            duration = time.perf_counter() - start
+            if iteration >= self.warmup:
+                timings.append(duration)
+        summary = summarize_timings(timings, items_per_call)
+        summary['peak_rss_mb'] = get_peak_rss_mb()
+        self.results[name] = summary
+        logging.info("{0}: p50 {1:.2f} ms, p95 {2:.2f} ms".format(name, summary['p50_ms'], summary['p95_ms']))
+        return summary
+
+    def to_dict(self) -> dict:
+        return {'metadata': get_metadata(), 'peak_rss_mb': get_peak_rss_mb(), 'stages': self.results}
+
+    def save(self, filepath: str) -> None:
+        """ Saves the results of the run as JSON """
+        with open(filepath, 'w') as results_file:
+            json.dump(self.to_dict(), results_file, indent=2, sort_keys=True)
+
+
+def load_results(filepath: str) -> dict:
+    with open(filepath) as results_file:
+        return json.load(results_file)
+
+
+def compare_results(baseline: dict, candidate: dict, threshold: float = 0.1, metric: str = 'p50_ms') -> list:
+    """ Compares the stages two benchmark runs have in common
+
+    :param baseline: the results of the reference run as saved by BenchmarkRunner.save
+    :param candidate: the results of the run to check
+    :param threshold: the relative slowdown past which a stage counts as a regression
+    :param metric: the timing statistic to compare
+    :returns a list of (stage, baseline value, candidate value, relative change, is regression) tuples sorted by
+    stage name
+    """
+    comparison = []
+    baseline_stages, candidate_stages = baseline['stages'], candidate['stages']
+    for stage in sorted(set(baseline_stages) & set(candidate_stages)):
+        baseline_value = baseline_stages[stage][metric]
+        candidate_value = candidate_stages[stage][metric]
+        change = (candidate_value - baseline_value) / baseline_value if baseline_value else 0.0
+        comparison.append((stage, baseline_value, candidate_value, change, change > threshold))
+    return comparison
@@ -0,0 +1,174 @@
+# Name: stages.py
+# Description: defines the benchmarked stages of audio processing and model inference
+
+import glob
+import os
+import tempfile
+
+import librosa
+import numpy as np
+import pkg_resources
+
+from genreml.model.processing import audio
+from genreml.model.processing.audio_features import LibrosaFeatureGenerator, SpectrogramGenerator, \
+    WavePlotGenerator
+from genreml.model.processing.config import AudioConfig, DisplayConfig, FeatureExtractorConfig
+from genreml.model.processing.display import VisualDataMixin
+from genreml.model.processing.spectral import SpectralEngine
+
+# Sample rate librosa resamples audio to by default
+SAMPLE_RATE = 22050
+
+
+def get_sample_files() -> list:
+    """ Retrieves the sample FMA files packaged with genreml """
+    return sorted(glob.glob(pkg_resources.resource_filename('genreml', 'fma_data/*.mp3')))
+
+
+def get_synthetic_signal(seconds: float = AudioConfig.MIN_CLIP_LENGTH, seed: int = 0) -> np.ndarray:
+    """ Creates a reproducible signal of a few tones over noise so no audio files are needed """
+    random_state = np.random.RandomState(seed)
+    time_steps = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tones = sum(np.sin(2 * np.pi * frequency * time_steps) for frequency in (110, 440, 1760))
+    return (0.2 * tones + 0.05 * random_state.standard_normal(len(time_steps))).astype(np.float32)
+
+
+def get_synthetic_features(count: int) -> list:
+    """ Creates feature dictionaries shaped like the ones extracted from audio """
+    random_state = np.random.RandomState(0)
+    feature_names = LibrosaFeatureGenerator(get_synthetic_signal(1), SAMPLE_RATE).generate()[1]
+    return [dict({name: float(value) for name, value in zip(feature_names, random_state.standard_normal(
+        len(feature_names)))}, file_name="{0:06d}.mp3".format(idx)) for idx in range(count)]
+
+
+def build_small_model(model_path: str) -> None:
+    """ Builds and saves an untrained Keras model with the same inputs and outputs as the FMA model so inference can be
+    benchmarked without downloading it
+    """
+    from tensorflow import keras
+    from genreml.model.cnn.config import CnnModelConfig
+    features = keras.Input(shape=(44,))
+    image = keras.Input(shape=(CnnModelConfig.IMG_HEIGHT, CnnModelConfig.IMG_WIDTH, 1))
+    image_output = keras.layers.Conv2D(8, 3, strides=2, activation='relu')(image)
+    image_output = keras.layers.MaxPooling2D(4)(image_output)
+    image_output = keras.layers.GlobalAveragePooling2D()(image_output)
+    features_output = keras.layers.Dense(32, activation='relu')(features)
+    output = keras.layers.Dense(32, activation='sigmoid')(
+        keras.layers.concatenate([features_output, image_output]))
+    keras.Model([features, image], output).save(model_path)
+
+
+def _get_warm_engine(audio_signal: np.ndarray) -> SpectralEngine:
+    """ Creates a spectral engine that already holds the STFT matrices every feature is derived from """
+    engine = SpectralEngine(audio_signal, SAMPLE_RATE)
+    engine.mel_power()
+    engine.power(FeatureExtractorConfig.HOP_LENGTH)
+    return engine
+
+
+def run_decode_stages(runner, sample_files: list) -> None:
+    """ Times decoding whole files against decoding only the clip the model needs """
+    files = iter(sample_files * (runner.warmup + runner.repeat))
+    runner.measure("decode.full", lambda file_location: librosa.load(file_location), lambda: next(files))
+    files = iter(sample_files * (runner.warmup + runner.repeat))
+    runner.measure(
+        "decode.clip", lambda file_location: audio.AudioCollection.load_audio_signal(file_location), lambda: next(files))
+
+
+def run_signal_stages(runner, audio_signal: np.ndarray) -> None:
+    """ Times clipping, the STFT and every feature and spectrogram computed from a clip """
+    long_signal = get_synthetic_signal(120)
+    runner.measure("clip_audio_signal", lambda: audio.AudioCollection.clip_audio_signal(
+        long_signal, SAMPLE_RATE, AudioConfig.MIN_CLIP_LENGTH))
+    runner.measure("stft", lambda: SpectralEngine(audio_signal, SAMPLE_RATE).magnitude())
+    feature_generator = LibrosaFeatureGenerator(audio_signal, SAMPLE_RATE)
+    for feature in FeatureExtractorConfig.SUPPORTED_FEATURES:
+        def run_feature(engine, feature=feature):
+            feature_generator.spectral_engine = engine
+            feature_function, inputs = feature_generator._get_feature_function(feature)
+            feature_function(**inputs)
+        runner.measure("feature.{0}".format(feature), run_feature, lambda: _get_warm_engine(audio_signal))
+    runner.measure("feature.all", lambda: LibrosaFeatureGenerator(audio_signal, SAMPLE_RATE).generate())
+    for spectrogram_type in ("melspectrogram", "chromagram", "spectrogram"):
+        runner.measure(
+            "spectrogram.{0}".format(spectrogram_type),
+            lambda engine, spectrogram_type=spectrogram_type: SpectrogramGenerator(
+                audio_signal, SAMPLE_RATE, spectrogram_type=spectrogram_type,
+                spectral_engine=engine)._create_spectrogram_data(),
+            lambda: _get_warm_engine(audio_signal))
+
+
+def run_display_stages(runner, audio_signal: np.ndarray, destination_filepath: str) -> None:
+    """ Times rendering and saving images with every display backend """
+    spectrogram_data = SpectrogramGenerator(audio_signal, SAMPLE_RATE)._create_spectrogram_data()
+    for backend in DisplayConfig.SUPPORTED_BACKENDS:
+        def render(backend=backend):
+            VisualDataMixin.close_img(VisualDataMixin.display_data(spectrogram_data, backend=backend))
+
+        def render_and_save(backend=backend):
+            figure = VisualDataMixin.display_data(spectrogram_data, backend=backend)
+            figure.savefig(os.path.join(destination_filepath, "render_{0}".format(backend)))
+            VisualDataMixin.close_img(figure)
+        runner.measure("render.{0}".format(backend), render)
+        runner.measure("render_and_save.{0}".format(backend), render_and_save)
+    runner.measure("render.grayscale_pixels", lambda: VisualDataMixin.to_grayscale_pixels(spectrogram_data, 200, 335))
+
+    def render_waveplot():
+        VisualDataMixin.close_img(WavePlotGenerator(audio_signal, SAMPLE_RATE).generate())
+    runner.measure("render.waveplot", render_waveplot)
+
+
+def run_export_stages(runner, destination_filepath: str, row_count: int = 1000) -> None:
+    """ Times converting and saving extracted features """
+    audio_files = audio.AudioFiles()
+    audio_files.features = get_synthetic_features(row_count)
+    runner.measure("export.to_df", audio_files.to_df, items_per_call=row_count)
+
+    def to_csv():
+        _, csv_filepath = audio_files.to_csv(destination_filepath + "/")
+        os.remove(csv_filepath)
+    runner.measure("export.to_csv", to_csv, items_per_call=row_count)
+
+
+def run_inference_stages(runner, audio_signal: np.ndarray, model_directory: str, batch_size: int = 8) -> None:
+    """ Times model inference on a small locally built model with the same inputs as the FMA model """
+    if not runner.should_run("inference"):
+        return
+    from genreml.model.cnn import cnn
+    from genreml.model.cnn.bundle import ModelBundle
+    model_path = os.path.join(model_directory, "benchmark_model.h5")
+    build_small_model(model_path)
+    model = cnn.CnnModel.from_bundle(ModelBundle(model_path=model_path))
+    model_input = model._create_model_input(audio_signal, SAMPLE_RATE)
+    runner.measure("inference.model_input", lambda: model._create_model_input(audio_signal, SAMPLE_RATE))
+    runner.measure("inference.predict", lambda: model._predict(model_input))
+    features = model._scale_features([model_input["features"]])
+    spectrograms = model._preprocess_spectrogram(model_input["spectrograms"])[np.newaxis]
+    runner.measure("inference.keras_predict", lambda: model.model.predict([features, spectrograms], verbose=0))
+    runner.measure("inference.session", lambda: model.session(features, spectrograms))
+    runner.measure(
+        "inference.predict_batch", lambda: model._predict_batch([model_input] * batch_size, batch_size=batch_size),
+        items_per_call=batch_size)
+    runner.measure("inference.predict_signal", lambda: model.predict_signal(audio_signal, SAMPLE_RATE, clip=False))
+
+
+def run_pipeline_stages(runner, sample_files: list, destination_filepath: str) -> None:
+    """ Times extracting every feature and image from each sample track end to end """
+    files = iter(sample_files * (runner.warmup + runner.repeat))
+
+    def extract_features(file_location):
+        audio.AudioFiles().extract_features(file_location, destination_filepath)
+    runner.measure("pipeline.extract_features", extract_features, lambda: next(files))
+
+
+def run_all(runner, sample_files: list = None) -> None:
+    """ Runs every benchmark stage the runner's filter lets through """
+    sample_files = sample_files or get_sample_files()
+    audio_signal = get_synthetic_signal()
+    with tempfile.TemporaryDirectory() as temp_directory:
+        run_decode_stages(runner, sample_files)
+        run_signal_stages(runner, audio_signal)
+        run_display_stages(runner, audio_signal, temp_directory)
+        run_export_stages(runner, temp_directory)
+        run_inference_stages(runner, audio_signal, temp_directory)
+        run_pipeline_stages(runner, sample_files, temp_directory)
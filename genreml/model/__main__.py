@@ -3,10 +3,9 @@ import logging
 import pkg_resources
 from PIL import Image
 import numpy as np
-import pandas as pd
 
 from genreml.model.acquisition import extraction
-from genreml.model.processing import audio, config
+from genreml.model.processing import audio, cache as feature_cache, config
 from genreml.model.cnn import cnn, config as model_config
 from genreml.model.utils import string_parsing, file_handling, logger, model_utils
 
@@ -42,9 +41,38 @@ def parse_args():
     parser.add_argument(
         '-fh', '--figure_height', default=config.DisplayConfig.FIGSIZE_HEIGHT, help='the height of the figures created')
     parser.add_argument(
-        '-cf', '--checkpoint_frequency', default=config.AudioConfig.CHECKPOINT_FREQUENCY,
+        '-b', '--backend', default=config.DisplayConfig.BACKEND, choices=config.DisplayConfig.SUPPORTED_BACKENDS,
+        help='how to render spectrograms: matplotlib figures or raster images written straight from the data'
+    )
+    parser.add_argument(
+        '-cf', '--checkpoint_frequency', type=int, default=config.AudioConfig.CHECKPOINT_FREQUENCY,
         help='how many tracks to process before saving features'
     )
+    parser.add_argument(
+        '-ff', '--feature_format', default=config.AudioConfig.FEATURE_FORMAT,
+        choices=config.AudioConfig.SUPPORTED_FEATURE_FORMATS,
+        help='the file format to save extracted features in; npz and parquet are faster to write and load than csv'
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=config.AudioConfig.WORKERS,
+        help='how many processes to extract features from a directory of audio files with'
+    )
+    parser.add_argument(
+        '-tl', '--timeline', action='store_true',
+        help='classify windows sliding across the whole song instead of only its middle clip'
+    )
+    parser.add_argument(
+        '-wh', '--window_hop', type=float, default=config.StreamingConfig.WINDOW_HOP,
+        help='how many seconds apart the windows classified in timeline mode start'
+    )
+    parser.add_argument(
+        '-st', '--stream', action='store_true',
+        help='decode and transform the song a block at a time in timeline mode so long mixes fit in memory'
+    )
+    parser.add_argument(
+        '-cd', '--cache_dir',
+        help='a directory to cache features and predictions in so unchanged audio is never processed twice'
+    )
     return parser.parse_args()
 
 
@@ -58,6 +86,8 @@ def validate_args(args):
     elif args.operation == 'classify' and not (args.file_path or args.youtube_url or args.example):
         raise RuntimeError(
             'you must either pass in a path to an audio file or a url to YouTube song')
+    elif args.operation == 'classify' and args.timeline and not args.window_hop > 0:
+        raise RuntimeError('the timeline window hop must be a positive number of seconds')
     elif args.operation == 'process' and args.example and not args.destination_path:
         raise RuntimeError(
             'if running an example feature extraction you must provide a destination path to save the results in'
@@ -70,6 +100,12 @@ def set_config(args):
     config.AudioConfig.AUDIO_FORMAT = args.audio_format
     # Set the checkpointing frequency in number of tracks processed
     config.AudioConfig.CHECKPOINT_FREQUENCY = args.checkpoint_frequency
+    # Set the file format extracted features are saved in
+    config.AudioConfig.FEATURE_FORMAT = args.feature_format
+    # Set the backend used to render spectrograms
+    config.DisplayConfig.BACKEND = args.backend
+    # Set the number of processes used to extract features from directories
+    config.AudioConfig.WORKERS = args.workers
 
 
 def get_audio_data(args):
@@ -85,6 +121,25 @@ def get_audio_data(args):
         return
 
 
+def format_timestamp(seconds: float) -> str:
+    """ Formats a number of seconds into a minutes:seconds timestamp """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return '{0}:{1:02d}'.format(minutes, seconds)
+
+
+def get_top_genres(prediction, labels: list, n: int) -> list:
+    """ Retrieves the labels of the n genres with the highest probabilities in a prediction """
+    top_n = np.argsort(prediction)[::-1][:n]
+    return [labels[val] for val in top_n]
+
+
+def get_cache(args):
+    """ Creates the feature cache in the directory given via CLI if there is one """
+    if args.cache_dir:
+        return feature_cache.FeatureCache(args.cache_dir)
+    return None
+
+
 def run(args):
     """ Run the operation as specified via CLI argument """
     # Download clips
@@ -108,13 +163,16 @@ def run(args):
         # Run the feature extraction
         if args.example:
             processor.extract_sample_fma_features(
-                destination_filepath=feature_destination_path, audio_format=args.audio_format)
+                destination_filepath=feature_destination_path, audio_format=args.audio_format, workers=args.workers,
+                cache=get_cache(args))
         else:
             processor.extract_features(args.file_path, feature_destination_path,
                                        features_to_exclude=features_to_exclude,
                                        cmap=cmap, figure_width=float(args.figure_width),
                                        figure_height=float(args.figure_height),
-                                       audio_format=args.audio_format
+                                       audio_format=args.audio_format,
+                                       workers=args.workers,
+                                       cache=get_cache(args)
                                        )
 
     elif args.operation == 'classify':
@@ -132,17 +190,24 @@ def run(args):
         # get input data
         get_audio_data(args)
 
-        # run model prediction
-        prediction = model.get_prediction(audio_path=args.file_path)
+        labels = model.bundle.labels
+        if args.timeline:
+            # run model prediction on every window of the song and average them into the song's prediction
+            window_starts, window_predictions, prediction = model.get_timeline(
+                args.file_path, hop_length=args.window_hop, stream=args.stream)
+            window_length = config.AudioConfig.MIN_CLIP_LENGTH
+            print('\nTop 3 predicted genres over time:')
+            for window_start, window_prediction in zip(window_starts, window_predictions):
+                print('{0} - {1}: {2}'.format(
+                    format_timestamp(window_start), format_timestamp(window_start + window_length),
+                    get_top_genres(window_prediction, labels, 3)))
+        else:
+            # run model prediction
+            prediction = model.get_prediction(audio_path=args.file_path, cache=get_cache(args))
 
         # display prediction results
         # Log top 5 predictions to console
-        n = 5
-        top_n_genres = []
-        top_n = np.argsort(prediction)
-        top_n = top_n[::-1][:n]
-        for i, val in enumerate(top_n, start=1):
-            top_n_genres.append(pd.read_csv(model_config.FMAModelConfig.LABELS_PATH)['category'][val])
+        top_n_genres = get_top_genres(prediction, labels, 5)
         print(f'\nTop 5 predicted genres: {top_n_genres}\n')
 
         if args.youtube_url:
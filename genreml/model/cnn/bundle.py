@@ -0,0 +1,125 @@
+# Name: bundle.py
+# Description: defines a handle that loads a trained model and its preprocessing data once per process
+
+import hashlib
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import tensorflow as tf
+
+from genreml.model.cnn import config
+from genreml.model.cnn.session import InferenceSession
+
+
+class ModelBundle(object):
+    """ Lazily loads and caches everything a prediction needs: the Keras model, the feature scaler, the ordering of the
+    feature columns and the genre labels
+
+    Each artifact is read from disk the first time it's accessed and then kept in memory, so one bundle can be reused
+    across calls and threads; loading is guarded by a lock so concurrent first accesses only load once. Use
+    ModelBundle.get to share one bundle per set of paths within the process.
+    """
+
+    # Bundles shared across the process keyed by their artifact paths
+    _bundles = {}
+    _bundles_lock = threading.Lock()
+
+    def __init__(self, model_path: str = None, scaler_path: str = None,
+                 feature_cols_path: str = None, labels_path: str = None):
+        self.model_path = model_path or config.FMAModelConfig.FMA_MODEL_PATH
+        self.scaler_path = scaler_path or config.FMAModelConfig.PKL_PATH
+        self.feature_cols_path = feature_cols_path or config.FMAModelConfig.FEATURE_COLS
+        self.labels_path = labels_path or config.FMAModelConfig.LABELS_PATH
+        self._lock = threading.RLock()
+        self._artifacts = {}
+
+    @classmethod
+    def get(cls, model_path: str = None, scaler_path: str = None,
+            feature_cols_path: str = None, labels_path: str = None):
+        """ Retrieves the bundle shared by the whole process for the given paths, creating it if needed
+
+        Paths that aren't given default to the FMAModelConfig paths
+        """
+        bundle = cls(model_path, scaler_path, feature_cols_path, labels_path)
+        key = bundle.paths
+        with cls._bundles_lock:
+            return cls._bundles.setdefault(key, bundle)
+
+    @property
+    def paths(self) -> tuple:
+        return self.model_path, self.scaler_path, self.feature_cols_path, self.labels_path
+
+    def _load(self, name: str, load_function) -> any:
+        """ Returns the cached artifact with the given name or loads it with load_function while holding the lock """
+        artifacts = self._artifacts
+        if name in artifacts:
+            return artifacts[name]
+        with self._lock:
+            if name not in self._artifacts:
+                self._artifacts[name] = load_function()
+            return self._artifacts[name]
+
+    def _read_scaler(self):
+        with open(self.scaler_path, 'rb') as scaler_file:
+            return pickle.load(scaler_file)
+
+    def _compute_content_hash(self) -> str:
+        """ Hashes the contents of every artifact in the bundle """
+        content_hash = hashlib.sha256()
+        for path in self.paths:
+            with open(path, 'rb') as artifact_file:
+                for chunk in iter(lambda: artifact_file.read(1 << 20), b''):
+                    content_hash.update(chunk)
+        return content_hash.hexdigest()
+
+    @property
+    def model(self) -> tf.keras.Model:
+        return self._load('model', lambda: tf.keras.models.load_model(self.model_path))
+
+    @property
+    def session(self) -> InferenceSession:
+        """ The compiled inference session of the model; traced and warmed up when it's first accessed """
+        return self._load('session', lambda: InferenceSession(self.model))
+
+    @property
+    def scaler(self) -> any:
+        """ The scaler fitted to the training features """
+        return self._load('scaler', self._read_scaler)
+
+    @property
+    def feature_cols(self) -> list:
+        """ The names of the features in the order the model expects them """
+        return self._load('feature_cols', lambda: list(pd.read_csv(self.feature_cols_path)['feature_columns']))
+
+    @property
+    def labels(self) -> list:
+        """ The genre names in the order of the model outputs """
+        return self._load('labels', lambda: list(pd.read_csv(self.labels_path)['category']))
+
+    @property
+    def content_hash(self) -> str:
+        """ A sha256 digest of the model, scaler, feature column and label files; changes whenever any of them does """
+        return self._load('content_hash', self._compute_content_hash)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._artifacts
+
+    def invalidate(self) -> None:
+        """ Drops every cached artifact so the next access reads them from disk again """
+        with self._lock:
+            self._artifacts = {}
+
+    def refresh(self) -> bool:
+        """ Invalidates the bundle if the artifacts on disk no longer match its content hash
+
+        :returns True if the bundle was invalidated
+        """
+        with self._lock:
+            if 'content_hash' in self._artifacts and self._compute_content_hash() != self._artifacts['content_hash']:
+                self.invalidate()
+                return True
+            return False
@@ -1,17 +1,22 @@
 import os
+import librosa
 import numpy as np
-import pandas as pd
-import pickle
-from PIL import Image
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 import tensorflow as tf
 from tensorflow import keras
 
 from genreml.model.processing import audio, config
+from genreml.model.processing.aggregation import FeatureAggregator
+from genreml.model.processing.cache import FeatureCache, get_clip_policy, hash_file
+from genreml.model.processing.audio_features import LibrosaFeatureGenerator, SpectrogramGenerator
+from genreml.model.processing.config import FeatureExtractorConfig, StreamingConfig
+from genreml.model.processing.spectral import SpectralEngine
+from genreml.model.processing.streaming import StreamingFeatureExtractor, iter_windows
 from genreml.model.cnn import config, dataset as ds
+from genreml.model.cnn.bundle import ModelBundle
+from genreml.model.cnn.session import InferenceSession
 from genreml.model.model import base_model, input
-from genreml.model.utils import file_handling
 
 
 class CnnInput(input.ModelInput):
@@ -23,11 +28,41 @@ class CnnInput(input.ModelInput):
 class CnnModel(base_model.Model):
     """Model class that contains keras model built from .h5 file or custom model trained with FMA dataset"""
 
-    def __init__(self, name: str = "ConvolutionalNeuralNetwork", model_config=config.CnnModelConfig):
+    def __init__(self, name: str = "ConvolutionalNeuralNetwork", model_config=config.CnnModelConfig,
+                 bundle: ModelBundle = None):
+        # Whether the keras model and its session are read through the bundle; see from_bundle
+        self.uses_bundle_model = False
+        self._session = None
         super().__init__(name)
         self.config = model_config
+        # Scaler, feature ordering and labels are loaded once per process and shared by every model using them
+        self.bundle = bundle or ModelBundle.get()
         self.training_history = None
 
+    @property
+    def model(self) -> keras.Model:
+        """ The keras model; for models created from a bundle it's read through the bundle on every access so the model
+        reloaded by ModelBundle.refresh is picked up by models created before the refresh
+        """
+        return self.bundle.model if self.uses_bundle_model else self._model
+
+    @model.setter
+    def model(self, model: keras.Model) -> None:
+        # Setting a model detaches it from the bundle's
+        self._model = model
+        self.uses_bundle_model = False
+
+    @property
+    def session(self) -> InferenceSession:
+        """ Compiled session running the model outside of Keras' predict loop; shared through the bundle for models
+        created from one and None for models trained in place, which use model.predict instead
+        """
+        return self.bundle.session if self.uses_bundle_model else self._session
+
+    @session.setter
+    def session(self, session: InferenceSession) -> None:
+        self._session = session
+
     def train(self, dataset: ds.Dataset, batch_size, epochs, optimizer) -> None:
         """ Train keras model against FMA dataset passed to function
 
@@ -48,23 +83,24 @@ class CnnModel(base_model.Model):
                                                    [dataset.test_features, dataset.test_images], dataset.test_labels),
                                                batch_size=batch_size, epochs=epochs)
 
-    @staticmethod
-    def _process_features(features: dict):
+    def _scale_features(self, features: list) -> np.array:
+        """ Sorts and scales many feature dictionaries at once
+
+        :param features: list of feature data dictionaries
+        :returns array of shape (len(features), number of features) scaled and sorted based on the bundle's feature
+        columns
+        """
+        feature_cols = self.bundle.feature_cols
+        features_sorted = np.array([[feature_data[col] for col in feature_cols] for feature_data in features])
+        # scale with the scaler object exported from the trained data
+        return self.bundle.scaler.transform(features_sorted)
+
+    def _process_features(self, features: dict):
         """ Extract feture data from audio source using genreml
         :param features: feature data dictionary
         :returns array of feature data scaled and sorted based on FEATURE_COLS list
         """
-        features_sorted = []
-        feature_cols = pd.read_csv(config.FMAModelConfig.FEATURE_COLS)['feature_columns']
-        for col in feature_cols:
-            features_sorted.append(features[col])
-        features_sorted = np.array(features_sorted)
-        features_sorted = features_sorted[np.newaxis, :]
-
-        # load scaler object from binary exported from trained data
-        sc = pickle.load(open(config.FMAModelConfig.PKL_PATH, 'rb'))
-        features = sc.transform(features_sorted)[0]
-        return features
+        return self._scale_features([features])[0]
 
     def _preprocess_spectrogram(self, image: list) -> np.array:
         """ Reshape pixel data to IMG_HEIGHT x IMG_WIDTH
@@ -79,47 +115,227 @@ class CnnModel(base_model.Model):
 
         :param input_data: ModelInput object containing input data used for prediction
         """
+        return self._predict_batch([input_data])
+
+    def _predict_batch(self, inputs: list, batch_size: int = None) -> np.array:
+        """ Run a single model prediction on a batch of feature/spectrogram inputs
+
+        :param inputs: list of ModelInput objects containing input data used for prediction
+        :param batch_size: the number of inputs per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :returns an array of shape (len(inputs), number of genres)
+        """
         if not self.model:
             raise AttributeError("Model {0} is not trained".format(self.name))
-        elif "spectrograms" not in input_data or "features" not in input_data:
-            raise AttributeError(
-                "Both spectrograms and raw features need to be provided to model {0}".format(self.name))
-        spectrogram = self._preprocess_spectrogram(input_data["spectrograms"])
-        features = self._process_features(input_data["features"])
-        features = np.array(features)
-        prediction = self.model.predict([np.array([features]), np.array([spectrogram])])
+        for input_data in inputs:
+            if "spectrograms" not in input_data or "features" not in input_data:
+                raise AttributeError(
+                    "Both spectrograms and raw features need to be provided to model {0}".format(self.name))
+        # Stack every input into one feature tensor and one image tensor so Keras is only called once
+        features = self._scale_features([input_data["features"] for input_data in inputs])
+        spectrograms = np.stack([self._preprocess_spectrogram(input_data["spectrograms"]) for input_data in inputs])
+        if self.session is not None:
+            return self.session(features, spectrograms, batch_size=batch_size or self.config.BATCH_SIZE)
+        return self.model.predict([features, spectrograms], batch_size=batch_size or self.config.BATCH_SIZE)
 
-        return prediction
+    def _create_model_input(self, audio_signal: np.ndarray, sample_rate) -> CnnInput:
+        """ Extracts the features and melspectrogram pixels the model needs from an audio signal entirely in memory
 
-    def get_prediction(self, audio_path):
-        """ Method used to get prediction results
+        :param audio_signal: an audio time-series already clipped to the length the model expects
+        :param sample_rate: the sampling rate of the audio time-series
+        :returns a CnnInput object with the raw features and the IMG_HEIGHT x IMG_WIDTH spectrogram pixels
+        """
+        # Features and spectrogram are both derived from the same STFT
+        spectral_engine = SpectralEngine(audio_signal, sample_rate)
+        features, _ = LibrosaFeatureGenerator(audio_signal, sample_rate, spectral_engine=spectral_engine).generate()
+        spectrogram = SpectrogramGenerator(audio_signal, sample_rate, spectral_engine=spectral_engine).generate_pixels(
+            self.config.IMG_HEIGHT, self.config.IMG_WIDTH)
+        return CnnInput(spectrograms=spectrogram, features=features)
 
-        :param string audio_path: local path to audio file that will be used for the prediction
+    def _create_window_input(self, features: dict, mel_power: np.ndarray) -> CnnInput:
+        """ Builds the model input of a window of a longer track from frames that were computed for the whole track
+
+        :param features: feature names to the frame-level data of the window
+        :param mel_power: the mel filterbank output of the window's power STFT at FEATURE_HOP_LENGTH
+        :returns a CnnInput object with the raw features and the IMG_HEIGHT x IMG_WIDTH spectrogram pixels
         """
-        # extract data from audio file
-        audio_files = audio.AudioFiles()
-        output_path = config.FMAModelConfig.SPECT_IMG_PATH
-        audio_files.extract_features(file_locations=audio_path,
-                                     destination_filepath=output_path,
-                                     features_to_exclude={'spectrogram', 'chromagram', 'waveplot'},
-                                     figure_height=config.CnnModelConfig.IMG_HEIGHT / 100,
-                                     figure_width=config.CnnModelConfig.IMG_WIDTH / 100)
+        aggregator = FeatureAggregator.from_feature_dict(features)
+        feature_data = dict(zip(aggregator.columns, aggregator.aggregate_features(features)))
+        # Image frames are every stride-th frame of the feature STFT the same way SpectralEngine slices them
+        stride = max(1, FeatureExtractorConfig.HOP_LENGTH // FeatureExtractorConfig.FEATURE_HOP_LENGTH)
+        spectrogram = SpectrogramGenerator.melspectrogram_pixels(
+            mel_power[:, ::stride], self.config.IMG_HEIGHT, self.config.IMG_WIDTH)
+        return CnnInput(spectrograms=spectrogram, features=feature_data)
 
-        # # open .png file and return raw pixel data
-        path = audio_files.visual_paths[0][0]
-        spect_img = Image.open(path).convert('L')
-        spect_img = spect_img.resize((config.CnnModelConfig.IMG_WIDTH, config.CnnModelConfig.IMG_HEIGHT))
-        spect_img = list(spect_img.getdata())
+    def predict_windows(self, windows, batch_size: int = None) -> tuple:
+        """ Get prediction results for windows of a track, running them through the model a batch at a time so only
+        one batch of windows is held at once
 
-        # build model input object
-        input_obj = CnnInput(spectrograms=spect_img, features=audio_files.features_saved[0])
+        :param windows: an iterator over (start in seconds, feature names to frame-level data, mel power) like
+        genreml.model.processing.streaming.iter_windows yields
+        :param batch_size: the number of windows per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :returns an array with the start of each window in seconds, an array with the genre probabilities of each
+        window and the average probabilities of all of the windows
+        """
+        batch_size = batch_size or self.config.BATCH_SIZE
+        starts, window_predictions, inputs = [], [], []
+        for start, features, mel_power in windows:
+            starts.append(start)
+            inputs.append(self._create_window_input(features, mel_power))
+            if len(inputs) == batch_size:
+                window_predictions.append(self._predict_batch(inputs, batch_size=batch_size))
+                inputs = []
+        if inputs:
+            window_predictions.append(self._predict_batch(inputs, batch_size=batch_size))
+        window_predictions = np.concatenate(window_predictions)
+        return np.array(starts), window_predictions, window_predictions.mean(axis=0)
+
+    def predict_stream(self, audio_path: str, window_length: float = None,
+                       hop_length: float = StreamingConfig.WINDOW_HOP, batch_size: int = None) -> tuple:
+        """ Get prediction results for windows across a whole audio file that is decoded and transformed a block at a
+        time, so tracks of any length are predicted on in the same amount of memory
+
+        :param audio_path: local path to an audio file
+        :param window_length: the length of each window in seconds; defaults to AudioConfig.MIN_CLIP_LENGTH
+        :param hop_length: the number of seconds between the starts of consecutive windows
+        :param batch_size: the number of windows per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :returns the window starts, window probabilities and average probabilities; see predict_windows
+        """
+        extractor = StreamingFeatureExtractor()
+        windows = extractor.iter_windows(
+            extractor.stream(audio_path), window_length or config.AudioConfig.MIN_CLIP_LENGTH, hop_length)
+        return self.predict_windows(windows, batch_size=batch_size)
+
+    def predict_signal_timeline(self, audio_signal: np.ndarray, sample_rate, window_length: float = None,
+                                hop_length: float = StreamingConfig.WINDOW_HOP, batch_size: int = None) -> tuple:
+        """ Get prediction results for windows sliding across a whole audio signal
 
-        # run model prediction
-        prediction = self._predict(input_data=input_obj)
+        The STFT of the whole signal is computed once and each window's features and melspectrogram are sliced from
+        it, so overlapping windows don't transform the same audio over and over again.
 
-        file_handling.delete_dir_contents(config.FMAModelConfig.FEATURES_PATH)
+        :param audio_signal: an audio time-series of a whole track
+        :param sample_rate: the sampling rate of the audio time-series
+        :param window_length: the length of each window in seconds; defaults to AudioConfig.MIN_CLIP_LENGTH
+        :param hop_length: the number of seconds between the starts of consecutive windows
+        :param batch_size: the number of windows per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :returns the window starts, window probabilities and average probabilities; see predict_windows
+        """
+        spectral_engine = SpectralEngine(audio_signal, sample_rate)
+        features, _ = LibrosaFeatureGenerator(
+            audio_signal, sample_rate, aggregate_features=False, spectral_engine=spectral_engine).generate()
+        windows = iter_windows(
+            [(features, spectral_engine.mel_power())], sample_rate,
+            window_length or config.AudioConfig.MIN_CLIP_LENGTH, hop_length)
+        return self.predict_windows(windows, batch_size=batch_size)
+
+    def get_timeline(self, audio_path: str, window_length: float = None, hop_length: float = StreamingConfig.WINDOW_HOP,
+                     batch_size: int = None, stream: bool = False) -> tuple:
+        """ Method used to get prediction results for windows sliding across a whole audio file
+
+        :param audio_path: local path to an audio file
+        :param window_length: the length of each window in seconds; defaults to AudioConfig.MIN_CLIP_LENGTH
+        :param hop_length: the number of seconds between the starts of consecutive windows
+        :param batch_size: the number of windows per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :param stream: whether to decode and transform the file a block at a time instead of all at once, which keeps
+        memory use flat for long files
+        :returns the window starts, window probabilities and average probabilities; see predict_windows
+        """
+        if stream:
+            return self.predict_stream(audio_path, window_length, hop_length, batch_size=batch_size)
+        audio_signal, sample_rate = librosa.load(audio_path)
+        return self.predict_signal_timeline(audio_signal, sample_rate, window_length, hop_length, batch_size=batch_size)
+
+    def predict_signal(self, audio_signal: np.ndarray, sample_rate, clip: bool = True) -> np.array:
+        """ Get prediction results for an audio signal that's already in memory without touching the disk
+
+        :param audio_signal: an audio time-series
+        :param sample_rate: the sampling rate of the audio time-series
+        :param clip: whether to clip the signal to its middle AudioConfig.MIN_CLIP_LENGTH seconds first
+        :returns an array with the probability of each genre
+        """
+        if clip:
+            audio_signal = audio.AudioCollection.clip_audio_signal(
+                audio_signal, sample_rate, config.AudioConfig.MIN_CLIP_LENGTH)
+        prediction = self._predict(input_data=self._create_model_input(audio_signal, sample_rate))
         return prediction[0]
 
+    def predict_batch(self, audio_signals: list, sample_rates, track_ids: list = None, batch_size: int = None) -> tuple:
+        """ Get prediction results for many clips at once with a single batched forward pass through the model
+
+        :param audio_signals: list of audio time-series already clipped to the length the model expects
+        :param sample_rates: the sampling rate shared by all of the clips or a list with one per clip
+        :param track_ids: optional list with the track each clip belongs to; defaults to each clip being its own track
+        :param batch_size: the number of clips per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :returns an array with the genre probabilities of each clip and a dictionary of track id to the average
+        probabilities of the track's clips in the order the tracks first appear
+        """
+        if not isinstance(sample_rates, (list, tuple)):
+            sample_rates = [sample_rates] * len(audio_signals)
+        if track_ids is None:
+            track_ids = list(range(len(audio_signals)))
+        if not len(audio_signals) == len(sample_rates) == len(track_ids):
+            raise ValueError("Each audio signal needs exactly one sample rate and one track id")
+        if not audio_signals:
+            return np.empty((0, 0)), {}
+        inputs = [self._create_model_input(audio_signal, sample_rate)
+                  for audio_signal, sample_rate in zip(audio_signals, sample_rates)]
+        clip_predictions = self._predict_batch(inputs, batch_size=batch_size)
+        # Average the clips of each track together
+        track_indices = {}
+        for index, track_id in enumerate(track_ids):
+            track_indices.setdefault(track_id, []).append(index)
+        track_predictions = {track_id: clip_predictions[indices].mean(axis=0)
+                             for track_id, indices in track_indices.items()}
+        return clip_predictions, track_predictions
+
+    def get_batch_prediction(self, audio_paths: list, clips_per_track: int = 1, batch_size: int = None) -> tuple:
+        """ Method used to get prediction results for many audio files with one batched forward pass
+
+        :param audio_paths: local paths to audio files that will be used for the prediction
+        :param clips_per_track: the maximum number of AudioConfig.MIN_CLIP_LENGTH clips taken from the middle of each
+        track; tracks too short for all of them only get their middle clip
+        :param batch_size: the number of clips per forward pass; defaults to CnnModelConfig.BATCH_SIZE
+        :returns an array with the probabilities of each clip and a dictionary of audio path to track probabilities
+        """
+        audio_signals, sample_rates, track_ids = [], [], []
+        for audio_path in audio_paths:
+            clips, sample_rate = audio.AudioCollection.load_audio_clips(
+                audio_path, config.AudioConfig.MIN_CLIP_LENGTH, clips_per_track)
+            audio_signals.extend(clips)
+            sample_rates.extend([sample_rate] * len(clips))
+            track_ids.extend([audio_path] * len(clips))
+        return self.predict_batch(audio_signals, sample_rates, track_ids=track_ids, batch_size=batch_size)
+
+    def get_prediction(self, audio_path, cache: FeatureCache = None):
+        """ Method used to get prediction results
+
+        :param string audio_path: local path to audio file that will be used for the prediction
+        :param cache: an optional FeatureCache; predictions are reused while the audio content and the model bundle
+        are unchanged and the model input is reused across models
+        """
+        if not cache:
+            audio_signal, sample_rate = audio.AudioCollection.load_audio_signal(audio_path)
+            return self.predict_signal(audio_signal, sample_rate, clip=False)
+        audio_hash = hash_file(audio_path)
+        prediction_key = cache.make_key(
+            audio_hash, "prediction", clip_policy=get_clip_policy(), model_hash=self.bundle.content_hash,
+            img_height=self.config.IMG_HEIGHT, img_width=self.config.IMG_WIDTH)
+        prediction = cache.get(prediction_key)
+        if prediction is not None:
+            return prediction
+        input_key = cache.make_key(
+            audio_hash, "model_input", clip_policy=get_clip_policy(),
+            img_height=self.config.IMG_HEIGHT, img_width=self.config.IMG_WIDTH)
+        model_input = cache.get(input_key)
+        if model_input is None:
+            audio_signal, sample_rate = audio.AudioCollection.load_audio_signal(audio_path)
+            input_data = self._create_model_input(audio_signal, sample_rate)
+            model_input = (input_data["features"], input_data["spectrograms"])
+            cache.put(input_key, model_input)
+        features, spectrogram = model_input
+        prediction = self._predict(input_data=CnnInput(spectrograms=spectrogram, features=features))[0]
+        cache.put(prediction_key, prediction)
+        return prediction
+
     def export_h5(self, path='./'):
         """ Export keras model to .h5 file at path location
 
@@ -133,8 +349,23 @@ class CnnModel(base_model.Model):
 
         :param h5_filepath: local file path to .h5 file
         """
-        cls_instance = cls()
-        cls_instance.model = tf.keras.models.load_model(h5_filepath)
+        return cls.from_bundle(ModelBundle.get(model_path=h5_filepath))
+
+    @classmethod
+    def from_bundle(cls, bundle: ModelBundle):
+        """ Instantiate CnnModel object from a model bundle, reusing its model and inference session if they've
+        already been loaded
+
+        The model and session aren't copied from the bundle but read through it on every prediction, so once
+        ModelBundle.refresh finds new artifacts on disk every model created from the bundle predicts with them
+
+        :param bundle: the ModelBundle with the keras model and its preprocessing data
+        """
+        cls_instance = cls(bundle=bundle)
+        cls_instance.uses_bundle_model = True
+        # The session is shared through the bundle so it's only traced and warmed up once per process; load it now
+        # rather than on the first prediction
+        bundle.session
         return cls_instance
 
     @classmethod
@@ -6,6 +6,8 @@ class CnnModelConfig:
     IMG_PIXELS = 67000
     IMG_WIDTH = 335
     IMG_HEIGHT = 200
+    # Number of clips run through the model per forward pass by predict_batch
+    BATCH_SIZE = 32
 
 
 class FMAModelConfig:
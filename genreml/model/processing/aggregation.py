@@ -0,0 +1,198 @@
+# Name: aggregation.py
+# Description: defines a vectorized kernel aggregating frame-level features of one or many clips into feature vectors
+
+import numpy as np
+
+from genreml.model.processing.config import FeatureExtractorConfig
+
+# Features aggregated as the mean of each of their rows instead of with the aggregations over all of their values
+ROW_MEAN_FEATURES = ('mfcc',)
+SUPPORTED_AGGREGATIONS = ('mean', 'min', 'max', 'std')
+
+
+class FeatureAggregator(object):
+    """ Aggregates frame-level features stacked into one (n_rows, n_frames) matrix in a single vectorized pass
+
+    Every feature takes up as many consecutive rows of the matrix as it has (12 for chroma_stft, 1 for rms, ...). The
+    row sums, minimums and maximums of the whole matrix are computed at once and then reduced per feature, so the
+    aggregations of all features cost a few numpy calls instead of a call per feature and aggregation. A batch of
+    clips of the same length can be aggregated at once as a (n_clips, n_rows, n_frames) array.
+    """
+
+    def __init__(self, feature_rows: list, aggregations: list = None):
+        """ Instantiates an aggregator for features laid out in the given order
+
+        :param feature_rows: (feature name, number of rows) pairs in the order the features are stacked in
+        :param aggregations: the aggregations of features that aren't in ROW_MEAN_FEATURES; defaults to
+        FeatureExtractorConfig.FEATURE_AGGREGATION
+        """
+        self.feature_rows = [(feature, int(rows)) for feature, rows in feature_rows]
+        self.aggregations = list(aggregations or FeatureExtractorConfig.FEATURE_AGGREGATION)
+        for aggregation in self.aggregations:
+            if aggregation not in SUPPORTED_AGGREGATIONS:
+                raise ValueError(
+                    "aggregation {0} is not associated with a valid aggregation function".format(aggregation))
+        self.n_rows = sum(rows for _, rows in self.feature_rows)
+        self.columns = []
+        # Rows of the features aggregated over all of their values, where each of those features starts among them
+        # and how many rows each has
+        aggregated_rows, group_starts, group_sizes = [], [], []
+        row_mean_rows = []
+        row = 0
+        for feature, rows in self.feature_rows:
+            if feature in ROW_MEAN_FEATURES:
+                row_mean_rows.extend(range(row, row + rows))
+            else:
+                group_starts.append(len(aggregated_rows))
+                group_sizes.append(rows)
+                aggregated_rows.extend(range(row, row + rows))
+            row += rows
+        self._aggregated_rows = np.array(aggregated_rows, dtype=np.intp)
+        self._group_starts = np.array(group_starts, dtype=np.intp)
+        self._group_sizes = np.array(group_sizes, dtype=np.intp)
+        self._row_mean_rows = np.array(row_mean_rows, dtype=np.intp)
+        # The aggregations are computed into one array of [each aggregation of every group..., every row mean...]
+        # and the output columns are gathered from it in feature order
+        n_groups = len(group_starts)
+        column_index = []
+        group, row_mean = 0, 0
+        for feature, rows in self.feature_rows:
+            if feature in ROW_MEAN_FEATURES:
+                for row in range(rows):
+                    self.columns.append('{0}{1}'.format(feature, row))
+                    column_index.append(len(self.aggregations) * n_groups + row_mean)
+                    row_mean += 1
+            else:
+                for position, aggregation in enumerate(self.aggregations):
+                    self.columns.append('{0}-{1}'.format(feature, aggregation))
+                    column_index.append(position * n_groups + group)
+                group += 1
+        self._column_index = np.array(column_index, dtype=np.intp)
+
+    @classmethod
+    def from_feature_dict(cls, feature_dict: dict, aggregations: list = None):
+        """ Creates an aggregator for the features in the given dictionary of feature names to frame-level data """
+        return cls([(feature, np.atleast_2d(data).shape[-2]) for feature, data in feature_dict.items()], aggregations)
+
+    def stack(self, feature_dict: dict) -> np.ndarray:
+        """ Stacks the frame-level data of each feature into one matrix in the order of the aggregator's features
+
+        :param feature_dict: feature names to arrays of shape (rows, n_frames) or (n_clips, rows, n_frames)
+        :returns an array of shape (n_rows, n_frames) or (n_clips, n_rows, n_frames)
+        """
+        blocks = [feature_dict[feature] for feature, _ in self.feature_rows]
+        frame_counts = {np.shape(block)[-1] for block in blocks}
+        if len(frame_counts) > 1:
+            raise ValueError("features have different numbers of frames {0}".format(sorted(frame_counts)))
+        return np.concatenate([block if np.ndim(block) > 1 else np.atleast_2d(block) for block in blocks], axis=-2)
+
+    def aggregate(self, stacked: np.ndarray) -> np.ndarray:
+        """ Aggregates stacked frame-level features
+
+        :param stacked: an array of shape (n_rows, n_frames) or (n_clips, n_rows, n_frames) laid out as the
+        aggregator's features
+        :returns a float32 array of shape (len(columns),) or (n_clips, len(columns)) in the order of columns
+        """
+        stacked = np.asarray(stacked)
+        if stacked.shape[-2] != self.n_rows:
+            raise ValueError("expected {0} feature rows but got {1}".format(self.n_rows, stacked.shape[-2]))
+        n_frames = stacked.shape[-1]
+        # Sums are accumulated in float64 without copying the matrix to float64
+        row_sums = stacked.sum(axis=-1, dtype=np.float64)
+        results = []
+        if len(self._group_starts) > 0:
+            values = stacked[..., self._aggregated_rows, :]
+            counts = self._group_sizes * n_frames
+            means = np.add.reduceat(row_sums[..., self._aggregated_rows], self._group_starts, axis=-1) / counts
+            for aggregation in self.aggregations:
+                if aggregation == 'mean':
+                    results.append(means)
+                elif aggregation == 'min':
+                    results.append(np.minimum.reduceat(values.min(axis=-1), self._group_starts, axis=-1))
+                elif aggregation == 'max':
+                    results.append(np.maximum.reduceat(values.max(axis=-1), self._group_starts, axis=-1))
+                else:
+                    # Two passes like np.std: squared deviations from each feature's own mean
+                    deviations = values - np.repeat(means, self._group_sizes, axis=-1)[..., np.newaxis]
+                    squares = np.square(deviations).sum(axis=-1, dtype=np.float64)
+                    results.append(np.sqrt(np.add.reduceat(squares, self._group_starts, axis=-1) / counts))
+        results.append(row_sums[..., self._row_mean_rows] / n_frames)
+        return np.concatenate(results, axis=-1)[..., self._column_index].astype(np.float32)
+
+    def aggregate_features(self, feature_dict: dict) -> np.ndarray:
+        """ Stacks and aggregates a dictionary of feature names to frame-level data; see stack and aggregate """
+        return self.aggregate(self.stack(feature_dict))
+
+
+class RunningFeatureAggregator(FeatureAggregator):
+    """ Aggregates frame-level features that arrive in blocks, like the blocks of a stream, in constant memory
+
+    Each block is reduced to the same per-feature statistics FeatureAggregator computes for a whole clip, and those
+    statistics are merged into running ones: minimums, maximums and sums directly, and standard deviations with the
+    pairwise form of Welford's algorithm (Chan et al.) so no block has to be kept and the variance isn't computed from
+    a difference of large sums.
+    """
+
+    def __init__(self, feature_rows: list, aggregations: list = None):
+        super().__init__(feature_rows, aggregations)
+        n_groups = len(self._group_starts)
+        self.n_frames = 0
+        self._means = np.zeros(n_groups)
+        self._squared_deviations = np.zeros(n_groups)
+        self._minimums = np.full(n_groups, np.inf)
+        self._maximums = np.full(n_groups, -np.inf)
+        self._row_mean_sums = np.zeros(len(self._row_mean_rows))
+
+    def update(self, stacked: np.ndarray) -> None:
+        """ Merges a block of stacked frame-level features into the running aggregates
+
+        :param stacked: an array of shape (n_rows, n_frames) laid out as the aggregator's features
+        """
+        stacked = np.asarray(stacked)
+        if stacked.shape[0] != self.n_rows:
+            raise ValueError("expected {0} feature rows but got {1}".format(self.n_rows, stacked.shape[0]))
+        n_frames = stacked.shape[1]
+        if n_frames == 0:
+            return
+        row_sums = stacked.sum(axis=-1, dtype=np.float64)
+        if len(self._group_starts) > 0:
+            values = stacked[self._aggregated_rows, :]
+            counts, block_counts = self._group_sizes * self.n_frames, self._group_sizes * n_frames
+            block_means = np.add.reduceat(row_sums[self._aggregated_rows], self._group_starts) / block_counts
+            deviations = values - np.repeat(block_means, self._group_sizes)[:, np.newaxis]
+            block_squared_deviations = np.add.reduceat(
+                np.square(deviations).sum(axis=-1, dtype=np.float64), self._group_starts)
+            # Merge the block's mean and sum of squared deviations into the running ones
+            delta = block_means - self._means
+            total_counts = counts + block_counts
+            self._means += delta * block_counts / total_counts
+            self._squared_deviations += \
+                block_squared_deviations + np.square(delta) * counts * block_counts / total_counts
+            self._minimums = np.minimum(self._minimums, np.minimum.reduceat(values.min(axis=-1), self._group_starts))
+            self._maximums = np.maximum(self._maximums, np.maximum.reduceat(values.max(axis=-1), self._group_starts))
+        self._row_mean_sums += row_sums[self._row_mean_rows]
+        self.n_frames += n_frames
+
+    def update_features(self, feature_dict: dict) -> None:
+        """ Stacks a block of frame-level features and merges it into the running aggregates; see stack and update """
+        self.update(self.stack(feature_dict))
+
+    def result(self) -> np.ndarray:
+        """ Retrieves the aggregates of every frame merged so far
+
+        :returns a float32 array of shape (len(columns),) in the order of columns
+        """
+        if self.n_frames == 0:
+            raise ValueError("no frames have been aggregated")
+        results = []
+        for aggregation in self.aggregations:
+            if aggregation == 'mean':
+                results.append(self._means)
+            elif aggregation == 'min':
+                results.append(self._minimums)
+            elif aggregation == 'max':
+                results.append(self._maximums)
+            else:
+                results.append(np.sqrt(self._squared_deviations / (self._group_sizes * self.n_frames)))
+        results.append(self._row_mean_sums / self.n_frames)
+        return np.concatenate(results)[self._column_index].astype(np.float32)
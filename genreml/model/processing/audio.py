@@ -1,22 +1,35 @@
 # Name: audio.py
 # Description: defines functionality to process audio from audio files
 
+import audioread
+import concurrent.futures
+import itertools
 import logging
 import librosa
+import multiprocessing
 import numpy as np
 import os
 import pkg_resources
 import pandas as pd
 import glob
 import json
+import soundfile
 
+from concurrent.futures import ProcessPoolExecutor
 from genreml.model.processing.audio_features import SpectrogramGenerator, LibrosaFeatureGenerator, WavePlotGenerator
-from genreml.model.processing.config import AudioConfig, DisplayConfig
+from genreml.model.processing.cache import FeatureCache, get_clip_policy, hash_file
+from genreml.model.processing.feature_sink import CsvFeatureSink, FeatureSink, get_feature_sink
+from genreml.model.processing.config import AudioConfig, DisplayConfig, FeatureExtractorConfig, \
+    get_config_values, set_config_values
+from genreml.model.processing.spectral import SpectralEngine
 from genreml.model.utils import file_handling
 
 
 class Audio(object):
 
+    # The visual features that can be extracted from audio in the order they're generated
+    VISUAL_FEATURES = ("spectrogram", "melspectrogram", "chromagram", "waveplot")
+
     def __init__(self, file_name: str, audio_signal, sample_rate, file_type: str = AudioConfig.AUDIO_FORMAT):
         """ Instantiates an AudioFile object that collects various attributes related to an audio file and exposes
         methods to extract features from that file
@@ -25,6 +38,18 @@ class Audio(object):
         self.audio_type = "." + file_type
         self.audio_signal = audio_signal
         self.sample_rate = sample_rate
+        self._spectral_engine = None
+
+    @property
+    def spectral_engine(self) -> SpectralEngine:
+        """ The spectral engine shared by every feature and spectrogram generated from this audio object """
+        if not self._spectral_engine:
+            self._spectral_engine = SpectralEngine(self.audio_signal, self.sample_rate)
+        return self._spectral_engine
+
+    def clear_spectral_cache(self) -> None:
+        """ Releases the STFT data cached while extracting features """
+        self._spectral_engine = None
 
     def _get_figure_filepath(self, destination_filepath: str, figure_type: str) -> str:
         return "{0}{1}_{2}".format(
@@ -40,7 +65,8 @@ class Audio(object):
     def to_spectrogram(
             self, destination_filepath: str = None, spec_generator=None,
             spectrogram_type: str = "spectrogram", cmap: str = None,
-            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT):
+            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+            backend: str = None):
         """ Extract spectrogram from the audio data and saves the resulting image to the destination path
 
         :param string destination_filepath: the file path to save the spectrogram to
@@ -49,13 +75,16 @@ class Audio(object):
         :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
         :param figure_width: the spectrogram width in inches
         :param figure_height: the spectrogram height in inches
+        :param backend: "matplotlib" or "raster"; defaults to DisplayConfig.BACKEND
         :returns the full path location of the saved melspetrogram image
         """
         logging.info("generating {0} for {1}".format(spectrogram_type, self.file_name))
         if not spec_generator:
             spec_generator = SpectrogramGenerator(
-                self.audio_signal, self.sample_rate, spectrogram_type=spectrogram_type)
-        spectrogram = spec_generator.generate(cmap=cmap, figure_width=figure_width, figure_height=figure_height)
+                self.audio_signal, self.sample_rate, spectrogram_type=spectrogram_type,
+                spectral_engine=self.spectral_engine)
+        spectrogram = spec_generator.generate(
+            cmap=cmap, figure_width=figure_width, figure_height=figure_height, backend=backend)
         path = None
         if destination_filepath:
             path = self._save_figure(spec_generator, spectrogram, destination_filepath, spectrogram_type)
@@ -63,7 +92,7 @@ class Audio(object):
 
     def to_melspectrogram(self, destination_filepath: str = None, spec_generator=None, cmap: str = None,
                           figure_width: float = DisplayConfig.FIGSIZE_WIDTH,
-                          figure_height: float = DisplayConfig.FIGSIZE_HEIGHT):
+                          figure_height: float = DisplayConfig.FIGSIZE_HEIGHT, backend: str = None):
         """ Extract melspectrogram from the audio data and saves the resulting image to the destination path
 
         :param string destination_filepath: the file path to save the melspectrogram to
@@ -71,15 +100,16 @@ class Audio(object):
         :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
         :param figure_width: the melspectrogram width in inches
         :param figure_height: the melspectrogram height in inches
+        :param backend: "matplotlib" or "raster"; defaults to DisplayConfig.BACKEND
         :returns the full path location of the saved melspetrogram image
         """
         return self.to_spectrogram(
             destination_filepath, spec_generator, spectrogram_type="melspectrogram", cmap=cmap,
-            figure_width=figure_width, figure_height=figure_height)
+            figure_width=figure_width, figure_height=figure_height, backend=backend)
 
     def to_chromagram(self, destination_filepath: str = None, spec_generator=None, cmap: str = None,
                       figure_width: float = DisplayConfig.FIGSIZE_WIDTH,
-                      figure_height: float = DisplayConfig.FIGSIZE_HEIGHT
+                      figure_height: float = DisplayConfig.FIGSIZE_HEIGHT, backend: str = None
                       ):
         """ Extract chromagram from the audio data and saves the resulting image to the destination path
 
@@ -88,11 +118,12 @@ class Audio(object):
         :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
         :param figure_width: the chromogram width in inches
         :param figure_height: the chromogram height in inches
+        :param backend: "matplotlib" or "raster"; defaults to DisplayConfig.BACKEND
         :returns the full path location of the saved chromagram image
         """
         return self.to_spectrogram(
             destination_filepath, spec_generator, spectrogram_type="chromagram", cmap=cmap,
-            figure_width=figure_width, figure_height=figure_height
+            figure_width=figure_width, figure_height=figure_height, backend=backend
         )
 
     def to_waveplot(self, destination_filepath: str = None, waveplot_generator=None, cmap: str = None,
@@ -144,7 +175,8 @@ class Audio(object):
         logging.info("generating librosa features for {0}".format(self.file_name))
         if not feature_generator:
             feature_generator = LibrosaFeatureGenerator(
-                self.audio_signal, self.sample_rate, aggregate_features, exclusion_set)
+                self.audio_signal, self.sample_rate, aggregate_features, exclusion_set,
+                spectral_engine=self.spectral_engine)
         # Extract features
         features, feature_names = feature_generator.generate()
         # Append the identifiers for the current audio file to the feature object
@@ -168,6 +200,7 @@ class AudioCollection(dict):
         self.features = []
         self.feature_names = []
         self.features_saved = []
+        self.feature_sink = None
 
     @staticmethod
     def clip_audio_signal(audio_signal: np.array, sample_rate, min_clip_length: int) -> np.array:
@@ -198,6 +231,102 @@ class AudioCollection(dict):
             audio_signal = tmp_signal'''
         return audio_signal
 
+    @staticmethod
+    def split_audio_signal(audio_signal: np.array, sample_rate, min_clip_length: int, num_clips: int) -> list:
+        """ Splits the middle of an audio signal into up to num_clips consecutive clips of min_clip_length seconds;
+        signals too short to hold all of them yield only the middle clip
+
+        :param audio_signal: an audio time-series
+        :param sample_rate: the sampling rate of the audio time-series
+        :param min_clip_length: the length of each clip in seconds
+        :param num_clips: the maximum number of clips to take
+        :returns a list of clipped audio time-series
+        """
+        if num_clips <= 1 or len(audio_signal) / sample_rate < min_clip_length * num_clips + 1:
+            return [AudioCollection.clip_audio_signal(audio_signal, sample_rate, min_clip_length)]
+        mid_index = int(len(audio_signal) / 2)
+        lower_index = mid_index - int(sample_rate * (min_clip_length * num_clips / 2))
+        clips = []
+        for _ in range(num_clips):
+            upper_index = lower_index + int(sample_rate * min_clip_length)
+            clips.append(audio_signal[lower_index:upper_index])
+            lower_index = upper_index
+        return clips
+
+    @staticmethod
+    def probe_duration(file_location: str) -> float:
+        """ Reads the duration of an audio file in seconds from its header without decoding the audio where possible
+
+        :param string file_location: the path to an audio file
+        """
+        try:
+            return soundfile.info(file_location).duration
+        except RuntimeError:
+            # Formats libsndfile can't read fall back to the same decoder librosa.load uses for them
+            with audioread.audio_open(file_location) as audio_file:
+                return audio_file.duration
+
+    @classmethod
+    def load_middle_window(cls, file_location: str, window_length: float, duration: float = None) -> tuple:
+        """ Decodes and resamples only the middle window_length seconds of an audio file
+
+        A margin of AudioConfig.DECODE_MARGIN seconds is decoded around the window and trimmed off so the result
+        matches what clip_audio_signal would cut out of the fully decoded file. If the file turns out to be shorter
+        than its header claims then the whole file is decoded instead.
+
+        :param string file_location: the path to an audio file
+        :param window_length: the length of the window to decode in seconds
+        :param duration: the duration of the file in seconds if it has already been probed
+        :returns the audio signal of the window and its sample rate
+        """
+        if duration is None:
+            duration = cls.probe_duration(file_location)
+        if duration < window_length:
+            raise ValueError("Length {0} for the song is shorted than min required length of {1}".format(
+                duration, window_length))
+        start = (duration - window_length) / 2
+        offset = max(0.0, start - AudioConfig.DECODE_MARGIN)
+        audio_signal, sample_rate = librosa.load(
+            file_location, offset=offset, duration=window_length + 2 * AudioConfig.DECODE_MARGIN)
+        start_index = int(round((start - offset) * sample_rate))
+        window_samples = int(sample_rate * window_length)
+        if start_index + window_samples > len(audio_signal):
+            logging.warning("{0} is shorter than its reported duration; decoding the whole file".format(
+                file_location))
+            audio_signal, sample_rate = librosa.load(file_location)
+            return cls.clip_audio_signal(audio_signal, sample_rate, window_length), sample_rate
+        return audio_signal[start_index:start_index + window_samples], sample_rate
+
+    @classmethod
+    def load_audio_signal(cls, file_location: str, min_clip_length: int = AudioConfig.MIN_CLIP_LENGTH) -> tuple:
+        """ Loads the middle min_clip_length seconds of the audio signal stored in the given file; only that part of the
+        file is decoded
+
+        :param string file_location: the path to an audio file
+        :param min_clip_length: the length of the clip to keep in seconds
+        :returns the clipped audio signal and its sample rate
+        """
+        return cls.load_middle_window(file_location, min_clip_length)
+
+    @classmethod
+    def load_audio_clips(cls, file_location: str, min_clip_length: int = AudioConfig.MIN_CLIP_LENGTH,
+                         num_clips: int = 1) -> tuple:
+        """ Loads up to num_clips consecutive clips from the middle of the given file the same way split_audio_signal
+        cuts them while only decoding the part of the file the clips cover
+
+        :param string file_location: the path to an audio file
+        :param min_clip_length: the length of each clip in seconds
+        :param num_clips: the maximum number of clips to take; files too short for all of them only get the middle clip
+        :returns a list of clipped audio signals and their sample rate
+        """
+        duration = cls.probe_duration(file_location)
+        if num_clips <= 1 or duration < min_clip_length * num_clips + 1:
+            num_clips = 1
+        audio_signal, sample_rate = cls.load_middle_window(file_location, min_clip_length * num_clips, duration)
+        clip_samples = int(sample_rate * min_clip_length)
+        clips = [audio_signal[idx * clip_samples:(idx + 1) * clip_samples] for idx in range(num_clips)]
+        return clips, sample_rate
+
     def _load_file(self, file_location, file_type: str = AudioConfig.AUDIO_FORMAT):
         """ Reads in a individual file from the given file_location on disk and keeps a record of those files that
         couldn't be read in
@@ -206,8 +335,7 @@ class AudioCollection(dict):
         """
         try:
             logging.info("loading audio file from {0}".format(file_location))
-            audio_signal, sample_rate = librosa.load(file_location)
-            audio_signal = self.clip_audio_signal(audio_signal, sample_rate, AudioConfig.MIN_CLIP_LENGTH)
+            audio_signal, sample_rate = self.load_audio_signal(file_location)
             self[file_location] = Audio(
                 file_handling.get_filename(file_location), audio_signal, sample_rate, file_type=file_type)
         except Exception as e:
@@ -243,6 +371,8 @@ class AudioCollection(dict):
         except Exception as e:
             logging.warning("failed to extract features from {0}".format(audio_object))
             logging.warning(e)
+        finally:
+            audio_object.clear_spectral_cache()
 
     @staticmethod
     def _initialize_feature_destination(destination_filepath: str) -> str:
@@ -261,16 +391,9 @@ class AudioCollection(dict):
 
         :returns a pandas data frame representation of the audio features
         """
-        df = pd.DataFrame()
-        record_count = 0
-        for idx, feature_dict in enumerate(self.features):
-            record_count += 1
-            if idx == 0:
-                record_to_insert = {key: [val] for key, val in feature_dict.items()}
-                df = pd.DataFrame(record_to_insert)
-            else:
-                df = df.append(feature_dict, ignore_index=True)
-        return df, record_count
+        # Build the frame from all of the records at once since appending row by row copies the frame every time
+        df = pd.DataFrame.from_records(list(self.features))
+        return df, len(df)
 
     def to_csv(self, destination_filepath: str):
         """ Creates a data frame of the features extracted from the current audio files and saves a CSV representation
@@ -280,20 +403,30 @@ class AudioCollection(dict):
         :returns the data frame of features that was saved as CSV
         """
         df, record_count = self.to_df()
-        csv_filepath = "{0}{1}{2}.csv".format(destination_filepath, 'feature_data_', str(os.getpid()))
-        if file_handling.file_exists(csv_filepath):
-            logging.info(
-                "appending feature data frame containing {0} records to {1}".format(record_count, csv_filepath))
-            df.to_csv(csv_filepath, float_format='%.{}e'.format(10), header=False, index=False, mode='a')
-        else:
-            logging.info(
-                "writing feature data frame containing {0} records to {1}".format(record_count, csv_filepath))
-            df.to_csv(csv_filepath, float_format='%.{}e'.format(10), index=False, mode='w')
+        csv_filepath = CsvFeatureSink(destination_filepath).path
+        logging.info("saving feature data frame containing {0} records to {1}".format(record_count, csv_filepath))
+        CsvFeatureSink.write_df(df, csv_filepath)
         return df, csv_filepath
 
+    def _get_feature_sink(self, destination_filepath: str) -> FeatureSink:
+        """ Retrieves the sink features are saved to, replacing it if the destination or the format changed """
+        sink = self.feature_sink
+        if sink is None or sink.destination_filepath != (destination_filepath or '') \
+                or sink.extension != AudioConfig.FEATURE_FORMAT:
+            self._close_feature_sink()
+            self.feature_sink = get_feature_sink(destination_filepath)
+        return self.feature_sink
+
+    def _close_feature_sink(self) -> None:
+        if self.feature_sink is not None:
+            self.feature_sink.close()
+            self.feature_sink = None
+
     def _checkpoint_feature_extraction(self, destination_filepath, clear_features=True):
         logging.info("checkpointing progress to {0}".format(destination_filepath))
-        _, _ = self.to_csv(destination_filepath)
+        sink = self._get_feature_sink(destination_filepath)
+        sink.add_rows(self.features)
+        sink.flush()
         self.features_saved.extend(self.features)
         if clear_features:
             self.features = []
@@ -326,7 +459,8 @@ class AudioFiles(AudioCollection):
                          file_locations, destination_filepath=None, features_to_exclude=None,
                          load=True, audio_format=AudioConfig.AUDIO_FORMAT, cmap=DisplayConfig.CMAP,
                          figure_width: float = DisplayConfig.FIGSIZE_WIDTH,
-                         figure_height: float = DisplayConfig.FIGSIZE_HEIGHT
+                         figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+                         workers: int = None, cache: FeatureCache = None
                          ):
         """ Iterates over all of the files in the file_locations, loads them in to extract audio data, and
         generates features
@@ -339,17 +473,18 @@ class AudioFiles(AudioCollection):
         :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
         :param figure_width: the visual feature figure width in inches
         :param figure_height: the visual feature figure height in inches
+        :param workers: how many processes to spread the files of a directory across; defaults to AudioConfig.WORKERS
+        :param cache: an optional FeatureCache to reuse the features and images of files whose content was processed
+        before with the same settings
         """
         self.features, self.features_saved = [], []
+        workers = workers or AudioConfig.WORKERS
         destination_filepath = self._initialize_feature_destination(destination_filepath)
         # Only load in and process a single file if the given location a file
         if os.path.isfile(file_locations):
-            if load:
-                self._load_file(file_locations, file_type=audio_format)
-            self._run_feature_extraction(
-                self[file_locations], destination_filepath, features_to_exclude,
-                cmap=cmap, figure_width=figure_width, figure_height=figure_height
-
+            self._extract_file(
+                file_locations, destination_filepath, features_to_exclude, load=load, audio_format=audio_format,
+                cmap=cmap, figure_width=figure_width, figure_height=figure_height, cache=cache
             )
         # Load in all applicable files if the given location is a directory
         elif os.path.isdir(file_locations):
@@ -359,37 +494,229 @@ class AudioFiles(AudioCollection):
                 file_locations = file_locations[:-1]
             # Retrieve list of files in directory with the matching audio format
             audio_files_in_dir = glob.glob("{0}/*.{1}".format(file_locations, audio_format))
-            # Iterate over each file in the directory, load in if applicable, and extract features
-            for idx, file in enumerate(audio_files_in_dir):
-                if load:
-                    self._load_file(file, file_type=audio_format)
-                try:
-                    self._run_feature_extraction(
-                        self[file], destination_filepath, features_to_exclude,
-                        cmap=cmap, figure_width=figure_width, figure_height=figure_height
-                    )
-                    # Checkpoint features every AudioConfig.CHECKPOINT_FREQUENCY tracks
-                    if (idx + 1) % AudioConfig.CHECKPOINT_FREQUENCY == 0 and destination_filepath:
-                        self._checkpoint_feature_extraction(destination_filepath)
-                except Exception as e:
-                    logging.critical("could not run feature extraction for {0}".format(file))
-                    logging.critical(e)
-                    if destination_filepath:
-                        self._checkpoint_feature_extraction(destination_filepath)
+            # Files are loaded in the worker processes so only files that haven't been loaded yet can be spread out
+            if workers > 1 and load:
+                self._extract_features_in_parallel(
+                    audio_files_in_dir, workers, destination_filepath, features_to_exclude,
+                    audio_format=audio_format, cmap=cmap, figure_width=figure_width, figure_height=figure_height,
+                    cache=cache
+                )
+            else:
+                # Iterate over each file in the directory, load in if applicable, and extract features
+                for idx, file in enumerate(audio_files_in_dir):
+                    try:
+                        self._extract_file(
+                            file, destination_filepath, features_to_exclude, load=load, audio_format=audio_format,
+                            cmap=cmap, figure_width=figure_width, figure_height=figure_height, cache=cache
+                        )
+                        # Checkpoint features every AudioConfig.CHECKPOINT_FREQUENCY tracks
+                        if (idx + 1) % AudioConfig.CHECKPOINT_FREQUENCY == 0 and destination_filepath:
+                            self._checkpoint_feature_extraction(destination_filepath)
+                    except Exception as e:
+                        logging.critical("could not run feature extraction for {0}".format(file))
+                        logging.critical(e)
+                        if destination_filepath:
+                            self._checkpoint_feature_extraction(destination_filepath)
         else:
             raise RuntimeError("file location {0} given to load audio clips from is invalid".format(file_locations))
         if destination_filepath:
             self._checkpoint_feature_extraction(destination_filepath)
+            self._close_feature_sink()
+
+    def _extract_file(
+            self, file_location: str, destination_filepath=None, features_to_exclude=None, load=True,
+            audio_format=AudioConfig.AUDIO_FORMAT, cmap=DisplayConfig.CMAP,
+            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+            cache: FeatureCache = None
+    ):
+        """ Loads a single file if applicable and extracts its features; when a cache is given the file's features and
+        images are restored from it instead if a file with the same content was processed with the same settings
 
-    def extract_sample_fma_features(self, destination_filepath=None, audio_format=AudioConfig.AUDIO_FORMAT):
+        :param string file_location: the path to the audio file
+        :param string destination_filepath: the location to save features in
+        :param set features_to_exclude: a collection of feature names to exclude from the final result
+        :param bool load: whether to load the file before extracting the features
+        :param cache: an optional FeatureCache
+        """
+        cache_keys = None
+        if cache:
+            cache_keys = self._get_cache_keys(
+                file_location, cache, destination_filepath, features_to_exclude, cmap, figure_width, figure_height)
+            if self._restore_cached_features(file_location, cache, cache_keys, destination_filepath, audio_format):
+                logging.info("restored cached features for {0}".format(file_location))
+                return
+        if load:
+            self._load_file(file_location, file_type=audio_format)
+        feature_count = len(self.features)
+        self._run_feature_extraction(
+            self[file_location], destination_filepath, features_to_exclude,
+            cmap=cmap, figure_width=figure_width, figure_height=figure_height
+        )
+        if cache and len(self.features) > feature_count:
+            self._cache_features(file_location, cache, cache_keys, destination_filepath)
+
+    @staticmethod
+    def _get_cache_keys(file_location: str, cache: FeatureCache, destination_filepath=None, features_to_exclude=None,
+                        cmap=DisplayConfig.CMAP, figure_width: float = DisplayConfig.FIGSIZE_WIDTH,
+                        figure_height: float = DisplayConfig.FIGSIZE_HEIGHT) -> tuple:
+        """ Builds the cache keys of the features and images of a file; images only have a key if they're saved """
+        audio_hash = hash_file(file_location)
+        features_to_exclude = features_to_exclude or set()
+        features_key = cache.make_key(
+            audio_hash, "features", clip_policy=get_clip_policy(), features_to_exclude=features_to_exclude)
+        images_key = None
+        if destination_filepath:
+            images_key = cache.make_key(
+                audio_hash, "images", clip_policy=get_clip_policy(), features_to_exclude=features_to_exclude,
+                cmap=cmap, figure_width=figure_width, figure_height=figure_height,
+                display_config=get_config_values(DisplayConfig))
+        return features_key, images_key
+
+    def _restore_cached_features(self, file_location: str, cache: FeatureCache, cache_keys: tuple,
+                                 destination_filepath=None, audio_format=AudioConfig.AUDIO_FORMAT) -> bool:
+        """ Adds the cached features of a file to the collection and writes out its cached images
+
+        :returns whether everything needed for the file was found in the cache
+        """
+        features_key, images_key = cache_keys
+        cached_features = cache.get(features_key)
+        cached_images = cache.get(images_key) if images_key else []
+        if cached_features is None or cached_images is None:
+            return False
+        audio_object = Audio(file_handling.get_filename(file_location), None, None, file_type=audio_format)
+        visual_paths = []
+        for figure_type, image in cached_images:
+            path = audio_object._get_figure_filepath(destination_filepath.replace(" ", ""), figure_type) + ".png"
+            with open(path, 'wb') as image_file:
+                image_file.write(image)
+            visual_paths.append(path)
+        if images_key:
+            self.visual_features.append([])
+            self.visual_paths.append(visual_paths)
+        feature_dict, feature_names_list = cached_features
+        # The features are shared by every file with the same content so the name comes from the current file
+        feature_dict = dict(feature_dict, file_name=audio_object.file_name)
+        self.features.append(feature_dict)
+        self.feature_names.append(feature_names_list)
+        return True
+
+    def _cache_features(self, file_location: str, cache: FeatureCache, cache_keys: tuple,
+                        destination_filepath=None) -> None:
+        """ Stores the features and images just extracted from a file in the cache """
+        features_key, images_key = cache_keys
+        try:
+            if images_key:
+                audio_object = self[file_location]
+                visual_paths = self.visual_paths[-1]
+                images = []
+                for figure_type in Audio.VISUAL_FEATURES:
+                    path = audio_object._get_figure_filepath(destination_filepath.replace(" ", ""), figure_type)
+                    if path + ".png" in visual_paths:
+                        with open(path + ".png", 'rb') as image_file:
+                            images.append((figure_type, image_file.read()))
+                cache.put(images_key, images)
+            feature_dict = {key: value for key, value in self.features[-1].items() if key != 'file_name'}
+            cache.put(features_key, (feature_dict, self.feature_names[-1]))
+        except Exception as e:
+            logging.warning("failed to cache features of {0} due to {1}".format(file_location, e))
+
+    def _extract_features_in_parallel(
+            self, audio_files: list, workers: int, destination_filepath=None, features_to_exclude=None,
+            audio_format=AudioConfig.AUDIO_FORMAT, cmap=DisplayConfig.CMAP,
+            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+            cache: FeatureCache = None
+    ):
+        """ Loads and extracts features from the given files in a pool of worker processes; results are collected and
+        checkpointed in the order the files finish
+
+        At most workers * AudioConfig.WORKER_QUEUE_DEPTH files are in flight at once. Loaded audio stays in the workers
+        so only the feature dictionaries and the paths of any saved images come back to this collection.
+
+        :param list audio_files: the paths of the audio files to process
+        :param int workers: the number of worker processes to use
+        :param string destination_filepath: the location to save features in
+        :param set features_to_exclude: a collection of feature names to exclude from the final result
+        :param cache: an optional FeatureCache shared with the worker processes through its disk store
+        """
+        max_in_flight = workers * AudioConfig.WORKER_QUEUE_DEPTH
+        files_to_submit = iter(audio_files)
+        # Settings changed at runtime (e.g. through the CLI) need to be carried over to the worker processes
+        config_values = (get_config_values(AudioConfig), get_config_values(DisplayConfig),
+                         get_config_values(FeatureExtractorConfig))
+        processed_count = 0
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context(AudioConfig.WORKER_START_METHOD),
+                                 initializer=_initialize_worker, initargs=config_values) as executor:
+            in_flight = {}
+            while True:
+                # Keep the pool busy without queueing up every file at once
+                for file in itertools.islice(files_to_submit, max_in_flight - len(in_flight)):
+                    future = executor.submit(
+                        _extract_file_features, file, destination_filepath, features_to_exclude,
+                        audio_format, cmap, figure_width, figure_height, cache
+                    )
+                    in_flight[future] = file
+                if not in_flight:
+                    break
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    file = in_flight.pop(future)
+                    processed_count += 1
+                    try:
+                        features, feature_names, visual_paths = future.result()
+                        self.features.extend(features)
+                        self.feature_names.extend(feature_names)
+                        # The figures themselves stay in the workers; keep a placeholder per file like cached files do
+                        self.visual_features.extend([] for _ in visual_paths)
+                        self.visual_paths.extend(visual_paths)
+                    except Exception as e:
+                        logging.critical("could not run feature extraction for {0}".format(file))
+                        logging.critical(e)
+                    # Checkpoint features every AudioConfig.CHECKPOINT_FREQUENCY tracks
+                    if processed_count % int(AudioConfig.CHECKPOINT_FREQUENCY) == 0 and destination_filepath:
+                        self._checkpoint_feature_extraction(destination_filepath)
+
+    def extract_sample_fma_features(self, destination_filepath=None, audio_format=AudioConfig.AUDIO_FORMAT,
+                                    workers: int = None, cache: FeatureCache = None):
         """ Retrieves audio features from sample FMA audio files packaged with the application in genreml/fma_data
 
         :param str destination_filepath: the optional path to save features to as part of regular feature extraction
         :param string audio_format: the format of the audio files in directory (wav, mp3, etc.)
+        :param workers: how many processes to spread the files across; defaults to AudioConfig.WORKERS
+        :param cache: an optional FeatureCache to reuse previously extracted features from
         """
         path = pkg_resources.resource_filename('genreml', 'fma_data/')
         self.extract_features(
-            path, destination_filepath=destination_filepath, audio_format=audio_format)
+            path, destination_filepath=destination_filepath, audio_format=audio_format, workers=workers, cache=cache)
+
+
+def _initialize_worker(audio_config_values: dict, display_config_values: dict, feature_config_values: dict) -> None:
+    """ Applies the parent process's config settings in a feature extraction worker process """
+    set_config_values(AudioConfig, audio_config_values)
+    set_config_values(DisplayConfig, display_config_values)
+    set_config_values(FeatureExtractorConfig, feature_config_values)
+
+
+def _extract_file_features(
+        file_location: str, destination_filepath=None, features_to_exclude=None,
+        audio_format=AudioConfig.AUDIO_FORMAT, cmap=DisplayConfig.CMAP,
+        figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+        cache: FeatureCache = None
+) -> tuple:
+    """ Loads a single audio file and extracts its features in a worker process; failures are logged and isolated to
+    the file the same way they are when processing serially
+
+    :returns the feature dictionaries, the feature names, and the paths of the saved visual features of the file
+    """
+    audio_files = AudioFiles()
+    try:
+        audio_files._extract_file(
+            file_location, destination_filepath, features_to_exclude, audio_format=audio_format,
+            cmap=cmap, figure_width=figure_width, figure_height=figure_height, cache=cache
+        )
+    except Exception as e:
+        logging.warning("failed to extract features from {0} due to {1}".format(file_location, e))
+    return audio_files.features, audio_files.feature_names, audio_files.visual_paths
 
 
 class AudioData(AudioCollection):
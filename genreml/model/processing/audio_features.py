@@ -10,20 +10,33 @@ import warnings
 
 from abc import ABC, abstractmethod
 
+from genreml.model.processing.aggregation import FeatureAggregator
 from genreml.model.processing.config import FeatureExtractorConfig, DisplayConfig
 from genreml.model.processing.display import VisualDataMixin
+from genreml.model.processing.spectral import SpectralEngine
 
 
 class FeatureGenerator(ABC):
     """ Abstract feature generation class defines common functionality and interface for all feature generators """
 
-    def __init__(self, audio_signal: np.array, sample_rate: np.array, features_to_exclude: any, config):
+    def __init__(self, audio_signal: np.array, sample_rate: np.array, features_to_exclude: any, config,
+                 spectral_engine: SpectralEngine = None):
         self.audio_signal = audio_signal
         self.sample_rate = sample_rate
         self.features_to_exclude = features_to_exclude
         if not features_to_exclude:
             self.features_to_exclude = set()
         self.config = config
+        # The engine caches the STFT of the audio signal so it can be shared with other generators for the same clip
+        self.spectral_engine = spectral_engine
+        if not spectral_engine:
+            self.spectral_engine = SpectralEngine(audio_signal, sample_rate, config)
+
+    def _get_spectral_engine(self, audio_signal: np.ndarray, sample_rate: np.ndarray) -> SpectralEngine:
+        """ Retrieves the shared spectral engine if the given data is the generator's own or a new engine otherwise """
+        if audio_signal is self.audio_signal and sample_rate == self.sample_rate:
+            return self.spectral_engine
+        return SpectralEngine(audio_signal, sample_rate, self.config)
 
     @abstractmethod
     def generate(self):
@@ -39,8 +52,10 @@ class SpectrogramGenerator(FeatureGenerator, VisualDataMixin):
 
     def __init__(self,
                  audio_signal: np.ndarray, sample_rate: np.ndarray,
-                 spectrogram_type: str = "melspectrogram", config=FeatureExtractorConfig):
-        super().__init__(audio_signal, sample_rate, features_to_exclude=None, config=config)
+                 spectrogram_type: str = "melspectrogram", config=FeatureExtractorConfig,
+                 spectral_engine: SpectralEngine = None):
+        super().__init__(audio_signal, sample_rate, features_to_exclude=None, config=config,
+                         spectral_engine=spectral_engine)
         self.spectrogram_type = spectrogram_type
 
     def _create_db_melspectrogram_data(self, audio_signal: np.ndarray, sample_rate: np.ndarray) -> np.ndarray:
@@ -50,10 +65,7 @@ class SpectrogramGenerator(FeatureGenerator, VisualDataMixin):
         :param sample_rate: the sampling rate of the audio time-series
         :returns a numpy array containing the data to plot as a melspectrogram
         """
-        mel_spect = librosa.feature.melspectrogram(
-            y=audio_signal, sr=sample_rate, n_fft=self.config.N_FFT, hop_length=self.config.HOP_LENGTH
-        )
-        return librosa.power_to_db(mel_spect)
+        return self._get_spectral_engine(audio_signal, sample_rate).db_melspectrogram(self.config.HOP_LENGTH)
 
     def _create_db_spectrogram_data(self, audio_signal: np.ndarray) -> np.ndarray:
         """ Creates the data for a decibel spectrogram using librosa
@@ -61,9 +73,7 @@ class SpectrogramGenerator(FeatureGenerator, VisualDataMixin):
         :param audio_signal: an audio time-series
         :returns a numpy array containing the data to plot as a spectrogram
         """
-        spectrogram_data = np.abs(
-            librosa.stft(y=audio_signal, n_fft=self.config.N_FFT, hop_length=self.config.HOP_LENGTH))
-        return librosa.amplitude_to_db(spectrogram_data, ref=np.max)
+        return self._get_spectral_engine(audio_signal, self.sample_rate).db_spectrogram(self.config.HOP_LENGTH)
 
     def _create_chromagram_data(self, audio_signal: np.ndarray, sample_rate: np.ndarray) -> np.ndarray:
         """ Generates the data from a chromagram using librosa
@@ -72,32 +82,63 @@ class SpectrogramGenerator(FeatureGenerator, VisualDataMixin):
         :param sample_rate: the sampling rate of the audio time-series
         :returns a numpy array containing the data to plot as a chromagram
         """
-        chromagram = librosa.feature.chroma_stft(audio_signal, sample_rate, hop_length=self.config.HOP_LENGTH)
-        return chromagram
+        return self._get_spectral_engine(audio_signal, sample_rate).chromagram(self.config.HOP_LENGTH)
+
+    def _create_spectrogram_data(self) -> np.ndarray:
+        """ Creates the data to visualize for the generator's spectrogram type """
+        if self.spectrogram_type == "melspectrogram":
+            return self.prepare_melspectrogram(self._create_db_melspectrogram_data(self.audio_signal, self.sample_rate))
+        elif self.spectrogram_type == "chromagram":
+            return self._create_chromagram_data(self.audio_signal, self.sample_rate)
+        return self._create_db_spectrogram_data(self.audio_signal)
+
+    @classmethod
+    def prepare_melspectrogram(cls, mel_spect: np.ndarray) -> np.ndarray:
+        """ Normalizes decibel melspectrogram data to 8 bits and flips and inverts it the way it's visualized """
+        norm_mel_spect = cls.normalize(mel_spect)
+        eight_bit_spectrogram = cls.convert_pixels_to_8_bits(norm_mel_spect)
+        return cls.flip_and_invert(eight_bit_spectrogram)
+
+    @classmethod
+    def melspectrogram_pixels(cls, mel_power: np.ndarray, height: int, width: int,
+                              cmap: str = DisplayConfig.CMAP) -> np.ndarray:
+        """ Generates the pixels generate_pixels would from mel filterbank output that's already been computed, like
+        the frames of a window of a longer track
+
+        :param mel_power: the mel filterbank output of the power STFT at FeatureExtractorConfig.HOP_LENGTH
+        :param height: the height of the result in pixels
+        :param width: the width of the result in pixels
+        :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
+        :returns a numpy uint8 array of shape (height, width)
+        """
+        return cls.to_grayscale_pixels(
+            cls.prepare_melspectrogram(librosa.power_to_db(mel_power)), height, width, cmap=cmap)
+
+    def generate_pixels(self, height: int, width: int, cmap: str = DisplayConfig.CMAP) -> np.ndarray:
+        """ Generates the grayscale pixels of the spectrogram at the given size entirely in memory
+
+        :param height: the height of the result in pixels
+        :param width: the width of the result in pixels
+        :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
+        :returns a numpy uint8 array of shape (height, width)
+        """
+        return self.to_grayscale_pixels(self._create_spectrogram_data(), height, width, cmap=cmap)
 
     def generate(self, cmap: str = None,
-                 figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT
-                 ) -> plt.figure:
+                 figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+                 backend: str = None) -> plt.figure:
         """ Generates a spectrogram by calling the different component methods of this object
 
         :param cmap: https://matplotlib.org/3.3.2/api/_as_gen/matplotlib.axes.Axes.imshow.html
         :param figure_width: the spectrogram width in inches
         :param figure_height: the spectrogram height in inches
-        :returns a matplotlib.pyplot.figure object visualizing the spectrogram data
+        :param backend: "matplotlib" or "raster"; defaults to DisplayConfig.BACKEND
+        :returns a matplotlib.pyplot.figure object or a RasterImage visualizing the spectrogram data
         """
-        if self.spectrogram_type == "melspectrogram":
-            mel_spect = self._create_db_melspectrogram_data(self.audio_signal, self.sample_rate)
-            norm_mel_spect = self.normalize(mel_spect)
-            eight_bit_spectrogram = self.convert_pixels_to_8_bits(norm_mel_spect)
-            transformed_spectrogram = self.flip_and_invert(eight_bit_spectrogram)
-        elif self.spectrogram_type == "chromagram":
-            chromagram = self._create_chromagram_data(self.audio_signal, self.sample_rate)
-            transformed_spectrogram = chromagram
-        else:
-            spect = self._create_db_spectrogram_data(self.audio_signal)
-            transformed_spectrogram = spect
+        transformed_spectrogram = self._create_spectrogram_data()
         return self.display_data(
-            transformed_spectrogram, cmap=cmap, figure_width=figure_width, figure_height=figure_height)
+            transformed_spectrogram, cmap=cmap, figure_width=figure_width, figure_height=figure_height,
+            backend=backend)
 
 
 class WavePlotGenerator(FeatureGenerator, VisualDataMixin):
@@ -133,11 +174,12 @@ class LibrosaFeatureGenerator(FeatureGenerator):
 
     def __init__(self,
                  audio_signal: np.array, sample_rate: np.array, aggregate_features: bool = True,
-                 features_to_exclude: list = None, config=FeatureExtractorConfig):
+                 features_to_exclude: list = None, config=FeatureExtractorConfig,
+                 spectral_engine: SpectralEngine = None):
         """ Constructor capturing the raw audio_signal and sample_rate data extracted from librosa audio processing
         to generate features from that data
         """
-        super().__init__(audio_signal, sample_rate, features_to_exclude, config)
+        super().__init__(audio_signal, sample_rate, features_to_exclude, config, spectral_engine=spectral_engine)
         # Ignore Librosa warning regarding PySoundFile
         warnings.filterwarnings('ignore', module='librosa')
         self.aggregate_features = aggregate_features
@@ -145,25 +187,21 @@ class LibrosaFeatureGenerator(FeatureGenerator):
         self.aggregations = self.config.FEATURE_AGGREGATION
 
     def _get_feature_function(self, feature: str):
-        """ Factory method for librosa function corresponding to a given feature name
+        """ Factory method for the spectral engine function corresponding to a given feature name
 
-        :param feature - the name of the feature for which to retrieve the librosa function
-        :returns the librosa function object and inputs it requires to generate the given feature name
+        :param feature - the name of the feature for which to retrieve the function
+        :returns the function object and inputs it requires to generate the given feature name
         """
-        # Some librosa functions require both audio signal and sample rate, some just audio signal, etc.
-        input_types = [
-            {'y': self.audio_signal, 'sr': self.sample_rate},
-            {'y': self.audio_signal},
-            {'y': self.audio_signal, 'sr': self.sample_rate, 'n_mfcc': self.config.NUMBER_OF_MFCC_COLS},
-        ]
+        # Every spectral feature is derived from the STFT cached in the spectral engine
+        engine = self.spectral_engine
         features = {
-            'chroma_stft': (librosa.feature.chroma_stft, input_types[0]),
-            'rms': (librosa.feature.rms, input_types[1]),
-            'spec_cent': (librosa.feature.spectral_centroid, input_types[0]),
-            'spec_bw': (librosa.feature.spectral_bandwidth, input_types[0]),
-            'spec_rolloff': (librosa.feature.spectral_rolloff, input_types[0]),
-            'zcr': (librosa.feature.zero_crossing_rate, input_types[1]),
-            'mfcc': (librosa.feature.mfcc, input_types[2])
+            'chroma_stft': (engine.chroma_stft, {}),
+            'rms': (engine.rms, {}),
+            'spec_cent': (engine.spectral_centroid, {}),
+            'spec_bw': (engine.spectral_bandwidth, {}),
+            'spec_rolloff': (engine.spectral_rolloff, {}),
+            'zcr': (engine.zero_crossing_rate, {}),
+            'mfcc': (engine.mfcc, {'n_mfcc': self.config.NUMBER_OF_MFCC_COLS})
         }
         try:
             return features[feature]
@@ -202,28 +240,20 @@ class LibrosaFeatureGenerator(FeatureGenerator):
         :returns a new dictionary containing the names of the feature aggregations as keys and agg results as values
             and a list of feature names in order of processing
         """
-        aggregated_features = {}
-        aggregation_functions = {'mean': np.mean, 'min': np.min, 'max': np.max, 'std': np.std}
-        feature_names = []
-        for feature, data in feature_dict.items():
-            # Aggregate the feature data and store the aggregations in the aggregated features dictionary
-            if feature != 'mfcc':
-                for aggregation in self.aggregations:
-                    if aggregation not in aggregation_functions:
-                        raise ValueError(
-                            "aggregation {0} is not associated with a valid aggregation function".format(aggregation))
-                    # Apply the aggregation result and store it
-                    aggregation_function = aggregation_functions[aggregation]
-                    feature_name = '{0}-{1}'.format(feature, aggregation)
-                    aggregated_features[feature_name] = aggregation_function(data)
-                    feature_names.append(feature_name)
-            else:
-                # Other features can't be aggregated
-                for mfcc_col in range(self.config.NUMBER_OF_MFCC_COLS):
-                    feature_name = 'mfcc{0}'.format(mfcc_col)
-                    aggregated_features[feature_name] = aggregation_functions['mean'](data[mfcc_col])
-                    feature_names.append(feature_name)
-        return aggregated_features, feature_names
+        aggregator = FeatureAggregator.from_feature_dict(feature_dict, self.aggregations)
+        # Every feature is aggregated in one vectorized pass over the stacked frame-level data
+        feature_vector = aggregator.aggregate_features(feature_dict)
+        return dict(zip(aggregator.columns, feature_vector)), aggregator.columns
+
+    def generate_vector(self) -> tuple:
+        """ Extracts the supported features and aggregates them into a vector without building a dictionary
+
+        :returns a float32 numpy array of the feature aggregations and a list of their names in order, which is the
+            order of the model's feature_cols.csv with the default config
+        """
+        features, _ = self._extract_features()
+        aggregator = FeatureAggregator.from_feature_dict(features, self.aggregations)
+        return aggregator.aggregate_features(features), aggregator.columns
 
     def generate(self) -> tuple:
         """ Runs the main feature generator logic and returns a dictionary with the processed features
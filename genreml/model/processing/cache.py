@@ -0,0 +1,196 @@
+# Name: cache.py
+# Description: defines a content-addressed cache for features, spectrograms and predictions extracted from audio
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import uuid
+
+from genreml.model.processing.config import AudioConfig, CacheConfig, FeatureExtractorConfig, get_config_values
+
+
+def hash_bytes(data: bytes) -> str:
+    """ Returns the sha256 hex digest of the given bytes """
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_location: str) -> str:
+    """ Returns the sha256 hex digest of the contents of the given file without reading it into memory at once """
+    content_hash = hashlib.sha256()
+    with open(file_location, 'rb') as audio_file:
+        for chunk in iter(lambda: audio_file.read(1 << 20), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def get_clip_policy(num_clips: int = 1) -> dict:
+    """ Describes how audio gets clipped before features are extracted from it so cached results from clips of a
+    different length or count are never reused
+    """
+    return {'min_clip_length': AudioConfig.MIN_CLIP_LENGTH, 'num_clips': num_clips}
+
+
+class FeatureCache(object):
+    """ Content-addressed cache of anything computed from audio like features, spectrogram images or predictions
+
+    Entries are keyed by the hash of the audio content together with everything that affects the result (see
+    make_key) and kept in two tiers: an optional in-process LRU of up to max_memory_entries entries in front of an
+    on-disk store that evicts the least recently used entries once it grows past max_disk_bytes. The disk store can be
+    shared by several processes; the cache is safe to use across threads and can be passed to worker processes.
+    """
+
+    def __init__(self, directory: str = None, max_disk_bytes: int = None, max_memory_entries: int = None):
+        self.directory = directory or CacheConfig.DIRECTORY
+        self.max_disk_bytes = max_disk_bytes if max_disk_bytes is not None else CacheConfig.MAX_DISK_BYTES
+        self.max_memory_entries = \
+            max_memory_entries if max_memory_entries is not None else CacheConfig.MAX_MEMORY_ENTRIES
+        self._init_state()
+
+    def _init_state(self) -> None:
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        self._disk_usage = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        # Only the settings are sent to other processes; each process keeps its own memory tier
+        return {'directory': self.directory, 'max_disk_bytes': self.max_disk_bytes,
+                'max_memory_entries': self.max_memory_entries}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._init_state()
+
+    @staticmethod
+    def make_key(audio_hash: str, kind: str, clip_policy: dict = None, model_hash: str = None,
+                 **parameters) -> str:
+        """ Builds the key of a cache entry
+
+        :param audio_hash: the content hash of the audio the entry was computed from
+        :param kind: what the entry holds (e.g. "features", "images" or "prediction")
+        :param clip_policy: how the audio was clipped; see get_clip_policy
+        :param model_hash: the content hash of the model for entries that depend on one
+        :param parameters: any other settings that change the result like the cmap or features excluded
+        :returns a hex digest identifying the entry
+        """
+        key_data = {
+            'version': CacheConfig.VERSION,
+            'audio_hash': audio_hash,
+            'kind': kind,
+            'feature_config': get_config_values(FeatureExtractorConfig),
+            'clip_policy': clip_policy,
+            'model_hash': model_hash,
+            'parameters': parameters
+        }
+        key_json = json.dumps(
+            key_data, sort_keys=True,
+            default=lambda value: sorted(value) if isinstance(value, (set, frozenset)) else str(value))
+        return hash_bytes(key_json.encode('utf-8'))
+
+    def _get_entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def _remember(self, key: str, value: any) -> None:
+        """ Adds an entry to the in-process tier, dropping the least recently used entries past the limit """
+        if self.max_memory_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str, default: any = None) -> any:
+        """ Retrieves the value stored under the given key or default if there isn't one """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        entry_path = self._get_entry_path(key)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                value = pickle.load(entry_file)
+            # Mark the entry as recently used for eviction
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logging.warning("failed to read cache entry {0} due to {1}".format(entry_path, e))
+            return default
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: any) -> None:
+        """ Stores a picklable value under the given key in both tiers """
+        self._remember(key, value)
+        entry_path = self._get_entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Write to a temporary file first so other processes never read a partial entry
+        temp_path = "{0}.{1}.tmp".format(entry_path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as entry_file:
+            pickle.dump(value, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            # An entry that's overwritten only grows the store by the difference in size
+            try:
+                replaced_size = os.path.getsize(entry_path)
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(temp_path, entry_path)
+            if self._disk_usage is None:
+                self._disk_usage = self._get_disk_entries_size()
+            else:
+                self._disk_usage += os.path.getsize(entry_path) - replaced_size
+            if self._disk_usage > self.max_disk_bytes:
+                self._evict()
+
+    def get_or_compute(self, key: str, compute_function) -> any:
+        """ Retrieves the value stored under the given key or computes it with compute_function and stores it """
+        value = self.get(key)
+        if value is None:
+            value = compute_function()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def _list_disk_entries(self) -> list:
+        entries = []
+        for entry_dir in os.scandir(self.directory):
+            if not entry_dir.is_dir():
+                continue
+            for entry in os.scandir(entry_dir.path):
+                if entry.name.endswith('.pkl'):
+                    entries.append(entry)
+        return entries
+
+    def _get_disk_entries_size(self) -> int:
+        return sum(entry.stat().st_size for entry in self._list_disk_entries())
+
+    def _evict(self) -> None:
+        """ Deletes the least recently used entries on disk until the store fits in max_disk_bytes """
+        entries = sorted(
+            ((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._list_disk_entries()))
+        self._disk_usage = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._disk_usage <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                self._disk_usage -= size
+            except FileNotFoundError:
+                # Already evicted by another process
+                self._disk_usage -= size
+
+    def clear(self) -> None:
+        """ Removes every entry from both tiers """
+        with self._lock:
+            self._memory.clear()
+            for entry in self._list_disk_entries():
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            self._disk_usage = 0
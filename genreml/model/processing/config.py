@@ -1,6 +1,10 @@
 # Name: config.py
 # Description: defines configurations for the various components of audio extraction and processing
 
+import os
+
+from pathlib import Path
+
 
 class AudioConfig:
     # The format to store audio in
@@ -9,8 +13,19 @@ class AudioConfig:
     FEATURE_DESTINATION = '/features/'
     # Checkpoint frequency in number of tracks processed
     CHECKPOINT_FREQUENCY = 10
+    # The file format to save extracted features in; npz and parquet write typed columns instead of text
+    SUPPORTED_FEATURE_FORMATS = ['csv', 'npz', 'parquet']
+    FEATURE_FORMAT = 'csv'
     # Minimum required clip length for prediction
     MIN_CLIP_LENGTH = 29
+    # Seconds of extra audio decoded on each side of a clip so resampling edge effects fall outside of it
+    DECODE_MARGIN = 0.5
+    # Number of processes to extract features from a directory of files with; 1 processes the files serially
+    WORKERS = 1
+    # How many files each worker can have queued up at once so the pool never holds the whole directory in memory
+    WORKER_QUEUE_DEPTH = 2
+    # How worker processes are started; spawn avoids forking a parent that has already loaded tensorflow
+    WORKER_START_METHOD = "spawn"
 
 
 class DisplayConfig:
@@ -20,6 +35,11 @@ class DisplayConfig:
     # Defines the size of the figures created by display
     FIGSIZE_WIDTH = 10
     FIGSIZE_HEIGHT = 10
+    # Pixels per inch of figure size; matches matplotlib's default figure dpi
+    DPI = 100
+    # How to render spectrograms: "matplotlib" builds a figure and "raster" writes the array straight to an image
+    SUPPORTED_BACKENDS = ['matplotlib', 'raster']
+    BACKEND = "matplotlib"
 
 
 class FeatureExtractorConfig:
@@ -30,3 +50,46 @@ class FeatureExtractorConfig:
     FEATURE_AGGREGATION = ['mean', 'min', 'max', 'std']
     N_FFT = 2048
     HOP_LENGTH = 1024
+    # Hop length of the frame-level features the model was trained on (librosa's default); HOP_LENGTH should be a
+    # multiple of it so that spectrogram images can be sliced from the same STFT
+    FEATURE_HOP_LENGTH = 512
+
+
+class StreamingConfig:
+    # Seconds of audio decoded and transformed at a time when streaming a file; memory use depends on this instead of
+    # on the length of the file
+    BLOCK_DURATION = 30
+    # The sample rate audio is streamed at; librosa.load's default, which every other path decodes at
+    SAMPLE_RATE = 22050
+    # Seconds between the starts of consecutive windows when predicting genres across a whole track
+    WINDOW_HOP = 15
+
+
+class CacheConfig:
+    # Where cached features, images and predictions are stored on disk
+    DIRECTORY = os.path.join(str(Path.home()), '.genreml', 'cache')
+    # How large the on-disk cache can grow before the least recently used entries are evicted
+    MAX_DISK_BYTES = 1024 * 1024 * 1024
+    # How many entries to also keep in memory in each process; 0 disables the in-process tier
+    MAX_MEMORY_ENTRIES = 256
+    # Bump whenever the way features or images are computed changes to stop reusing older entries
+    VERSION = 1
+
+
+def get_config_values(config_class) -> dict:
+    """ Retrieves the current values of the settings defined in a config class
+
+    :param config_class: one of the config classes in this module
+    :returns a dictionary of setting name to value
+    """
+    return {name: value for name, value in vars(config_class).items() if name.isupper()}
+
+
+def set_config_values(config_class, config_values: dict) -> None:
+    """ Overrides the settings of a config class; used to carry settings made at runtime over to worker processes
+
+    :param config_class: one of the config classes in this module
+    :param config_values: a dictionary of setting name to value like the one returned by get_config_values
+    """
+    for name, value in config_values.items():
+        setattr(config_class, name, value)
@@ -1,12 +1,39 @@
 # Name: display.py
 # Description: defines common display functionality for matplot graphics
 
+import io
 import matplotlib.pyplot as plt
 import numpy as np
 
+from PIL import Image
+
 from genreml.model.processing.config import DisplayConfig
 
 
+class RasterImage(object):
+    """ An image rendered straight from a numpy array that can be saved like a matplotlib figure """
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+
+    def savefig(self, path: str) -> None:
+        """ Saves the image as a PNG; like matplotlib, the .png extension is added if the path doesn't have it """
+        if not path.endswith(".png"):
+            path = path + ".png"
+        self.image.save(path, format="PNG")
+
+    def to_buffer(self) -> io.BytesIO:
+        """ Encodes the image as a PNG in an in-memory buffer """
+        buffer = io.BytesIO()
+        self.image.save(buffer, format="PNG")
+        buffer.seek(0)
+        return buffer
+
+    def to_array(self, mode: str = "L") -> np.ndarray:
+        """ Returns the pixel data of the image converted to the given PIL mode """
+        return np.asarray(self.image.convert(mode))
+
+
 class VisualDataMixin(object):
     """ Defines common functionality for visualization of features """
 
@@ -39,13 +66,79 @@ class VisualDataMixin(object):
         fig.add_axes(ax)
         return fig, ax
 
+    @staticmethod
+    def scale_data(visual_data: np.array) -> np.array:
+        """ Scales the given data to [0, 1] between its min and max the way imshow does before applying a cmap """
+        visual_data = np.asarray(visual_data, dtype=np.float64)
+        data_range = visual_data.max() - visual_data.min()
+        if data_range > 0:
+            return (visual_data - visual_data.min()) / data_range
+        return np.zeros_like(visual_data)
+
+    @staticmethod
+    def resize_data(visual_data: np.array, height: int, width: int) -> np.array:
+        """ Resizes a 2D array to height x width with a triangle filter that widens when downsampling, the same way
+        PIL's bilinear resize does, so no image needs to be created
+        """
+        def get_weights(input_size, output_size):
+            scale = input_size / output_size
+            support = max(scale, 1.0)
+            output_centers = (np.arange(output_size) + 0.5) * scale
+            input_centers = np.arange(input_size) + 0.5
+            weights = np.clip(1 - np.abs(input_centers - output_centers[:, np.newaxis]) / support, 0, None)
+            return weights / weights.sum(axis=1, keepdims=True)
+
+        visual_data = np.asarray(visual_data, dtype=np.float64)
+        row_weights = get_weights(visual_data.shape[0], height)
+        col_weights = get_weights(visual_data.shape[1], width)
+        return row_weights @ visual_data @ col_weights.T
+
+    @staticmethod
+    def to_grayscale_pixels(visual_data: np.array, height: int, width: int,
+                            cmap: str = DisplayConfig.CMAP) -> np.array:
+        """ Converts the given data to the height x width grayscale pixels a saved figure of it would have without
+        rendering an image
+
+        :returns a numpy uint8 array of shape (height, width)
+        """
+        scaled_data = VisualDataMixin.resize_data(VisualDataMixin.scale_data(visual_data), height, width)
+        pixels = plt.get_cmap(cmap)(scaled_data, bytes=True).astype(np.float64)
+        # Same luminance transform PIL uses when converting RGB images to L mode
+        luminance = pixels[..., 0] * 0.299 + pixels[..., 1] * 0.587 + pixels[..., 2] * 0.114
+        return np.round(luminance).astype(np.uint8)
+
+    @staticmethod
+    def rasterize_data(
+            visual_data: np.array, cmap: str = DisplayConfig.CMAP,
+            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT
+    ) -> RasterImage:
+        """ Renders the given data straight to an image of figure size * DisplayConfig.DPI pixels without creating a
+        matplotlib figure; the data is scaled and colored the same way imshow would
+        """
+        width = int(round(figure_width * DisplayConfig.DPI))
+        height = int(round(figure_height * DisplayConfig.DPI))
+        pixels = plt.get_cmap(cmap)(VisualDataMixin.scale_data(visual_data), bytes=True)
+        image = Image.fromarray(pixels, mode="RGBA").resize((width, height), Image.BILINEAR)
+        return RasterImage(image)
+
     @staticmethod
     def display_data(
             visual_data: np.array, frameon: bool = False, cmap: str = DisplayConfig.CMAP,
             display_axes: bool = False, x_axis_name: str = None, y_axis_name: str = None,
-            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT
+            figure_width: float = DisplayConfig.FIGSIZE_WIDTH, figure_height: float = DisplayConfig.FIGSIZE_HEIGHT,
+            backend: str = None
     ) -> plt.figure:
-        """ Displays the given data in a matplotlib figure and returns the figure object """
+        """ Displays the given data in a matplotlib figure and returns the figure object
+
+        If the backend (DisplayConfig.BACKEND by default) is "raster" and no axes are requested then a RasterImage is
+        returned instead of a figure
+        """
+        backend = backend or DisplayConfig.BACKEND
+        if backend not in DisplayConfig.SUPPORTED_BACKENDS:
+            raise ValueError("display backend {0} is not supported".format(backend))
+        if backend == "raster" and not display_axes:
+            return VisualDataMixin.rasterize_data(
+                visual_data, cmap=cmap, figure_width=figure_width, figure_height=figure_height)
         fig, ax = VisualDataMixin.create_display_figure(
             frameon, display_axes, x_axis_name, y_axis_name, figure_width=figure_width, figure_height=figure_height)
         ax.imshow(visual_data, aspect='auto', cmap=cmap)
@@ -54,4 +147,6 @@ class VisualDataMixin(object):
     @staticmethod
     def close_img(fig: plt.figure) -> None:
         """ Closes a matplotlib figure """
+        if isinstance(fig, RasterImage):
+            return
         plt.close(fig)
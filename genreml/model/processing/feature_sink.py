@@ -0,0 +1,273 @@
+# Name: feature_sink.py
+# Description: defines writers that save extracted features in batches and a reader that loads them back
+
+import glob
+import logging
+import numbers
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from genreml.model.processing.config import AudioConfig
+
+# Every shard written by a sink starts with this prefix so that a directory of them can be read back as one table
+FEATURE_FILE_PREFIX = 'feature_data_'
+# Stands in for missing text features in npz shards, whose string matrices can't hold None; the unit separator control
+# character doesn't turn up in file names or track metadata
+NPZ_MISSING_TEXT = '\x1f'
+
+
+class FeatureSink(object):
+    """ Accumulates feature dictionaries in preallocated typed arrays and writes them out in batches
+
+    The columns are taken from the first row added and features that only show up in later rows are dropped with a
+    warning: numeric features are kept in a float64 matrix and anything else (like the file name) in an object matrix.
+    Both grow by doubling so adding a row is amortized O(1) and nothing is formatted or written until flush is called,
+    typically once per checkpoint. Subclasses define how a batch of rows is written by implementing _write.
+    """
+
+    extension = None
+
+    def __init__(self, destination_filepath: str, initial_capacity: int = None):
+        self.destination_filepath = destination_filepath or ''
+        self.initial_capacity = initial_capacity or max(int(AudioConfig.CHECKPOINT_FREQUENCY), 1)
+        self._column_order, self.numeric_columns, self.text_columns = None, None, None
+        self._column_set, self._dropped_columns = None, set()
+        self._numeric_values, self._text_values = None, None
+        self.row_count = 0
+        self.rows_written = 0
+
+    @property
+    def columns(self) -> list:
+        """ The names of the columns in the order they were first seen """
+        return self._column_order
+
+    def _initialize_columns(self, feature_dict: dict) -> None:
+        self._column_order = list(feature_dict.keys())
+        self._column_set = set(self._column_order)
+        self.numeric_columns = [
+            column for column, value in feature_dict.items() if isinstance(value, (numbers.Number, np.number))]
+        self.text_columns = [column for column in self._column_order if column not in self.numeric_columns]
+        self._numeric_values = np.empty((self.initial_capacity, len(self.numeric_columns)), dtype=np.float64)
+        self._text_values = np.empty((self.initial_capacity, len(self.text_columns)), dtype=object)
+
+    def _grow(self) -> None:
+        """ Doubles the capacity of the preallocated arrays """
+        capacity = self._numeric_values.shape[0] * 2
+        numeric_values = np.empty((capacity, len(self.numeric_columns)), dtype=np.float64)
+        numeric_values[:self.row_count] = self._numeric_values[:self.row_count]
+        text_values = np.empty((capacity, len(self.text_columns)), dtype=object)
+        text_values[:self.row_count] = self._text_values[:self.row_count]
+        self._numeric_values, self._text_values = numeric_values, text_values
+
+    def add(self, feature_dict: dict) -> None:
+        """ Adds a single row of features; features missing from the row are stored as NaN or None and features that
+        weren't in the first row are dropped, logging a warning the first time each one is seen
+
+        :param feature_dict: a dictionary of feature name to value like the ones in AudioCollection.features
+        """
+        if self.numeric_columns is None:
+            self._initialize_columns(feature_dict)
+        elif not feature_dict.keys() <= self._column_set:
+            self._warn_dropped_columns(feature_dict)
+        if self.row_count == self._numeric_values.shape[0]:
+            self._grow()
+        row = self.row_count
+        for idx, column in enumerate(self.numeric_columns):
+            self._numeric_values[row, idx] = feature_dict.get(column, np.nan)
+        for idx, column in enumerate(self.text_columns):
+            self._text_values[row, idx] = feature_dict.get(column)
+        self.row_count += 1
+
+    def _warn_dropped_columns(self, feature_dict: dict) -> None:
+        new_columns = [
+            column for column in feature_dict if column not in self._column_set and column not in self._dropped_columns]
+        if new_columns:
+            logging.warning("dropping features {0} that weren't in the first row added to {1}".format(
+                new_columns, self.path))
+            self._dropped_columns.update(new_columns)
+
+    def add_rows(self, features: list) -> None:
+        """ Adds many rows of features at once """
+        for feature_dict in features:
+            self.add(feature_dict)
+
+    def to_df(self) -> pd.DataFrame:
+        """ Creates a data frame of the rows that haven't been flushed yet with the columns in their original order """
+        df = pd.DataFrame(self._numeric_values[:self.row_count], columns=self.numeric_columns)
+        for idx, column in enumerate(self.text_columns):
+            df[column] = self._text_values[:self.row_count, idx]
+        return df[self._column_order]
+
+    def flush(self) -> int:
+        """ Writes out the rows added since the last flush and empties the buffers while keeping their capacity
+
+        :returns the number of rows written
+        """
+        if not self.row_count:
+            return 0
+        row_count = self.row_count
+        logging.info("writing {0} feature records to {1}".format(row_count, self.path))
+        self._write(self._numeric_values[:row_count], self._text_values[:row_count])
+        self.rows_written += row_count
+        self.row_count = 0
+        return row_count
+
+    def close(self) -> None:
+        """ Flushes any remaining rows and finalizes the output """
+        self.flush()
+
+    @property
+    def path(self) -> str:
+        raise NotImplementedError()
+
+    def _write(self, numeric_values: np.ndarray, text_values: np.ndarray) -> None:
+        raise NotImplementedError()
+
+
+class CsvFeatureSink(FeatureSink):
+    """ Writes features to a single feature_data_<pid>.csv file per process, appending a batch of rows at every flush
+    """
+
+    extension = 'csv'
+
+    @property
+    def path(self) -> str:
+        return "{0}{1}{2}.csv".format(self.destination_filepath, FEATURE_FILE_PREFIX, str(os.getpid()))
+
+    def _write(self, numeric_values: np.ndarray, text_values: np.ndarray) -> None:
+        self.write_df(self.to_df(), self.path)
+
+    @staticmethod
+    def write_df(df: pd.DataFrame, csv_filepath: str) -> None:
+        """ Saves a data frame of features to a CSV file, appending to it without a header if it already exists """
+        if os.path.isfile(csv_filepath):
+            df.to_csv(csv_filepath, float_format='%.{}e'.format(10), header=False, index=False, mode='a')
+        else:
+            df.to_csv(csv_filepath, float_format='%.{}e'.format(10), index=False, mode='w')
+
+
+class NpzFeatureSink(FeatureSink):
+    """ Writes every flush to its own feature_data_<pid>_<id>_<shard>.npz file holding the numeric features as a
+    float64 matrix and the text features as a string matrix, along with the names of their columns
+    """
+
+    extension = 'npz'
+
+    def __init__(self, destination_filepath: str, initial_capacity: int = None):
+        super().__init__(destination_filepath, initial_capacity)
+        self.sink_id = uuid.uuid4().hex[:8]
+        self.shard_count = 0
+
+    @property
+    def path(self) -> str:
+        return "{0}{1}{2}_{3}_{4:05d}.npz".format(
+            self.destination_filepath, FEATURE_FILE_PREFIX, os.getpid(), self.sink_id, self.shard_count)
+
+    def _write(self, numeric_values: np.ndarray, text_values: np.ndarray) -> None:
+        # Write to a temporary file first so readers never see a partial shard
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as shard_file:
+            np.savez(
+                shard_file,
+                columns=np.array(self.columns, dtype=str),
+                numeric_columns=np.array(self.numeric_columns, dtype=str),
+                numeric_values=numeric_values,
+                text_columns=np.array(self.text_columns, dtype=str),
+                text_values=np.where(text_values == None, NPZ_MISSING_TEXT, text_values).astype(str)  # noqa: E711
+            )
+        os.replace(temp_path, self.path)
+        self.shard_count += 1
+
+
+class ParquetFeatureSink(FeatureSink):
+    """ Writes features to a feature_data_<pid>_<id>.parquet file with one row group per flush; requires pyarrow
+
+    The file can only be read once the sink has been closed
+    """
+
+    extension = 'parquet'
+
+    def __init__(self, destination_filepath: str, initial_capacity: int = None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow needs to be installed to save features as parquet")
+        super().__init__(destination_filepath, initial_capacity)
+        self._pyarrow, self._parquet = pyarrow, pyarrow.parquet
+        self.sink_id = uuid.uuid4().hex[:8]
+        self._writer = None
+
+    @property
+    def path(self) -> str:
+        return "{0}{1}{2}_{3}.parquet".format(self.destination_filepath, FEATURE_FILE_PREFIX, os.getpid(), self.sink_id)
+
+    def _write(self, numeric_values: np.ndarray, text_values: np.ndarray) -> None:
+        arrays = {column: numeric_values[:, idx] for idx, column in enumerate(self.numeric_columns)}
+        arrays.update({
+            column: self._pyarrow.array(
+                [None if value is None else str(value) for value in text_values[:, idx]], type=self._pyarrow.string())
+            for idx, column in enumerate(self.text_columns)})
+        table = self._pyarrow.table({column: arrays[column] for column in self.columns})
+        if self._writer is None:
+            self._writer = self._parquet.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+FEATURE_SINKS = {sink.extension: sink for sink in (CsvFeatureSink, NpzFeatureSink, ParquetFeatureSink)}
+
+
+def get_feature_sink(destination_filepath: str, feature_format: str = None) -> FeatureSink:
+    """ Creates a sink that saves features in the given format
+
+    :param destination_filepath: the directory to save the features in
+    :param feature_format: one of AudioConfig.SUPPORTED_FEATURE_FORMATS; defaults to AudioConfig.FEATURE_FORMAT
+    """
+    feature_format = feature_format or AudioConfig.FEATURE_FORMAT
+    if feature_format not in FEATURE_SINKS:
+        raise ValueError("feature format {0} is not supported".format(feature_format))
+    return FEATURE_SINKS[feature_format](destination_filepath)
+
+
+def _read_npz(shard_path: str) -> pd.DataFrame:
+    with np.load(shard_path) as shard:
+        df = pd.DataFrame(shard['numeric_values'], columns=list(shard['numeric_columns']))
+        for idx, column in enumerate(shard['text_columns']):
+            text_values = shard['text_values'][:, idx].astype(object)
+            text_values[text_values == NPZ_MISSING_TEXT] = None
+            df[column] = text_values
+        return df[list(shard['columns'])]
+
+
+def _read_parquet(shard_path: str) -> pd.DataFrame:
+    import pyarrow.parquet
+    return pyarrow.parquet.read_table(shard_path).to_pandas()
+
+
+FEATURE_READERS = {'csv': pd.read_csv, 'npz': _read_npz, 'parquet': _read_parquet}
+
+
+def read_features(directory: str, feature_format: str = None) -> pd.DataFrame:
+    """ Loads every feature shard saved in a directory as a single data frame
+
+    :param directory: the directory the features were saved in
+    :param feature_format: only read shards of this format; by default shards of every format are read
+    :returns a data frame with a row per track
+    """
+    feature_formats = [feature_format] if feature_format else list(FEATURE_READERS)
+    frames = []
+    for shard_format in feature_formats:
+        shard_paths = sorted(glob.glob(os.path.join(directory, "{0}*.{1}".format(FEATURE_FILE_PREFIX, shard_format))))
+        frames.extend(FEATURE_READERS[shard_format](shard_path) for shard_path in shard_paths)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
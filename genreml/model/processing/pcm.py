@@ -0,0 +1,65 @@
+# Name: pcm.py
+# Description: defines the compact format decoded audio clips are passed between services in so they're never decoded
+#              or resampled again
+
+import struct
+
+import numpy as np
+
+# Every encoded clip starts with these bytes
+PCM_MAGIC = b'GMLP'
+PCM_VERSION = 1
+# Codes of the sample types stored in the header
+PCM_SAMPLE_TYPES = {1: np.dtype('<i2'), 2: np.dtype('<f4')}
+# Magic, version, sample type code, two padding bytes, sample rate and number of samples
+PCM_HEADER = struct.Struct('<4sBBxxII')
+# Extension of files holding an encoded clip
+PCM_EXTENSION = 'pcm'
+# Scale between float samples in [-1, 1] and 16 bit integer samples, the same one libsndfile uses
+INT16_SCALE = 32768
+
+
+def encode_pcm(audio_signal: np.ndarray, sample_rate: int, sample_type: str = 'int16') -> bytes:
+    """ Encodes a mono signal as a 16 byte header followed by its raw little endian samples
+
+    :param audio_signal: the samples of the clip as floats in [-1, 1]
+    :param sample_rate: the sample rate of the clip
+    :param sample_type: int16 for half the size of float32 at the precision of a 16 bit WAV file or float32 to keep the
+    samples as they are
+    :returns the encoded clip
+    """
+    dtype = np.dtype(sample_type).newbyteorder('<')
+    sample_type_codes = {value: key for key, value in PCM_SAMPLE_TYPES.items()}
+    if dtype not in sample_type_codes:
+        raise ValueError("{0} is not a supported sample type, use int16 or float32".format(sample_type))
+    audio_signal = np.asarray(audio_signal)
+    if dtype.kind == 'i':
+        audio_signal = np.clip(audio_signal, -1.0, 1.0) * (INT16_SCALE - 1)
+    header = PCM_HEADER.pack(PCM_MAGIC, PCM_VERSION, sample_type_codes[dtype], int(sample_rate), len(audio_signal))
+    return header + audio_signal.astype(dtype).tobytes()
+
+
+def is_pcm(data: bytes) -> bool:
+    """ Whether the given bytes are a clip encoded with encode_pcm rather than an audio file """
+    return len(data) >= PCM_HEADER.size and bytes(data[:len(PCM_MAGIC)]) == PCM_MAGIC
+
+
+def decode_pcm(data: bytes) -> tuple:
+    """ Decodes a clip encoded with encode_pcm
+
+    float32 samples are viewed in place with np.frombuffer so the returned signal is read-only and shares memory with
+    data; int16 samples are scaled back to float32
+
+    :param data: the encoded clip
+    :returns a tuple of the audio signal as float32 samples and its sample rate
+    """
+    if not is_pcm(data):
+        raise ValueError("data is not an encoded pcm clip")
+    _, version, sample_type_code, sample_rate, sample_count = PCM_HEADER.unpack_from(data)
+    if version != PCM_VERSION or sample_type_code not in PCM_SAMPLE_TYPES:
+        raise ValueError("unsupported pcm clip version {0} or sample type {1}".format(version, sample_type_code))
+    audio_signal = np.frombuffer(
+        data, dtype=PCM_SAMPLE_TYPES[sample_type_code], count=sample_count, offset=PCM_HEADER.size)
+    if audio_signal.dtype.kind == 'i':
+        audio_signal = audio_signal.astype(np.float32) / INT16_SCALE
+    return audio_signal, sample_rate
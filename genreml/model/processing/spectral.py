@@ -0,0 +1,136 @@
+# Name: spectral.py
+# Description: defines a shared STFT engine so that each audio clip is only transformed once
+
+import librosa
+import numpy as np
+
+from genreml.model.processing.config import FeatureExtractorConfig
+
+
+class SpectralEngine(object):
+    """ Computes the magnitude STFT of an audio signal once and derives every spectral feature and spectrogram from
+    the cached matrix
+
+    The STFT is computed with FeatureExtractorConfig.FEATURE_HOP_LENGTH; any coarser hop length that is a multiple of
+    it (like FeatureExtractorConfig.HOP_LENGTH used for images) is sliced from the same matrix instead of being
+    recomputed since centered STFT frames at hop k * h are every k-th frame at hop h.
+    """
+
+    def __init__(self, audio_signal: np.ndarray, sample_rate, config=FeatureExtractorConfig,
+                 base_hop_length: int = None, center: bool = True):
+        """ Instantiates a SpectralEngine for the given audio signal
+
+        :param audio_signal: an audio time-series
+        :param sample_rate: the sampling rate of the audio time-series
+        :param config: the configuration holding the STFT settings
+        :param base_hop_length: the hop length of the one STFT computed; defaults to
+        FeatureExtractorConfig.FEATURE_HOP_LENGTH, use FeatureExtractorConfig.HOP_LENGTH when only images are needed
+        so the finer feature STFT isn't computed just to be sliced
+        :param center: whether frames are centered on their hop by padding the signal like librosa does by default;
+        signals that already carry the padding, like the blocks of a stream, are framed as they are
+        """
+        self.audio_signal = audio_signal
+        self.sample_rate = sample_rate
+        self.config = config
+        self.base_hop_length = base_hop_length or config.FEATURE_HOP_LENGTH
+        self.center = center
+        self._magnitude = {}
+        self._power = {}
+        self._mel_power = {}
+
+    def _get_stride(self, hop_length: int) -> int:
+        """ Returns how many base frames to step over to get frames at the given hop length or 0 if the hop length
+        can't be derived from the base STFT
+        """
+        base_hop_length = self.base_hop_length
+        if hop_length != base_hop_length and hop_length % base_hop_length == 0:
+            return hop_length // base_hop_length
+        return 0
+
+    def magnitude(self, hop_length: int = None) -> np.ndarray:
+        """ Retrieves the magnitude STFT of the audio signal
+
+        :param hop_length: the hop length of the STFT; defaults to the base hop length
+        :returns a numpy array of shape (1 + N_FFT / 2, frames)
+        """
+        hop_length = hop_length or self.base_hop_length
+        if hop_length not in self._magnitude:
+            stride = self._get_stride(hop_length)
+            if stride:
+                self._magnitude[hop_length] = self.magnitude()[:, ::stride]
+            else:
+                self._magnitude[hop_length] = np.abs(librosa.stft(
+                    y=self.audio_signal, n_fft=self.config.N_FFT, hop_length=hop_length, center=self.center))
+        return self._magnitude[hop_length]
+
+    def power(self, hop_length: int = None) -> np.ndarray:
+        """ Retrieves the power STFT of the audio signal
+
+        :param hop_length: the hop length of the STFT; defaults to the base hop length
+        """
+        hop_length = hop_length or self.base_hop_length
+        if hop_length not in self._power:
+            stride = self._get_stride(hop_length)
+            if stride:
+                self._power[hop_length] = self.power()[:, ::stride]
+            else:
+                self._power[hop_length] = self.magnitude(hop_length) ** 2
+        return self._power[hop_length]
+
+    def mel_power(self, hop_length: int = None) -> np.ndarray:
+        """ Retrieves the mel filterbank output of the power STFT; shared by MFCC and melspectrogram images
+
+        :param hop_length: the hop length of the STFT; defaults to the base hop length
+        """
+        hop_length = hop_length or self.base_hop_length
+        if hop_length not in self._mel_power:
+            stride = self._get_stride(hop_length)
+            if stride:
+                self._mel_power[hop_length] = self.mel_power()[:, ::stride]
+            else:
+                self._mel_power[hop_length] = librosa.feature.melspectrogram(
+                    S=self.power(hop_length), sr=self.sample_rate)
+        return self._mel_power[hop_length]
+
+    def chroma_stft(self, hop_length: int = None) -> np.ndarray:
+        return librosa.feature.chroma_stft(S=self.power(hop_length), sr=self.sample_rate)
+
+    def spectral_centroid(self) -> np.ndarray:
+        return librosa.feature.spectral_centroid(S=self.magnitude(), sr=self.sample_rate)
+
+    def spectral_bandwidth(self) -> np.ndarray:
+        return librosa.feature.spectral_bandwidth(S=self.magnitude(), sr=self.sample_rate)
+
+    def spectral_rolloff(self) -> np.ndarray:
+        return librosa.feature.spectral_rolloff(S=self.magnitude(), sr=self.sample_rate)
+
+    def rms(self) -> np.ndarray:
+        # RMS is computed in the time domain to match the features the model was trained on
+        return librosa.feature.rms(
+            y=self.audio_signal, frame_length=self.config.N_FFT, hop_length=self.config.FEATURE_HOP_LENGTH,
+            center=self.center)
+
+    def zero_crossing_rate(self) -> np.ndarray:
+        return librosa.feature.zero_crossing_rate(
+            y=self.audio_signal, frame_length=self.config.N_FFT, hop_length=self.config.FEATURE_HOP_LENGTH,
+            center=self.center)
+
+    def mfcc(self, n_mfcc: int = None) -> np.ndarray:
+        n_mfcc = n_mfcc or self.config.NUMBER_OF_MFCC_COLS
+        return librosa.feature.mfcc(S=librosa.power_to_db(self.mel_power()), n_mfcc=n_mfcc)
+
+    def db_melspectrogram(self, hop_length: int = None) -> np.ndarray:
+        """ Creates the data for a decibel melspectrogram; defaults to FeatureExtractorConfig.HOP_LENGTH """
+        return librosa.power_to_db(self.mel_power(hop_length or self.config.HOP_LENGTH))
+
+    def db_spectrogram(self, hop_length: int = None) -> np.ndarray:
+        """ Creates the data for a decibel spectrogram; defaults to FeatureExtractorConfig.HOP_LENGTH """
+        return librosa.amplitude_to_db(self.magnitude(hop_length or self.config.HOP_LENGTH), ref=np.max)
+
+    def chromagram(self, hop_length: int = None) -> np.ndarray:
+        """ Creates the data for a chromagram; defaults to FeatureExtractorConfig.HOP_LENGTH """
+        return self.chroma_stft(hop_length or self.config.HOP_LENGTH)
+
+    def clear(self) -> None:
+        """ Releases the cached matrices """
+        self._magnitude, self._power, self._mel_power = {}, {}, {}
@@ -0,0 +1,301 @@
+# Name: streaming.py
+# Description: defines streaming feature extraction that decodes and transforms audio of any length a block at a time
+
+import audioread
+import librosa
+import logging
+import math
+import numpy as np
+import soundfile
+
+from genreml.model.processing.aggregation import RunningFeatureAggregator
+from genreml.model.processing.audio_features import LibrosaFeatureGenerator
+from genreml.model.processing.config import AudioConfig, FeatureExtractorConfig, StreamingConfig
+from genreml.model.processing.spectral import SpectralEngine
+from genreml.model.utils import file_handling
+
+
+def iter_native_blocks(file_location: str, block_duration: float = StreamingConfig.BLOCK_DURATION) -> tuple:
+    """ Decodes an audio file a block at a time at its own sample rate, mixed down to mono the way librosa.load does
+
+    :param string file_location: the path to an audio file
+    :param block_duration: roughly how many seconds of audio each block holds
+    :returns the sample rate of the file and an iterator over float32 blocks of its audio signal
+    """
+    try:
+        sample_rate = soundfile.info(file_location).samplerate
+    except RuntimeError:
+        # Formats libsndfile can't read fall back to the same decoder librosa.load uses for them
+        with audioread.audio_open(file_location) as audio_file:
+            sample_rate = audio_file.samplerate
+        return sample_rate, _iter_audioread_blocks(file_location, int(block_duration * sample_rate))
+    return sample_rate, _iter_soundfile_blocks(file_location, int(block_duration * sample_rate))
+
+
+def _iter_soundfile_blocks(file_location: str, block_size: int):
+    for block in soundfile.blocks(file_location, blocksize=block_size, dtype='float32', always_2d=True):
+        yield block.mean(axis=1, dtype=np.float32)
+
+
+def _iter_audioread_blocks(file_location: str, block_size: int):
+    with audioread.audio_open(file_location) as audio_file:
+        n_channels = audio_file.channels
+        pending, pending_size = [], 0
+        for buffer in audio_file:
+            samples = librosa.util.buf_to_float(buffer, dtype=np.float32).reshape(-1, n_channels)
+            pending.append(samples.mean(axis=1, dtype=np.float32))
+            pending_size += len(pending[-1])
+            if pending_size >= block_size:
+                yield np.concatenate(pending)
+                pending, pending_size = [], 0
+        if pending_size > 0:
+            yield np.concatenate(pending)
+
+
+def resample_blocks(signal_blocks, orig_sr: int, target_sr: int,
+                    block_duration: float = StreamingConfig.BLOCK_DURATION):
+    """ Resamples a stream of audio blocks without the seams resampling each block on its own would leave
+
+    Every block is resampled together with AudioConfig.DECODE_MARGIN seconds of the audio on each side of it and the
+    margins are trimmed off the result, so each sample comes out the same as it would from resampling the whole signal
+    at once. Blocks and margins are whole multiples of the samples that make up a whole number of output samples so
+    the trimmed blocks line up exactly.
+
+    :param signal_blocks: an iterator over blocks of an audio time-series
+    :param orig_sr: the sampling rate of the blocks
+    :param target_sr: the sampling rate to resample to
+    :param block_duration: roughly how many seconds of audio each resampled block holds
+    :returns an iterator over float32 blocks of the audio time-series at target_sr
+    """
+    divisor = math.gcd(orig_sr, target_sr)
+    input_step, output_step = orig_sr // divisor, target_sr // divisor
+    block_size = max(1, int(block_duration * orig_sr) // input_step) * input_step
+    margin = 0
+    if orig_sr != target_sr:
+        margin = int(math.ceil(AudioConfig.DECODE_MARGIN * orig_sr / input_step)) * input_step
+
+    def resample(segment, start):
+        # start is how far into the segment the samples to return begin; a multiple of input_step
+        if orig_sr != target_sr:
+            segment = librosa.resample(segment, orig_sr, target_sr)
+        return segment[start // input_step * output_step:].astype(np.float32)
+
+    buffer = np.empty(0, dtype=np.float32)
+    # The position of the first sample in the buffer and of the next sample to return within the whole signal
+    buffer_start, position = 0, 0
+    for block in signal_blocks:
+        buffer = np.concatenate((buffer, block))
+        while buffer_start + len(buffer) >= position + block_size + margin:
+            segment = buffer[:position + block_size + margin - buffer_start]
+            yield resample(segment, position - buffer_start)[:block_size // input_step * output_step]
+            position += block_size
+            dropped = max(0, position - margin - buffer_start)
+            buffer, buffer_start = buffer[dropped:], buffer_start + dropped
+    if buffer_start + len(buffer) > position:
+        yield resample(buffer, position - buffer_start)
+
+
+def stream_audio_signal(file_location: str, sample_rate: int = StreamingConfig.SAMPLE_RATE,
+                        block_duration: float = StreamingConfig.BLOCK_DURATION):
+    """ Decodes an audio file a block at a time at the given sample rate
+
+    :param string file_location: the path to an audio file
+    :param sample_rate: the sampling rate to stream the audio at
+    :param block_duration: roughly how many seconds of audio each block holds
+    :returns an iterator over float32 blocks of the audio time-series
+    """
+    native_sample_rate, native_blocks = iter_native_blocks(file_location, block_duration)
+    return resample_blocks(native_blocks, native_sample_rate, sample_rate, block_duration)
+
+
+def frame_signal_blocks(signal_blocks, frame_length: int, hop_length: int):
+    """ Regroups a stream of audio blocks into segments holding whole frames, padded the way centered STFT frames are
+
+    The start and the end of the signal are padded with frame_length // 2 reflected samples like librosa.stft pads
+    them and every segment starts where the frame after the last one of the previous segment starts, so framing the
+    segments one after the other without centering gives the frames of the whole padded signal.
+
+    :param signal_blocks: an iterator over blocks of an audio time-series
+    :param frame_length: the number of samples in each frame
+    :param hop_length: the number of samples between the starts of consecutive frames
+    :returns an iterator over (segment, samples of padding at its start, samples of padding at its end)
+    """
+    padding = frame_length // 2
+    buffer = np.empty(0, dtype=np.float32)
+    head_padding = None
+    signal_blocks = iter(signal_blocks)
+    block = next(signal_blocks, None)
+    while block is not None:
+        buffer = np.concatenate((buffer, block))
+        # Look a block ahead so the end of the signal is framed along with the last block instead of on its own
+        block = next(signal_blocks, None)
+        if head_padding is None:
+            if len(buffer) <= padding:
+                continue
+            buffer, head_padding = np.concatenate((buffer[padding:0:-1], buffer)), padding
+        tail_padding = 0
+        if block is None:
+            buffer, tail_padding = np.concatenate((buffer, buffer[-2:-padding - 2:-1])), padding
+        if len(buffer) < frame_length:
+            continue
+        n_frames = 1 + (len(buffer) - frame_length) // hop_length
+        segment_length = (n_frames - 1) * hop_length + frame_length
+        # Samples past the last whole frame are left for the next segment or left out at the end of the signal
+        yield buffer[:segment_length], head_padding, max(0, tail_padding - (len(buffer) - segment_length))
+        buffer, head_padding = buffer[n_frames * hop_length:], max(0, head_padding - n_frames * hop_length)
+    if head_padding is None:
+        raise ValueError("the audio signal needs more than {0} samples to be framed".format(padding))
+
+
+class BlockSpectralEngine(SpectralEngine):
+    """ A spectral engine for one segment of a stream which is framed as it is since it's already padded wherever it
+    holds the start or the end of the signal
+    """
+
+    def __init__(self, segment: np.ndarray, sample_rate, head_padding: int = 0, tail_padding: int = 0,
+                 config=FeatureExtractorConfig):
+        super().__init__(segment, sample_rate, config, center=False)
+        self.head_padding = head_padding
+        self.tail_padding = tail_padding
+
+    def zero_crossing_rate(self) -> np.ndarray:
+        # librosa pads the signal with its first and last samples for this feature instead of reflecting it
+        signal = self.audio_signal
+        if self.head_padding or self.tail_padding:
+            signal = signal.copy()
+            signal[:self.head_padding] = signal[self.head_padding]
+            if self.tail_padding:
+                signal[-self.tail_padding:] = signal[-self.tail_padding - 1]
+        return librosa.feature.zero_crossing_rate(
+            y=signal, frame_length=self.config.N_FFT, hop_length=self.config.FEATURE_HOP_LENGTH, center=False)
+
+
+def iter_windows(feature_blocks, sample_rate, window_length: float = AudioConfig.MIN_CLIP_LENGTH,
+                 hop_length: float = StreamingConfig.WINDOW_HOP, config=FeatureExtractorConfig):
+    """ Slides a window over consecutive blocks of frame-level features and melspectrogram data
+
+    Windows span as many frames as a clip of window_length seconds has, start every hop_length seconds and a last
+    window is lined up with the end of the signal when the others don't reach it. Only the frames that a window still
+    to come needs are kept.
+
+    :param feature_blocks: an iterator over (feature names to frame-level data, mel power) with frames at
+    FeatureExtractorConfig.FEATURE_HOP_LENGTH
+    :param sample_rate: the sampling rate of the audio the features were extracted from
+    :param window_length: the length of each window in seconds
+    :param hop_length: the number of seconds between the starts of consecutive windows
+    :param config: the configuration holding the STFT settings
+    :returns an iterator over (start of the window in seconds, feature names to frame-level data, mel power)
+    """
+    frame_hop = config.FEATURE_HOP_LENGTH
+    window_frames = 1 + int(sample_rate * window_length) // frame_hop
+    hop_frames = max(1, int(round(hop_length * sample_rate / frame_hop)))
+    features, mel_power = None, None
+    # The index of the first buffered frame within the whole signal and of the first frame of the next window
+    buffer_start, window_start, last_window_end = 0, 0, 0
+    for block_features, block_mel_power in feature_blocks:
+        if features is None:
+            features, mel_power = block_features, block_mel_power
+        else:
+            features = {feature: np.concatenate((data, block_features[feature]), axis=-1)
+                        for feature, data in features.items()}
+            mel_power = np.concatenate((mel_power, block_mel_power), axis=-1)
+        while buffer_start + mel_power.shape[-1] >= window_start + window_frames:
+            start = window_start - buffer_start
+            yield window_start * frame_hop / sample_rate, \
+                {feature: data[..., start:start + window_frames] for feature, data in features.items()}, \
+                mel_power[:, start:start + window_frames]
+            last_window_end = window_start + window_frames
+            window_start += hop_frames
+        # Keep the frames of the next window and enough before them to line a window up with the end of the signal
+        dropped = max(0, min(window_start, buffer_start + mel_power.shape[-1] - window_frames) - buffer_start)
+        features = {feature: data[..., dropped:] for feature, data in features.items()}
+        mel_power, buffer_start = mel_power[:, dropped:], buffer_start + dropped
+    if mel_power is None or buffer_start + mel_power.shape[-1] < window_frames:
+        raise ValueError("the audio signal is shorter than the window length of {0} seconds".format(window_length))
+    if last_window_end < buffer_start + mel_power.shape[-1]:
+        start = mel_power.shape[-1] - window_frames
+        yield (buffer_start + start) * frame_hop / sample_rate, \
+            {feature: data[..., start:] for feature, data in features.items()}, mel_power[:, start:]
+
+
+class StreamingFeatureExtractor(object):
+    """ Extracts the same features as LibrosaFeatureGenerator from audio that is decoded and transformed a block at a
+    time, so memory use stays the same no matter how long the audio is
+
+    Frames are computed with the STFT settings of FeatureExtractorConfig over the whole signal, so the frame-level
+    data of the blocks put together is that of the whole signal and so are rms, zcr and the spectral centroid,
+    bandwidth and rolloff. Chroma estimates its tuning and MFCC clips its decibels to 80 dB below the loudest bin of
+    each block instead of the whole signal, which one pass can't know ahead of time. Aggregates are kept running with
+    RunningFeatureAggregator.
+    """
+
+    def __init__(self, sample_rate: int = StreamingConfig.SAMPLE_RATE, features_to_exclude: set = None,
+                 config=FeatureExtractorConfig, block_duration: float = StreamingConfig.BLOCK_DURATION):
+        """ Instantiates a StreamingFeatureExtractor
+
+        :param sample_rate: the sampling rate audio files are streamed at
+        :param features_to_exclude: an optional set of feature names to exclude from the features generated
+        :param config: the configuration holding the features, aggregations and STFT settings
+        :param block_duration: roughly how many seconds of audio are decoded and transformed at a time
+        """
+        self.sample_rate = sample_rate
+        self.features_to_exclude = features_to_exclude or set()
+        self.config = config
+        self.block_duration = block_duration
+
+    def stream(self, file_location: str):
+        """ Decodes an audio file a block at a time at the extractor's sample rate; see stream_audio_signal """
+        return stream_audio_signal(file_location, self.sample_rate, self.block_duration)
+
+    def iter_feature_blocks(self, signal_blocks):
+        """ Extracts the frame-level features of a stream of audio blocks
+
+        :param signal_blocks: an iterator over blocks of an audio time-series at the extractor's sample rate
+        :returns an iterator over (feature names to frame-level data, spectral engine of the block) where the frames
+        of consecutive blocks follow each other
+        """
+        for segment, head_padding, tail_padding in frame_signal_blocks(
+                signal_blocks, self.config.N_FFT, self.config.FEATURE_HOP_LENGTH):
+            engine = BlockSpectralEngine(segment, self.sample_rate, head_padding, tail_padding, self.config)
+            features, _ = LibrosaFeatureGenerator(
+                segment, self.sample_rate, aggregate_features=False, features_to_exclude=self.features_to_exclude,
+                config=self.config, spectral_engine=engine).generate()
+            yield features, engine
+
+    def extract(self, signal_blocks) -> tuple:
+        """ Extracts and aggregates the features of a stream of audio blocks
+
+        :param signal_blocks: an iterator over blocks of an audio time-series at the extractor's sample rate
+        :returns a dictionary with the feature aggregations as keys and their results as values and a list of the
+            aggregation names in order, like LibrosaFeatureGenerator.generate
+        """
+        aggregator = None
+        for features, _ in self.iter_feature_blocks(signal_blocks):
+            if aggregator is None:
+                aggregator = RunningFeatureAggregator.from_feature_dict(features, self.config.FEATURE_AGGREGATION)
+            aggregator.update_features(features)
+        return dict(zip(aggregator.columns, aggregator.result())), aggregator.columns
+
+    def extract_file(self, file_location: str) -> tuple:
+        """ Streams an audio file and extracts its aggregated features; see extract
+
+        :param string file_location: the path to an audio file
+        :returns a dictionary of the feature aggregations along with the file name and a list of aggregation names
+        """
+        logging.info("streaming librosa features for {0}".format(file_location))
+        features, feature_names = self.extract(self.stream(file_location))
+        features['file_name'] = file_handling.get_filename(file_location)
+        return features, feature_names
+
+    def iter_windows(self, signal_blocks, window_length: float = AudioConfig.MIN_CLIP_LENGTH,
+                     hop_length: float = StreamingConfig.WINDOW_HOP):
+        """ Slides a window over the frame-level features and melspectrogram data of a stream; see iter_windows
+
+        :param signal_blocks: an iterator over blocks of an audio time-series at the extractor's sample rate
+        :param window_length: the length of each window in seconds
+        :param hop_length: the number of seconds between the starts of consecutive windows
+        :returns an iterator over (start of the window in seconds, feature names to frame-level data, mel power)
+        """
+        feature_blocks = (
+            (features, engine.mel_power()) for features, engine in self.iter_feature_blocks(signal_blocks))
+        return iter_windows(feature_blocks, self.sample_rate, window_length, hop_length, self.config)
@@ -24,7 +24,7 @@ setup(
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.7",
     ],
-    packages=find_packages(exclude=("test",)),
+    packages=find_packages(exclude=("test", "benchmarks", "benchmarks.*")),
     name='genreml',
     python_requires='>=3.5',
     package_data={
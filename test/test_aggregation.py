@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from genreml.model.processing.aggregation import FeatureAggregator, RunningFeatureAggregator
+
+
+def _get_test_features(seed: int = 0, n_frames: int = 50) -> dict:
+    random_state = np.random.RandomState(seed)
+    return {
+        'chroma_stft': random_state.rand(12, n_frames).astype(np.float32),
+        'rms': random_state.rand(1, n_frames).astype(np.float32),
+        'spec_cent': random_state.rand(1, n_frames) * 3000,
+        'mfcc': random_state.randn(3, n_frames).astype(np.float32)
+    }
+
+
+def test_aggregate_features():
+    """ Tests that genreml.model.processing.aggregation.FeatureAggregator matches aggregating features with numpy """
+    features = _get_test_features()
+    aggregator = FeatureAggregator.from_feature_dict(features)
+    expected = {}
+    for feature in ['chroma_stft', 'rms', 'spec_cent']:
+        for aggregation, aggregation_function in [('mean', np.mean), ('min', np.min), ('max', np.max), ('std', np.std)]:
+            expected['{0}-{1}'.format(feature, aggregation)] = aggregation_function(features[feature])
+    for row in range(3):
+        expected['mfcc{0}'.format(row)] = np.mean(features['mfcc'][row])
+    feature_vector = aggregator.aggregate_features(features)
+    assert aggregator.columns == list(expected) and feature_vector.dtype == np.float32
+    assert np.allclose(feature_vector, [expected[column] for column in aggregator.columns], rtol=1e-5)
+
+
+def test_aggregate_batch():
+    """ Tests genreml.model.processing.aggregation.FeatureAggregator aggregate method with a batch of clips """
+    aggregator = FeatureAggregator.from_feature_dict(_get_test_features())
+    stacked = [aggregator.stack(_get_test_features(seed)) for seed in range(4)]
+    batch_vectors = aggregator.aggregate(np.stack(stacked))
+    assert batch_vectors.shape == (4, len(aggregator.columns))
+    for clip_vector, clip_stacked in zip(batch_vectors, stacked):
+        assert np.allclose(clip_vector, aggregator.aggregate(clip_stacked))
+    with pytest.raises(ValueError):
+        aggregator.stack({**_get_test_features(), 'rms': np.zeros((1, 10))})
+    with pytest.raises(ValueError):
+        FeatureAggregator([('rms', 1)], ['median'])
+
+
+def test_running_aggregates():
+    """ Tests that genreml.model.processing.aggregation.RunningFeatureAggregator merges blocks into the aggregates of
+    all of their frames
+    """
+    features = _get_test_features(n_frames=200)
+    aggregator = RunningFeatureAggregator.from_feature_dict(features)
+    stacked = aggregator.stack(features)
+    for start, end in [(0, 7), (7, 120), (120, 121), (121, 200)]:
+        aggregator.update(stacked[:, start:end])
+    assert aggregator.n_frames == 200
+    assert np.allclose(aggregator.result(), FeatureAggregator.from_feature_dict(features).aggregate(stacked), rtol=1e-5)
+    with pytest.raises(ValueError):
+        RunningFeatureAggregator.from_feature_dict(features).result()
@@ -0,0 +1,35 @@
+import json
+
+from benchmarks import harness
+
+
+def test_summarize_timings():
+    """ Tests benchmarks.harness.summarize_timings method """
+    summary = harness.summarize_timings([0.001 * duration for duration in range(1, 101)], items_per_call=2)
+    assert summary['calls'] == 100
+    assert round(summary['p50_ms'], 2) == 50.5 and round(summary['p95_ms'], 2) == 95.05
+    assert round(summary['items_per_second'], 2) == round(200 / 5.05, 2)
+
+
+def test_benchmark_runner(tmp_path):
+    """ Tests benchmarks.harness.BenchmarkRunner measure and save methods """
+    runner = harness.BenchmarkRunner(repeat=3, warmup=1, stage_filter=["feature"])
+    calls = []
+    runner.measure("feature.test", lambda value: calls.append(value), setup_function=lambda: len(calls))
+    # Filtered out stages are never called
+    assert runner.measure("inference.test", lambda: calls.append(None)) is None
+    assert calls == [0, 1, 2, 3] and list(runner.results) == ["feature.test"]
+    results_path = str(tmp_path / "results.json")
+    runner.save(results_path)
+    with open(results_path) as results_file:
+        results = json.load(results_file)
+    assert results["stages"]["feature.test"]["calls"] == 3 and "metadata" in results
+
+
+def test_compare_results():
+    """ Tests benchmarks.harness.compare_results method """
+    baseline = {"stages": {"a": {"p50_ms": 10.0}, "b": {"p50_ms": 10.0}, "c": {"p50_ms": 1.0}}}
+    candidate = {"stages": {"a": {"p50_ms": 10.5}, "b": {"p50_ms": 12.0}, "d": {"p50_ms": 1.0}}}
+    comparison = harness.compare_results(baseline, candidate, threshold=0.1)
+    # Only stages in both runs are compared
+    assert [(stage, regression) for stage, _, _, _, regression in comparison] == [("a", False), ("b", True)]
@@ -0,0 +1,65 @@
+import shutil
+
+import numpy as np
+from tensorflow import keras
+
+from genreml.model.cnn import cnn, config as model_config
+from genreml.model.cnn.bundle import ModelBundle
+from genreml.model.cnn.session import InferenceSession
+
+
+def _save_test_model(path: str) -> None:
+    features = keras.Input(shape=(44,))
+    keras.Model(features, keras.layers.Dense(32, activation='sigmoid')(features)).save(path)
+
+
+def test_model_bundle(tmp_path):
+    """ Tests genreml.model.cnn.bundle.ModelBundle lazy loading and sharing """
+    model_path = str(tmp_path / 'model.h5')
+    _save_test_model(model_path)
+    bundle = ModelBundle.get(model_path=model_path)
+    # Bundles are shared per set of paths and nothing is read until it's needed
+    assert ModelBundle.get(model_path=model_path) is bundle
+    assert not bundle.is_loaded('model') and not bundle.is_loaded('scaler')
+    assert len(bundle.feature_cols) == 44 and len(bundle.labels) == 32
+    assert bundle.model is bundle.model
+    assert bundle.scaler.transform(np.zeros((2, 44))).shape == (2, 44)
+    # Models created from the same file reuse the loaded keras model
+    assert cnn.CnnModel.from_h5_file(model_path).model is bundle.model
+
+
+def test_model_bundle_content_hash(tmp_path):
+    """ Tests genreml.model.cnn.bundle.ModelBundle.content_hash and refresh methods """
+    model_path = str(tmp_path / 'model.h5')
+    labels_path = str(tmp_path / 'labels_key.csv')
+    _save_test_model(model_path)
+    shutil.copy(model_config.FMAModelConfig.LABELS_PATH, labels_path)
+    bundle = ModelBundle(model_path=model_path, labels_path=labels_path)
+    content_hash = bundle.content_hash
+    assert content_hash == ModelBundle(model_path=model_path, labels_path=labels_path).content_hash
+    assert bundle.refresh() is False
+    labels = bundle.labels
+    # Changing any artifact changes the hash and drops the cached data
+    with open(labels_path, 'a') as labels_file:
+        labels_file.write('99,32,New Genre\n')
+    assert bundle.refresh() is True
+    assert bundle.content_hash != content_hash
+    assert len(bundle.labels) == len(labels) + 1
+
+
+def test_inference_session(tmp_path):
+    """ Tests that genreml.model.cnn.session.InferenceSession matches model.predict and is shared through the bundle """
+    model_path = str(tmp_path / 'model.h5')
+    _save_test_model(model_path)
+    bundle = ModelBundle(model_path=model_path)
+    model = cnn.CnnModel.from_bundle(bundle)
+    assert model.session is bundle.session and bundle.session.model is bundle.model
+    features = np.random.RandomState(0).rand(5, 44)
+    assert np.allclose(bundle.session(features, batch_size=2), bundle.model.predict(features), atol=1e-6)
+    assert bundle.session(features[:0]).shape == (0, 32)
+    # Models created from a bundle pick up the model and session it reloads after a refresh
+    session = bundle.session
+    bundle.invalidate()
+    assert model.session is bundle.session and model.session is not session and model.model is bundle.model
+    session = InferenceSession(bundle.model, warm_up=False)
+    assert [spec.shape.as_list() for spec in session.input_signature] == [[None, 44]]
@@ -0,0 +1,89 @@
+import os
+import pickle
+import pkg_resources
+import shutil
+
+from genreml.model.processing import config
+from genreml.model.processing.audio import AudioFiles
+from genreml.model.processing.cache import FeatureCache, get_clip_policy, hash_bytes
+
+
+def test_make_key():
+    """ Tests genreml.model.processing.cache.FeatureCache.make_key method """
+    audio_hash = hash_bytes(b"audio")
+    key = FeatureCache.make_key(audio_hash, "features", clip_policy=get_clip_policy(), exclusion={"b", "a"})
+    # Keys only depend on their contents
+    assert key == FeatureCache.make_key(audio_hash, "features", clip_policy=get_clip_policy(), exclusion={"a", "b"})
+    assert key != FeatureCache.make_key(audio_hash, "images", clip_policy=get_clip_policy(), exclusion={"a", "b"})
+    assert key != FeatureCache.make_key(audio_hash, "features", clip_policy=get_clip_policy(num_clips=3),
+                                        exclusion={"a", "b"})
+    assert key != FeatureCache.make_key(audio_hash, "features", clip_policy=get_clip_policy(), model_hash="model",
+                                        exclusion={"a", "b"})
+    # Changing the feature extraction config invalidates every key
+    n_fft = config.FeatureExtractorConfig.N_FFT
+    try:
+        config.FeatureExtractorConfig.N_FFT = n_fft * 2
+        assert key != FeatureCache.make_key(
+            audio_hash, "features", clip_policy=get_clip_policy(), exclusion={"a", "b"})
+    finally:
+        config.FeatureExtractorConfig.N_FFT = n_fft
+
+
+def test_feature_cache(tmp_path):
+    """ Tests genreml.model.processing.cache.FeatureCache get, put and eviction methods """
+    cache = FeatureCache(str(tmp_path), max_disk_bytes=10 ** 6, max_memory_entries=1)
+    assert cache.get("missing") is None and cache.get("missing", 1) == 1
+    cache.put("a" * 64, {"feature": 1.0})
+    cache.put("b" * 64, {"feature": 2.0})
+    # Only the last entry is kept in memory but both are on disk
+    assert list(cache._memory) == ["b" * 64]
+    assert cache.get("a" * 64) == {"feature": 1.0}
+    assert FeatureCache(str(tmp_path)).get("b" * 64) == {"feature": 2.0}
+    assert cache.get_or_compute("c" * 64, lambda: 3) == 3
+    assert cache.get_or_compute("c" * 64, lambda: 4) == 3
+    # Copies sent to other processes share the disk store
+    assert pickle.loads(pickle.dumps(cache)).get("a" * 64) == {"feature": 1.0}
+    # Overwriting an entry only counts its new size towards the store
+    for _ in range(3):
+        cache.put("a" * 64, {"feature": 1.0})
+    assert cache._disk_usage == cache._get_disk_entries_size()
+    # Least recently used entries are evicted first once the store is full
+    small_cache = FeatureCache(str(tmp_path / "small"), max_disk_bytes=2500, max_memory_entries=0)
+    small_cache.put("d" * 64, b"0" * 1000)
+    os.utime(small_cache._get_entry_path("d" * 64), (0, 0))
+    small_cache.put("e" * 64, b"1" * 1000)
+    small_cache.put("f" * 64, b"2" * 1000)
+    assert small_cache.get("d" * 64) is None
+    assert small_cache.get("e" * 64) == b"1" * 1000 and small_cache.get("f" * 64) == b"2" * 1000
+    small_cache.clear()
+    assert small_cache.get("e" * 64) is None
+
+
+def test_extract_features_cache(tmp_path):
+    """ Tests genreml.model.processing.audio.AudioFiles.extract_features method with a FeatureCache """
+    sample_data_path = pkg_resources.resource_filename('genreml', 'fma_data/')
+    sample_file = sorted(os.listdir(sample_data_path))[0]
+    audio_path = str(tmp_path / sample_file)
+    shutil.copy(os.path.join(sample_data_path, sample_file), audio_path)
+    cache = FeatureCache(str(tmp_path / "cache"))
+    features_to_exclude = {"waveplot", "chromagram", "spectrogram"}
+    audio_files_processor = AudioFiles()
+    audio_files_processor.extract_features(
+        audio_path, destination_filepath=str(tmp_path), features_to_exclude=features_to_exclude, cache=cache)
+    assert len(audio_files_processor) == 1
+    image_path = audio_files_processor.visual_paths[0][0]
+    with open(image_path, 'rb') as image_file:
+        image = image_file.read()
+    os.remove(image_path)
+    # The same content under another name is restored from the cache without loading the file
+    copy_path = str(tmp_path / "copy.mp3")
+    shutil.copy(audio_path, copy_path)
+    cached_processor = AudioFiles()
+    cached_processor.extract_features(
+        copy_path, destination_filepath=str(tmp_path), features_to_exclude=features_to_exclude, cache=cache)
+    assert len(cached_processor) == 0
+    assert cached_processor.features_saved[0]["file_name"] == "copy.mp3"
+    assert {key: value for key, value in cached_processor.features_saved[0].items() if key != "file_name"} == \
+        {key: value for key, value in audio_files_processor.features_saved[0].items() if key != "file_name"}
+    with open(cached_processor.visual_paths[0][0], 'rb') as image_file:
+        assert image_file.read() == image
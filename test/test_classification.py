@@ -1,6 +1,7 @@
 import pkg_resources
 from genreml.model.acquisition import extraction
 from genreml.model.cnn import cnn, config as model_config
+from genreml.model.processing import audio
 from genreml.model.utils import model_utils, file_handling
 
 
@@ -27,3 +28,37 @@ def test_youtube_classification():
     file_handling.delete_dir_contents(model_config.FMAModelConfig.FEATURES_PATH)
     file_handling.delete_file(audio_path)
     assert (len(prediction) == 32)
+
+
+def test_signal_classification():
+    if not file_handling.file_exists(model_config.FMAModelConfig.FMA_MODEL_PATH):
+        model_utils.download_model()
+    audio_path = pkg_resources.resource_filename('genreml', 'fma_data/000002.mp3')
+    audio_signal, sample_rate = audio.AudioCollection.load_audio_signal(audio_path)
+    model = cnn.CnnModel.from_h5_file(model_config.FMAModelConfig.FMA_MODEL_PATH)
+    prediction = model.predict_signal(audio_signal, sample_rate, clip=False)
+    assert (len(prediction) == 32)
+
+
+def test_batch_classification():
+    if not file_handling.file_exists(model_config.FMAModelConfig.FMA_MODEL_PATH):
+        model_utils.download_model()
+    audio_path = pkg_resources.resource_filename('genreml', 'fma_data/000002.mp3')
+    audio_signal, sample_rate = audio.AudioCollection.load_audio_signal(audio_path)
+    model = cnn.CnnModel.from_h5_file(model_config.FMAModelConfig.FMA_MODEL_PATH)
+    clip_predictions, track_predictions = model.predict_batch(
+        [audio_signal, audio_signal, audio_signal], sample_rate, track_ids=['a', 'a', 'b'], batch_size=2)
+    assert clip_predictions.shape == (3, 32)
+    assert list(track_predictions.keys()) == ['a', 'b']
+    assert (len(track_predictions['a']) == 32)
+
+
+def test_timeline_classification():
+    if not file_handling.file_exists(model_config.FMAModelConfig.FMA_MODEL_PATH):
+        model_utils.download_model()
+    audio_path = pkg_resources.resource_filename('genreml', 'fma_data/000002.mp3')
+    model = cnn.CnnModel.from_h5_file(model_config.FMAModelConfig.FMA_MODEL_PATH)
+    window_starts, window_predictions, track_prediction = model.get_timeline(
+        audio_path, window_length=10, hop_length=5, batch_size=2)
+    assert window_predictions.shape == (len(window_starts), 32) and len(window_starts) > 1
+    assert (len(track_prediction) == 32)
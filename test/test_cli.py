@@ -15,6 +15,8 @@ class MockArgs(object):
     destination_path = None
     youtube_url = None
     model_path = None
+    timeline = False
+    window_hop = 15
 
 
 def test_validate_args():
@@ -61,6 +63,12 @@ def test_validate_args():
     mock_args.youtube_url = 'some_url'
     mock_args.model_path = 'some_path'
     __main__.validate_args(mock_args)
+    mock_args.timeline = True
+    __main__.validate_args(mock_args)
+    mock_args.window_hop = 0
+    with pytest.raises(RuntimeError):
+        __main__.validate_args(mock_args)
+    mock_args.timeline = False
     # Missing required classify attributes
     mock_args.example = False
     mock_args.file_path = False
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+import pytest
+
+from genreml.model.processing.display import VisualDataMixin, RasterImage
+
+
+def test_rasterize_data():
+    """ Tests genreml.model.processing.display.VisualDataMixin.rasterize_data method """
+    visual_data = np.arange(128 * 625, dtype=np.float32).reshape(128, 625)
+    raster = VisualDataMixin.display_data(
+        visual_data, cmap="Greys", figure_width=3.35, figure_height=2.0, backend="raster")
+    assert isinstance(raster, RasterImage)
+    pixels = raster.to_array()
+    # Pixel size should be figure size * DisplayConfig.DPI just like a matplotlib figure
+    assert pixels.shape == (200, 335)
+    # Greys maps low values to white and high values to black
+    assert pixels[0, 0] > pixels[-1, -1]
+    # Unsupported backends are rejected
+    with pytest.raises(ValueError):
+        VisualDataMixin.display_data(visual_data, backend="some_backend")
+
+
+def test_raster_savefig():
+    """ Tests genreml.model.processing.display.RasterImage.savefig method """
+    raster = VisualDataMixin.rasterize_data(np.zeros((10, 10)), figure_width=0.5, figure_height=0.5)
+    path = './test_raster' + str(os.getpid())
+    raster.savefig(path)
+    assert os.path.isfile(path + ".png")
+    os.remove(path + ".png")
+    assert raster.to_buffer().read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_to_grayscale_pixels():
+    """ Tests genreml.model.processing.display.VisualDataMixin.to_grayscale_pixels method """
+    visual_data = np.tile(np.linspace(0, 1, 625), (128, 1))
+    pixels = VisualDataMixin.to_grayscale_pixels(visual_data, 200, 335, cmap="Greys")
+    assert pixels.shape == (200, 335) and pixels.dtype == np.uint8
+    # The resized gradient should go from white to black across the columns just like the raster image
+    raster_pixels = VisualDataMixin.rasterize_data(
+        visual_data, cmap="Greys", figure_width=3.35, figure_height=2.0).to_array().astype(np.float64)
+    assert np.mean(np.abs(pixels - raster_pixels)) < 2
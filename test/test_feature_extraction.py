@@ -1,8 +1,13 @@
 import glob
+import numpy as np
 import os
 import pkg_resources
+import pytest
+import shutil
+import soundfile
 
-from genreml.model.processing.audio import AudioFiles, AudioData
+from genreml.model.processing import config
+from genreml.model.processing.audio import AudioCollection, AudioFiles, AudioData
 
 
 def test_extract_features():
@@ -72,3 +77,63 @@ def test_feature_checkpointing():
     audio_files_processor._checkpoint_feature_extraction("")
     assert len(audio_files_processor.features_saved) == previous_feature_length
     assert len(audio_files_processor.features) == 0
+
+
+def test_split_audio_signal():
+    """ Tests genreml.model.processing.audio.AudioCollection.split_audio_signal method """
+    sample_rate = 100
+    audio_signal = np.arange(100 * sample_rate)
+    clips = AudioCollection.split_audio_signal(audio_signal, sample_rate, 29, 3)
+    assert len(clips) == 3
+    assert all(len(clip) == 29 * sample_rate for clip in clips)
+    # The clips should be consecutive and centered on the middle of the signal
+    assert clips[0][-1] + 1 == clips[1][0] and clips[1][-1] + 1 == clips[2][0]
+    assert clips[1][0] == 50 * sample_rate - int(29 * sample_rate / 2)
+    # Signals too short for every clip only keep their middle clip
+    assert len(AudioCollection.split_audio_signal(audio_signal[:80 * sample_rate], sample_rate, 29, 3)) == 1
+
+
+def test_parallel_feature_extraction(tmp_path):
+    """ Tests genreml.model.processing.audio.AudioFiles.extract_features method with multiple workers """
+    sample_data_path = pkg_resources.resource_filename('genreml', 'fma_data/')
+    sample_files = sorted(os.listdir(sample_data_path))[:3]
+    for sample_file in sample_files:
+        shutil.copy(os.path.join(sample_data_path, sample_file), tmp_path)
+    # A file that can't be decoded should only fail by itself
+    with open(os.path.join(tmp_path, "broken.mp3"), "w") as broken_file:
+        broken_file.write("not audio")
+    audio_files_processor = AudioFiles()
+    checkpoint_frequency = config.AudioConfig.CHECKPOINT_FREQUENCY
+    try:
+        # Settings can reach the config as strings, like -cf did before it was parsed as an int
+        config.AudioConfig.CHECKPOINT_FREQUENCY = "2"
+        audio_files_processor.extract_features(
+            str(tmp_path), destination_filepath=str(tmp_path), features_to_exclude={"waveplot", "chromagram"},
+            workers=2)
+    finally:
+        config.AudioConfig.CHECKPOINT_FREQUENCY = checkpoint_frequency
+    assert sorted(features["file_name"] for features in audio_files_processor.features_saved) == sample_files
+    assert len(audio_files_processor.visual_features) == len(audio_files_processor.visual_paths) == len(sample_files)
+    assert len(glob.glob(os.path.join(tmp_path, "features", "melspectrogram*"))) == len(sample_files)
+    assert len(glob.glob(os.path.join(tmp_path, "features", "feature_data_*.csv"))) == 1
+    # Loaded audio stays in the worker processes
+    assert len(audio_files_processor) == 0
+
+
+def test_load_audio_signal(tmp_path):
+    """ Tests that genreml.model.processing.audio.AudioCollection.load_audio_signal and load_audio_clips only decode
+    the clips they return and match clipping the fully decoded file
+    """
+    sample_rate = 22050
+    audio_signal = np.random.RandomState(0).uniform(-0.5, 0.5, sample_rate * 100).astype(np.float32)
+    audio_path = str(tmp_path / "long.wav")
+    soundfile.write(audio_path, audio_signal, sample_rate, subtype="FLOAT")
+    assert AudioCollection.probe_duration(audio_path) == 100
+    clip, clip_sample_rate = AudioCollection.load_audio_signal(audio_path, 29)
+    assert clip_sample_rate == sample_rate
+    assert np.allclose(clip, AudioCollection.clip_audio_signal(audio_signal, sample_rate, 29))
+    clips, _ = AudioCollection.load_audio_clips(audio_path, 29, 3)
+    expected_clips = AudioCollection.split_audio_signal(audio_signal, sample_rate, 29, 3)
+    assert len(clips) == 3 and all(np.allclose(clip, expected) for clip, expected in zip(clips, expected_clips))
+    with pytest.raises(ValueError):
+        AudioCollection.load_audio_signal(audio_path, 101)
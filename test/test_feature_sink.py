@@ -0,0 +1,73 @@
+import logging
+import numpy as np
+import os
+import pytest
+
+from genreml.model.processing import config
+from genreml.model.processing.audio import AudioFiles
+from genreml.model.processing.feature_sink import CsvFeatureSink, NpzFeatureSink, get_feature_sink, read_features
+
+
+def _get_features(count: int) -> list:
+    return [{"feature_a": idx * 0.5, "file_name": "{0}.mp3".format(idx), "feature_b": idx} for idx in range(count)]
+
+
+@pytest.mark.parametrize("sink_class", [CsvFeatureSink, NpzFeatureSink])
+def test_feature_sink(tmp_path, sink_class):
+    """ Tests genreml.model.processing.feature_sink.FeatureSink add, flush and read_features methods """
+    destination_filepath = str(tmp_path) + "/"
+    sink = sink_class(destination_filepath, initial_capacity=2)
+    features = _get_features(5)
+    # The buffers grow past their initial capacity and keep it after a flush
+    sink.add_rows(features[:3])
+    assert sink.flush() == 3 and sink.row_count == 0
+    sink.add_rows(features[3:])
+    sink.close()
+    assert sink.rows_written == len(features)
+    df = read_features(destination_filepath, sink.extension)
+    assert list(df.columns) == ["feature_a", "file_name", "feature_b"]
+    assert list(df["file_name"]) == [feature_dict["file_name"] for feature_dict in features]
+    assert np.allclose(df["feature_a"], [feature_dict["feature_a"] for feature_dict in features])
+
+
+def test_feature_sink_missing_and_new_features(tmp_path, caplog):
+    """ Tests genreml.model.processing.feature_sink.FeatureSink add method with rows that differ from the first one """
+    destination_filepath = str(tmp_path) + "/"
+    sink = NpzFeatureSink(destination_filepath)
+    features = _get_features(3)
+    features[1]["file_name"] = None
+    features[2]["feature_c"] = 1.0
+    with caplog.at_level(logging.WARNING):
+        sink.add_rows(features)
+    assert "feature_c" in caplog.text
+    sink.close()
+    df = read_features(destination_filepath, sink.extension)
+    # Missing text features are read back as None rather than the string 'None'
+    assert list(df["file_name"]) == ["0.mp3", None, "2.mp3"]
+    assert "feature_c" not in df.columns
+
+
+def test_get_feature_sink():
+    """ Tests genreml.model.processing.feature_sink.get_feature_sink method """
+    assert isinstance(get_feature_sink(""), CsvFeatureSink)
+    assert isinstance(get_feature_sink("", "npz"), NpzFeatureSink)
+    with pytest.raises(ValueError):
+        get_feature_sink("", "xlsx")
+
+
+def test_feature_checkpointing_format(tmp_path):
+    """ Tests genreml.model.processing.audio.AudioFiles._checkpoint_feature_extraction method with a columnar format """
+    destination_filepath = str(tmp_path) + "/"
+    feature_format = config.AudioConfig.FEATURE_FORMAT
+    try:
+        config.AudioConfig.FEATURE_FORMAT = "npz"
+        audio_files_processor = AudioFiles()
+        for features in (_get_features(2), _get_features(3)):
+            audio_files_processor.features = features
+            audio_files_processor._checkpoint_feature_extraction(destination_filepath)
+        audio_files_processor._close_feature_sink()
+    finally:
+        config.AudioConfig.FEATURE_FORMAT = feature_format
+    # Every checkpoint is its own shard and the shards are read back as one table
+    assert len([path for path in os.listdir(destination_filepath) if path.endswith(".npz")]) == 2
+    assert len(read_features(destination_filepath)) == 5
@@ -0,0 +1,34 @@
+import io
+
+import numpy as np
+import pytest
+import soundfile
+
+from genreml.model.processing.pcm import PCM_HEADER, decode_pcm, encode_pcm, is_pcm
+
+
+def test_encode_decode_pcm():
+    """ Tests genreml.model.processing.pcm.encode_pcm and decode_pcm methods """
+    audio_signal = np.sin(np.linspace(0, 100, 22050)).astype(np.float32) * 0.9
+    encoded = encode_pcm(audio_signal, 22050, "float32")
+    assert is_pcm(encoded) and len(encoded) == PCM_HEADER.size + 4 * len(audio_signal)
+    decoded_signal, sample_rate = decode_pcm(encoded)
+    assert sample_rate == 22050 and np.array_equal(decoded_signal, audio_signal)
+    # int16 clips decode to the same samples libsndfile reads from a 16 bit WAV file of the clip
+    encoded = encode_pcm(audio_signal, 22050)
+    assert len(encoded) == PCM_HEADER.size + 2 * len(audio_signal)
+    wav_file = io.BytesIO()
+    soundfile.write(wav_file, np.int16(audio_signal * 32767), 22050, format="WAV", subtype="PCM_16")
+    wav_file.seek(0)
+    decoded_signal, _ = decode_pcm(encoded)
+    assert decoded_signal.dtype == np.float32
+    assert np.array_equal(decoded_signal, soundfile.read(wav_file, dtype="float32")[0])
+
+
+def test_decode_pcm_errors():
+    """ Tests genreml.model.processing.pcm.decode_pcm method with data that isn't an encoded clip """
+    assert not is_pcm(b"RIFF0000WAVE")
+    with pytest.raises(ValueError):
+        decode_pcm(b"RIFF0000WAVEfmt ")
+    with pytest.raises(ValueError):
+        encode_pcm(np.zeros(10), 22050, "float64")
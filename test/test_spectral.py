@@ -0,0 +1,50 @@
+import librosa
+import numpy as np
+
+from genreml.model.processing.config import FeatureExtractorConfig
+from genreml.model.processing.spectral import SpectralEngine
+
+
+def _get_test_signal(sample_rate: int = 22050, seconds: int = 5) -> np.ndarray:
+    time = np.arange(sample_rate * seconds) / sample_rate
+    return (np.sin(2 * np.pi * 440 * time) + 0.5 * np.sin(2 * np.pi * 1250 * time)).astype(np.float32)
+
+
+def test_spectral_features():
+    """ Tests that genreml.model.processing.spectral.SpectralEngine features match librosa's own computation """
+    sample_rate = 22050
+    audio_signal = _get_test_signal(sample_rate)
+    engine = SpectralEngine(audio_signal, sample_rate)
+    assert np.allclose(engine.chroma_stft(), librosa.feature.chroma_stft(y=audio_signal, sr=sample_rate))
+    assert np.allclose(engine.spectral_centroid(), librosa.feature.spectral_centroid(y=audio_signal, sr=sample_rate))
+    assert np.allclose(engine.spectral_rolloff(), librosa.feature.spectral_rolloff(y=audio_signal, sr=sample_rate))
+    assert np.allclose(
+        engine.mfcc(), librosa.feature.mfcc(y=audio_signal, sr=sample_rate, n_mfcc=engine.config.NUMBER_OF_MFCC_COLS))
+
+
+def test_spectrograms_share_stft():
+    """ Tests that genreml.model.processing.spectral.SpectralEngine slices image spectrograms from the feature STFT """
+    sample_rate = 22050
+    audio_signal = _get_test_signal(sample_rate)
+    engine = SpectralEngine(audio_signal, sample_rate)
+    mel_spect = librosa.feature.melspectrogram(
+        y=audio_signal, sr=sample_rate,
+        n_fft=FeatureExtractorConfig.N_FFT, hop_length=FeatureExtractorConfig.HOP_LENGTH)
+    assert np.allclose(engine.db_melspectrogram(), librosa.power_to_db(mel_spect))
+    # Only the base STFT should have been computed
+    assert engine.magnitude(FeatureExtractorConfig.HOP_LENGTH).base is engine.magnitude()
+
+
+def test_image_only_engine():
+    """ Tests that genreml.model.processing.spectral.SpectralEngine computes a single STFT at the base hop length it
+    was given and derives every image spectrogram from it
+    """
+    sample_rate = 22050
+    audio_signal = _get_test_signal(sample_rate)
+    engine = SpectralEngine(audio_signal, sample_rate, base_hop_length=FeatureExtractorConfig.HOP_LENGTH)
+    db_spect = librosa.amplitude_to_db(np.abs(librosa.stft(
+        y=audio_signal, n_fft=FeatureExtractorConfig.N_FFT, hop_length=FeatureExtractorConfig.HOP_LENGTH)), ref=np.max)
+    assert np.allclose(engine.db_spectrogram(), db_spect)
+    engine.db_melspectrogram()
+    engine.chromagram()
+    assert list(engine._magnitude) == [FeatureExtractorConfig.HOP_LENGTH]
@@ -0,0 +1,49 @@
+import librosa
+import numpy as np
+import pytest
+
+from genreml.model.processing import streaming
+from genreml.model.processing.audio_features import LibrosaFeatureGenerator
+
+
+def _get_test_signal(sample_rate: int = 22050, seconds: float = 12.3) -> np.ndarray:
+    random_state = np.random.RandomState(0)
+    time = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (np.sin(2 * np.pi * 440 * time) + 0.5 * np.sin(2 * np.pi * 1250 * time) +
+            0.1 * random_state.randn(len(time))).astype(np.float32)
+
+
+def _split_signal(audio_signal: np.ndarray, block_size: int) -> list:
+    return [audio_signal[start:start + block_size] for start in range(0, len(audio_signal), block_size)]
+
+
+def test_streamed_features():
+    """ Tests that genreml.model.processing.streaming.StreamingFeatureExtractor extracts the frames and aggregates of
+    the whole signal from its blocks
+    """
+    sample_rate = 22050
+    audio_signal = _get_test_signal(sample_rate)
+    expected, _ = LibrosaFeatureGenerator(audio_signal, sample_rate, aggregate_features=False).generate()
+    extractor = streaming.StreamingFeatureExtractor(sample_rate)
+    blocks = [features for features, _ in extractor.iter_feature_blocks(_split_signal(audio_signal, 3 * sample_rate))]
+    assert len(blocks) > 1
+    for feature in ['rms', 'zcr', 'spec_cent', 'spec_bw', 'spec_rolloff']:
+        assert np.array_equal(np.concatenate([block[feature] for block in blocks], axis=-1), expected[feature])
+    expected_aggregates, expected_names = LibrosaFeatureGenerator(audio_signal, sample_rate).generate()
+    aggregates, names = extractor.extract(_split_signal(audio_signal, 3 * sample_rate))
+    assert names == expected_names
+    assert np.allclose([aggregates[name] for name in names], [expected_aggregates[name] for name in names], rtol=1e-3)
+    with pytest.raises(ValueError):
+        extractor.extract([audio_signal[:100]])
+
+
+def test_stream_resampling_and_windows():
+    """ Tests that genreml.model.processing.streaming resamples blocks seamlessly and slides windows to the end """
+    audio_signal = _get_test_signal(44100, seconds=6.1)
+    resampled = np.concatenate(list(streaming.resample_blocks(_split_signal(audio_signal, 30000), 44100, 22050, 1)))
+    assert np.allclose(resampled, librosa.resample(audio_signal, 44100, 22050), atol=1e-6)
+    extractor = streaming.StreamingFeatureExtractor(22050)
+    windows = list(extractor.iter_windows(_split_signal(resampled, 22050), window_length=2, hop_length=1.5))
+    assert [round(start, 1) for start, _, _ in windows] == [0.0, 1.5, 3.0, 4.1]
+    for _, features, mel_power in windows:
+        assert features['mfcc'].shape[-1] == mel_power.shape[-1] == 1 + 2 * 22050 // 512